@@ -54,11 +54,7 @@ flags_full = (hebbian_flag, three_factor_flag, adaptive_set_point_flag,
 
 flags_list = [flags_full] #this is a list of tuples. You can add multiple tuples and run multiple conditions
 
-analyze_model(4,  flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure2_3/",
-              run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag)
-analyze_model(24, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure2_3/",
-              run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag)
-analyze_model(48, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure2_3/",
+analyze_model([4, 24, 48], flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure2_3/",
               run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag)
 
 ### Plotting Figure 4b
@@ -95,11 +91,7 @@ directory = get_data_directory(modulation_SST)
 os.chdir(directory)
 
 
-analyze_model(4,  flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
-              run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag,modulation_SST=modulation_SST)
-analyze_model(24, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
-              run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag,modulation_SST=modulation_SST)
-analyze_model(48, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
+analyze_model([4, 24, 48], flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
               run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag,modulation_SST=modulation_SST)
 plot_testing_at_regular_intervals(flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
                                   run_simulation=run_flag_cont, save_results =1, plot_results=plot_flag,modulation_SST=modulation_SST)
@@ -109,11 +101,7 @@ directory = get_data_directory(modulation_SST)
 os.chdir(directory)
 
 
-analyze_model(4,  flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
-              run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag,modulation_SST=modulation_SST)
-analyze_model(24, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
-              run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag,modulation_SST=modulation_SST)
-analyze_model(48, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
+analyze_model([4, 24, 48], flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
               run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag,modulation_SST=modulation_SST)
 plot_testing_at_regular_intervals(flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure6/",
                                   run_simulation=run_flag_cont, save_results =1, plot_results=plot_flag,modulation_SST=modulation_SST)
@@ -197,12 +185,8 @@ flags_list = [flags_full,flags_E_off,flags_P_off,flags_S_off] #this is a list of
 # flags_list = [flags_E_off] #this is a list of tuples. You can add multiple tuples and run multiple conditions
 
 
-analyze_model_3_compartmental_v3(4,  flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure8/", modulation_SST=modulation_SST,
-              run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag)
-analyze_model_3_compartmental_v3(24, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure8/", modulation_SST=modulation_SST,
+analyze_model_3_compartmental_v3([4, 24, 48], flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure8/", modulation_SST=modulation_SST,
               run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag)
-analyze_model_3_compartmental_v3(48, flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure8/",modulation_SST=modulation_SST,
-             run_simulation=run_flag_discrete, save_results=1, plot_results=plot_flag)
 plot_testing_at_regular_intervals_dendrites_v3(flags_list, dir_data = dir_data, dir_plot = dir_plot + "figure8/",modulation_SST=modulation_SST,
                                    run_simulation=run_flag_cont, save_results =1, plot_results=plot_flag)
 
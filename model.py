@@ -1,15 +1,250 @@
 
 
 import numpy as np
-from numba import jit
-from util import *
-
+from numba import jit, prange
+from numba.extending import overload
+
+# The kernels are compiled with nogil, they release the GIL while they run, thus simulations in several threads of one
+# process run in parallel (see run_threads() in simulation.py).
+
+
+# Layout of the state vector of model(). The state vector holds everything that the loop of the numerical iterations
+# carries from one time step to the next (rates, plastic weights, set points and their regulators, learning rate, the
+# active stimuli and flags, the number of stimuli applied and the data-holder counters). A simulation can therefore be
+# stopped at any time step and continued later, or forked into several continuations, with model_from_state().
+(ST_E1, ST_E2, ST_P1, ST_P2, ST_S1, ST_S2,
+ ST_EE11, ST_EE12, ST_EE21, ST_EE22,
+ ST_EP11, ST_EP12, ST_EP21, ST_EP22,
+ ST_ES11, ST_ES12, ST_ES21, ST_ES22,
+ ST_THETA1, ST_THETA2, ST_BETA1, ST_BETA2,
+ ST_LEARNING_RATE, ST_R_BASELINE,
+ ST_STIM_E1, ST_STIM_E2, ST_STIM_P1, ST_STIM_P2, ST_STIM_S1, ST_STIM_S2,
+ ST_HEBBIAN, ST_THREE_FACTOR, ST_ADAPTIVE_SET_POINT, ST_E_SCALING, ST_P_SCALING, ST_S_SCALING,
+ ST_THETA_SHIFT, ST_THETA_LOCAL,
+ ST_STIM_APPLIED, ST_STIM_INDEX,
+ ST_PHASE1, ST_PHASE3, ST_COUNTER1, ST_COUNTER2, ST_COUNTER3, ST_I1, ST_I2, ST_I3,
+ ST_MAX_E, ST_STEP,
+ ST_EXIT_REASON, ST_N_CLAMPS, ST_RK_ACCEPTED, ST_RK_REJECTED,
+ ST_CONVERGED_STEP, ST_REFERENCE_I2) = range(56)
+# Followed by the plastic weights, set points and regulators of the last check of the convergence of phase 2, in the
+# order of ST_EE11 to ST_BETA2 (see check_convergence())
+ST_REFERENCE = 56
+N_STATE = 72
+
+# Reasons a simulation stopped (state[ST_EXIT_REASON], see exit_status()): it reached the time step it was run until,
+# the rates exploded (E1 above 1000) or the network fell silent (E1 at zero)
+EXIT_STEP_STOP, EXIT_EXPLODED, EXIT_SILENT = range(3)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def initial_state(weights):
+    (w_EEii, w_EPii, w_ESii, w_PEii, w_PPii, w_PSii, w_SEii,
+     w_EEij, w_EPij, w_ESij, w_PEij, w_PPij, w_PSij, w_SEij) = weights
 
-@jit(nopython=True) # ensures that the function is compiled without using the Python interpreter ("nopython" mode). If Numba encounters any code that cannot be translated to machine code, it will raise an error.
+    state = np.zeros(N_STATE)
+
+    # The initial rates are arbitrarily set to 1
+    state[ST_E1:ST_S2 + 1] = 1
+    state[ST_EE11] = w_EEii; state[ST_EE12] = w_EEij; state[ST_EE21] = w_EEij; state[ST_EE22] = w_EEii
+    state[ST_EP11] = w_EPii; state[ST_EP12] = w_EPij; state[ST_EP21] = w_EPij; state[ST_EP22] = w_EPii
+    state[ST_ES11] = w_ESii; state[ST_ES12] = w_ESij; state[ST_ES21] = w_ESij; state[ST_ES22] = w_ESii
+    state[ST_THETA1:ST_BETA2 + 1] = 1
+    state[ST_LEARNING_RATE] = 1
+
+    return state
+
+
+# Returns the status of the simulation held in state: the reason it stopped (EXIT_*), the time step reached, the
+# simulated time in seconds (including the 2 seconds before t=0 of stim_times), the number of activations of the
+# lower boundaries of the rates, set points and weights in the Euler steps and the numbers of accepted and rejected
+# steps of the adaptive Runge-Kutta integration (see model_rk_from_state(), zero for the other integrators). The data
+# arrays of a simulation that didn't reach its last time step hold fill_value after it, which exit_reason tells apart
+# from the data.
+@jit(nopython=True, nogil=True, cache=True)
+def exit_status(state, delta_t):
+    return (int(state[ST_EXIT_REASON]), int(state[ST_STEP]), state[ST_STEP] * delta_t, int(state[ST_N_CLAMPS]),
+            int(state[ST_RK_ACCEPTED]), int(state[ST_RK_REJECTED]))
+
+
+# Time steps of the events of the protocol for the stimuli in stim_times: the onset and offset of every stimulus
+# (stim_steps, one row per stimulus) and the start and end of the data registration windows of phase 1 and phase 3
+# (phase_steps). The simulation loops only check for events at these time steps and at the data registrations.
+@jit(nopython=True, nogil=True, cache=True)
+def event_steps(delta_t, stim_times):
+    stim_steps = np.empty(stim_times.shape, dtype=np.int64)
+    for i in range(stim_times.shape[0]):
+        stim_steps[i, 0] = int((stim_times[i][0] + 2) * (1 / delta_t))
+        stim_steps[i, 1] = int((stim_times[i][1] + 2) * (1 / delta_t))
+    phase_steps = (int(2*(1/delta_t)), int((stim_times[0][1] + 5 + 2) * (1 / delta_t)),
+                   int((stim_times[1][0] - 5 + 2) * (1 / delta_t)), int((stim_times[1][1] + 5 + 2) * (1 / delta_t)))
+    return stim_steps, phase_steps
+
+
+# Returns the first time step after step (but not after step_stop) where an event of the protocol (see event_steps())
+# or a registration of data can happen. The counters are the ones of the data registration after the events of step are
+# applied. Until then, only the dynamics have to be iterated.
+@jit(nopython=True, nogil=True, cache=True)
+def next_event_step(step, step_stop, sampling_rate, stim_steps, phase_steps, stim_index, counter1, counter2, counter3):
+    (sampling_rate_stim, sampling_rate_sim) = sampling_rate
+    step_next = step_stop
+
+    for event in (stim_steps[stim_index, 0], stim_steps[stim_index, 1]) + phase_steps:
+        if step < event < step_next:
+            step_next = event
+
+    # The data is registered when a counter reaches its sampling rate, they all increase by one per time step
+    for counter, sampling in ((counter1, sampling_rate_stim), (counter2, sampling_rate_sim), (counter3, sampling_rate_stim)):
+        if counter < sampling and step + sampling - counter < step_next:
+            step_next = step + sampling - counter
+
+    return step_next
+
+
+# A recorder registers the chosen entries (channels) of the state vector, e.g. (ST_E1,) for the response of E1, at every
+# stride-th time step from step_start until before step_stop into the columns of data, independent of the data arrays
+# of the phases. It is given as the tuple (channels, (step_start, step_stop, stride), data) with an int array of
+# channels, an int array for the window and a float array of shape (len(channels), number of samples), e.g. to keep
+# only what the analysis of a sweep needs (see new_recorder() in simulation.py).
+@jit(nopython=True, nogil=True, cache=True)
+def is_record_step(window, step):
+    return window[0] <= step < window[1] and (step - window[0]) % window[2] == 0
+
+
+# Returns the first time step of the recorder after step, step_stop if there is none before it
+@jit(nopython=True, nogil=True, cache=True)
+def next_record_step(window, step, step_stop):
+    step_next = window[0]
+    if step >= window[0]:
+        step_next = window[0] + ((step - window[0]) // window[2] + 1) * window[2]
+    if step_next >= window[1]:
+        return step_stop
+    return min(step_next, step_stop)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def record(recorder, step, state):
+    (channels, window, data) = recorder
+    i_record = int((step - window[0]) // window[2])
+    for i_channel in range(channels.shape[0]):
+        data[i_channel, i_record] = state[channels[i_channel]]
+
+
+# Reductions compute statistics of entries of the state vector while the simulation runs, e.g. the maximum of E1 during
+# the test, instead of from the data arrays afterwards. They are given as the tuple (channels, kinds, windows, values)
+# with an int array of channels, an int array of the kinds below, an int array of shape (number of reductions, 3) with
+# a window (step_start, step_stop, stride) per reduction, sampled as the window of a recorder, and a float array values
+# of shape (number of reductions, 3). The result of a reduction is values[i, 0], values[i, 1:] hold its first sample and
+# its running maximum. The value of REDUCE_ONSET is the maximum over the window minus its first sample (the response to
+# a stimulus starting within the window), the one of REDUCE_VALUE is the last sample of the window (see new_reductions()
+# in simulation.py). The maximum of E1 over the whole simulation is kept in max_E by all the models.
+REDUCE_MAX, REDUCE_MIN, REDUCE_MEAN, REDUCE_ONSET, REDUCE_VALUE = range(5)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def is_reduction_step(reductions, step):
+    windows = reductions[2]
+    for i in range(windows.shape[0]):
+        if is_record_step(windows[i], step):
+            return True
+    return False
+
+
+# Returns the first time step of any reduction after step, step_stop if there is none before it
+@jit(nopython=True, nogil=True, cache=True)
+def next_reduction_step(reductions, step, step_stop):
+    windows = reductions[2]
+    for i in range(windows.shape[0]):
+        step_stop = next_record_step(windows[i], step, step_stop)
+    return step_stop
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def reduce(reductions, step, state):
+    (channels, kinds, windows, values) = reductions
+    for i in range(channels.shape[0]):
+        if not is_record_step(windows[i], step):
+            continue
+        value = state[channels[i]]
+        i_sample = int((step - windows[i, 0]) // windows[i, 2])
+        if i_sample == 0:
+            values[i, 1] = value
+            values[i, 2] = value
+        values[i, 2] = max(values[i, 2], value)
+
+        if kinds[i] == REDUCE_MAX:
+            values[i, 0] = values[i, 2]
+        elif kinds[i] == REDUCE_MIN:
+            values[i, 0] = value if i_sample == 0 else min(values[i, 0], value)
+        elif kinds[i] == REDUCE_MEAN:
+            values[i, 0] = value if i_sample == 0 else values[i, 0] + (value - values[i, 0]) / (i_sample + 1)
+        elif kinds[i] == REDUCE_ONSET:
+            values[i, 0] = values[i, 2] - values[i, 1]
+        else:
+            values[i, 0] = value
+
+
+# Convergence monitoring of phase 2 is given as the tuple (tolerance, n_window) or None. Every n_window-th sample of
+# phase 2 after the registration window of the conditioning, the slow variables (the entries slow_start to slow_stop of
+# the state vector: plastic weights, set points and regulators) are compared with the ones of the sample n_window
+# before, kept in the state vector from idx_reference on. Once none of them drifted by more than tolerance relative to
+# its value (absolute for values below 1), the simulation has converged: the time step is held in state[idx_converged]
+# and the models jump over the rest of phase 2 (see model_from_state()). Returns True if the simulation has converged.
+@jit(nopython=True, nogil=True, cache=True)
+def check_convergence(state, convergence, step, i_2, slow_start, slow_stop, idx_reference, idx_reference_i2,
+                      idx_converged):
+    (tolerance, n_window) = convergence
+    if state[idx_converged] != 0:
+        return True
+    if i_2 % n_window != 0:
+        return False
+
+    # The reference is held with the index of its sample plus one, zero if there is none
+    n_slow = slow_stop - slow_start
+    if state[idx_reference_i2] == i_2 - n_window + 1:
+        drift = 0.
+        for i in range(n_slow):
+            reference = state[idx_reference + i]
+            drift = max(drift, abs(state[slow_start + i] - reference) / max(abs(reference), 1))
+        if drift < tolerance:
+            state[idx_converged] = step
+            return True
+    state[idx_reference:idx_reference + n_slow] = state[slow_start:slow_stop]
+    state[idx_reference_i2] = i_2 + 1
+    return False
+
+
+@jit(nopython=True, nogil=True, cache=True) # ensures that the function is compiled without using the Python interpreter ("nopython" mode). If Numba encounters any code that cannot be translated to machine code, it will raise an error.
 def model(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
           g_stim, stim_times, taus, beta_K, rheobases,
-          flags=(0, 0, 0, 0, 0, 0), flags_theta = (1,1)):
-    
+          flags=(0, 0, 0, 0, 0, 0), flags_theta = (1,1), exponential_euler=False, recorder=None,
+          reductions=None, convergence=None):
+
+    state = initial_state(weights)
+    return model_from_state(state, sim_duration, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                            g_stim, stim_times, taus, beta_K, rheobases, flags=flags, flags_theta=flags_theta,
+                            exponential_euler=exponential_euler, recorder=recorder, reductions=reductions,
+                            convergence=convergence)
+
+
+# Advances the simulation held in state (see initial_state()) until the time step step_stop and writes the data of this
+# stretch into the data arrays. The state vector is updated in place, thus the simulation can be continued afterwards.
+# All events (stimuli, data registration windows) are defined in absolute time steps, so a state can be continued with
+# a different stim_times for the stimuli that are not applied yet, e.g. to test the network at a different time.
+# With exponential_euler, the rates are updated with the exponential Euler method instead of the Euler method: the
+# leak term is integrated exactly over the time step, so the update stays stable for time steps close to and above the
+# time constants of the rates (e.g. 1-2 ms instead of 0.1 ms). sampling_rate is given in time steps, thus it has to be
+# scaled with delta_t to keep the same registration times. The data arrays of the phases may hold fewer samples than
+# the protocol registers (e.g. none, if only the recorder is needed, see is_record_step()), the others are dropped. The
+# reductions (see reduce()) are updated at the time steps of their windows. With convergence (see
+# check_convergence()), the simulation jumps from the sample of phase 2 where the slow variables have converged to the
+# last sample before the registration window of the test (or step_stop), the samples in between are filled with the
+# converged one. Returns the status of the simulation (see exit_status()).
+@jit(nopython=True, nogil=True, cache=True)
+def model_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                     g_stim, stim_times, taus, beta_K, rheobases,
+                     flags=(0, 0, 0, 0, 0, 0), flags_theta = (1,1), exponential_euler=False, recorder=None,
+                     reductions=None, convergence=None):
+
     ##### Initializing the setup
     (sampling_rate_stim, sampling_rate_sim) = sampling_rate
     (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
@@ -18,47 +253,68 @@ def model(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weig
      w_EEij, w_EPij, w_ESij, w_PEij, w_PPij, w_PSij, w_SEij) = weights
     (g_E, g_P, g_S) = g
     (g_stim_E, g_stim_P, g_stim_S) = g_stim
-    (stim_start, stim_stop) = stim_times[0]
     (tau_E, tau_P, tau_S, tau_plas,
      tau_scaling_E, tau_scaling_P, tau_scaling_S,
      tau_theta, tau_beta) = taus
     (rheobase_E, rheobase_P, rheobase_S) = rheobases
 
-    # Setting up initial conditions
-    E01, E02, P01, P02, S01, S02 = 1,1,1,1,1,1 # The initial rates are arbitrarily set to 1
-    EE110, EE120, EE210, EE220 = w_EEii, w_EEij, w_EEij, w_EEii
-    EP110, EP120, EP210, EP220 = w_EPii, w_EPij, w_EPij, w_EPii
-    ES110, ES120, ES210, ES220 = w_ESii, w_ESij, w_ESij, w_ESii
-    E1, E2 = 0,0
-    max_E[0] = 0
-    stimulus_E1, stimulus_P1, stimulus_S1 = 0, 0, 0
-    stimulus_E2, stimulus_P2, stimulus_S2 = 0, 0, 0
-
-    learning_rate = 1
-    r_baseline = 0
-    theta1, theta2 = 1, 1
-    beta1, beta2 = 1, 1
-
-    # Flags of the plasticity mechanisms are initialized here
-    hebbian_flag, three_factor_flag, adaptive_set_point_flag, E_scaling_flag, P_scaling_flag, S_scaling_flag = 0, 0, 0, 0, 0, 0
-    flag_theta_shift, flag_theta_local = 0, 0
-
-    # Counters and indices are initialized for different phases
+    # Fraction of the way to the steady-state rate covered in one time step
+    if exponential_euler:
+        dt_tau_E, dt_tau_P, dt_tau_S = -np.expm1(-delta_t / tau_E), -np.expm1(-delta_t / tau_P), -np.expm1(-delta_t / tau_S)
+    else:
+        dt_tau_E, dt_tau_P, dt_tau_S = delta_t*(1/tau_E), delta_t*(1/tau_P), delta_t*(1/tau_S)
+    # Factors of the slow variables, e.g. the synaptic scaling, calculated once instead of at every time step
+    dt_tau_beta, dt_tau_theta = delta_t * (1 / tau_beta), delta_t * (1 / tau_theta)
+    dt_tau_scaling_E, dt_tau_scaling_P, dt_tau_scaling_S = \
+        delta_t * (1 / tau_scaling_E), delta_t * (1 / tau_scaling_P), delta_t * (1 / tau_scaling_S)
+
+    # Reading the state of the simulation
+    E01, E02, P01, P02, S01, S02 = state[ST_E1], state[ST_E2], state[ST_P1], state[ST_P2], state[ST_S1], state[ST_S2]
+    EE110, EE120, EE210, EE220 = state[ST_EE11], state[ST_EE12], state[ST_EE21], state[ST_EE22]
+    EP110, EP120, EP210, EP220 = state[ST_EP11], state[ST_EP12], state[ST_EP21], state[ST_EP22]
+    ES110, ES120, ES210, ES220 = state[ST_ES11], state[ST_ES12], state[ST_ES21], state[ST_ES22]
+    E1, E2 = E01, E02
+    max_E[0] = state[ST_MAX_E]
+    stimulus_E1, stimulus_E2 = state[ST_STIM_E1], state[ST_STIM_E2]
+    stimulus_P1, stimulus_P2 = state[ST_STIM_P1], state[ST_STIM_P2]
+    stimulus_S1, stimulus_S2 = state[ST_STIM_S1], state[ST_STIM_S2]
+
+    learning_rate = int(state[ST_LEARNING_RATE])
+    r_baseline = state[ST_R_BASELINE]
+    theta1, theta2 = state[ST_THETA1], state[ST_THETA2]
+    beta1, beta2 = state[ST_BETA1], state[ST_BETA2]
+
+    # Flags of the plasticity mechanisms, they are all zero before the conditioning
+    hebbian_flag, three_factor_flag, adaptive_set_point_flag = \
+        int(state[ST_HEBBIAN]), int(state[ST_THREE_FACTOR]), int(state[ST_ADAPTIVE_SET_POINT])
+    E_scaling_flag, P_scaling_flag, S_scaling_flag = \
+        int(state[ST_E_SCALING]), int(state[ST_P_SCALING]), int(state[ST_S_SCALING])
+    flag_theta_shift, flag_theta_local = int(state[ST_THETA_SHIFT]), int(state[ST_THETA_LOCAL])
+
+    # Counters and indices for different phases
     # (counter and i (index) to fill the arrays. np.mod doesn't work in numba,
     # thus we need counters to hold data at every "sampling_rate" step)
-    phase1, phase3 = 0,0
-    counter1, counter2 , counter3 = 0,0,0 # Counter to hold data with the respective sampling rate
-    i_1, i_2, i_3 = 0,0,0 # Index to fill the data arrays
+    phase1, phase3 = int(state[ST_PHASE1]), int(state[ST_PHASE3])
+    counter1, counter2, counter3 = int(state[ST_COUNTER1]), int(state[ST_COUNTER2]), int(state[ST_COUNTER3])
+    i_1, i_2, i_3 = int(state[ST_I1]), int(state[ST_I2]), int(state[ST_I3])
 
-    stim_applied = 0  # The number of stimulation applied is held
+    stim_applied = int(state[ST_STIM_APPLIED])  # The number of stimulation applied is held
+    stim_index = int(state[ST_STIM_INDEX])  # The row of stim_times holding the timing of the current/next stimulus
+    (stim_steps, phase_steps) = event_steps(delta_t, stim_times)
 
+    step = int(state[ST_STEP])
+    step_reached = step_stop
+    exit_reason = EXIT_STEP_STOP
+    n_clamps = int(state[ST_N_CLAMPS])
 
     ##### The loop of the numerical iterations
-    for step in range(sim_duration):
-
+    # The iterations run in segments between the time steps where anything of the protocol happens (see
+    # next_event_step()). The events and the data registration are handled at the top of a segment, the steps within
+    # a segment only update the dynamics.
+    while step < step_stop:
 
         ### If it is the start of the stimulation
-        if step == int((stim_start + 2) * (1 / delta_t)):
+        if step == stim_steps[stim_index, 0]:
             # If it is the first stimuli (conditioning)
             if stim_applied == 0:
                 r_baseline = E1
@@ -92,7 +348,7 @@ def model(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weig
 
 
         ### If it is the end of the stimulation
-        if step == int((stim_stop + 2)*(1/delta_t)):
+        if step == stim_steps[stim_index, 1]:
             # The offset of the conditioning
             if stim_applied == 1:
                 g_S_total = g_S # Add top-down input to S
@@ -108,148 +364,1241 @@ def model(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weig
             stimulus_S1, stimulus_S2 = 0, 0
 
             # Set the new timing for the next stim if exists
-            if stim_times.shape[0] > stim_applied:
-                (stim_start, stim_stop) = stim_times[stim_applied]
+            if stim_steps.shape[0] > stim_applied:
+                stim_index = stim_applied
 
         # setting the counters for phase 1 and 3 with 5 seconds of
-        if step == int(2*(1/delta_t)):
+        if step == phase_steps[0]:
             counter1 = sampling_rate_stim  # Start the data-holder counter1
             phase1 = 1
-        elif step == int((stim_times[0][1] + 5 + 2) * (1 / delta_t)):
+        elif step == phase_steps[1]:
             phase1 = 0
 
-        elif step == int((stim_times[1][0] - 5 + 2) * (1 / delta_t)):
+        elif step == phase_steps[2]:
             counter3 = sampling_rate_stim  # Start the data-holder counter3
             phase3 = 1
-        elif step == int((stim_times[1][1] + 5 + 2) * (1 / delta_t)):
+        elif step == phase_steps[3]:
             phase3 = 0
 
 
         ### Data is registered to the arrays
-        if phase1 and counter1 == sampling_rate_stim:
-            r_phase1[:,i_1] = [E01, E02, P01, P02, S01, S02]
-            J_exc_phase1[:,i_1] = [EE110, EE120, EE210, EE220]
+        # The variables are written to the state vector and copied from there into the columns of the arrays, without
+        # building temporary arrays
+        registration1 = phase1 and counter1 == sampling_rate_stim
+        registration3 = not registration1 and phase3 and counter3 == sampling_rate_stim
+        registration2 = stim_applied == 1 and counter2 == sampling_rate_sim
+        recording = False
+        reducing = False
+        if recorder is not None:
+            recording = is_record_step(recorder[1], step)
+        if reductions is not None:
+            reducing = is_reduction_step(reductions, step)
+        if registration1 or registration2 or registration3 or recording or reducing:
+            state[ST_E1], state[ST_E2], state[ST_P1], state[ST_P2], state[ST_S1], state[ST_S2] = E01, E02, P01, P02, S01, S02
+            state[ST_EE11], state[ST_EE12], state[ST_EE21], state[ST_EE22] = EE110, EE120, EE210, EE220
+            state[ST_EP11], state[ST_EP12], state[ST_EP21], state[ST_EP22] = EP110, EP120, EP210, EP220
+            state[ST_ES11], state[ST_ES12], state[ST_ES21], state[ST_ES22] = ES110, ES120, ES210, ES220
+            state[ST_THETA1], state[ST_THETA2], state[ST_BETA1], state[ST_BETA2] = theta1, theta2, beta1, beta2
+
+        if registration1:
+            if i_1 < r_phase1.shape[1]:
+                r_phase1[:, i_1] = state[ST_E1:ST_S2 + 1]
+                J_exc_phase1[:, i_1] = state[ST_EE11:ST_EE22 + 1]
 
             i_1 = i_1 + 1
             counter1 = 0  # restart
 
-        elif phase3 and counter3 == sampling_rate_stim:
-            r_phase3[:,i_3] = [E01, E02, P01, P02, S01, S02]
+        elif registration3:
+            if i_3 < r_phase3.shape[1]:
+                r_phase3[:, i_3] = state[ST_E1:ST_S2 + 1]
 
             i_3 = i_3 + 1
             counter3 = 0  # restart
 
-        if stim_applied == 1 and counter2 == sampling_rate_sim:
-            r_phase2[:,i_2] = [E01, E02, P01, P02, S01, S02, theta1, theta2, beta1, beta2]
-            J_phase2[:,i_2] = [EE110, EE120, EE210, EE220, EP110, EP120, EP210, EP220, ES110, ES120, ES210, ES220]
+        if registration2:
+            # The sample taken during the conditioning adds one sample to the ones counted for phase 2, it is dropped if
+            # it doesn't fit into the arrays instead of being written past their end
+            if i_2 < r_phase2.shape[1]:
+                r_phase2[:6, i_2] = state[ST_E1:ST_S2 + 1]
+                r_phase2[6:, i_2] = state[ST_THETA1:ST_BETA2 + 1]
+                J_phase2[:, i_2] = state[ST_EE11:ST_ES22 + 1]
 
             i_2 = i_2 + 1
             counter2 = 0  # restart
 
-        if E01 > max_E[0]:
-            max_E[0] = E01
+        if recorder is not None and recording:
+            record(recorder, step, state)
+        if reductions is not None and reducing:
+            reduce(reductions, step, state)
+
+        ### The rest of phase 2 is skipped once the slow variables have converged
+        if convergence is not None and registration2 and step >= phase_steps[1]:
+            if check_convergence(state, convergence, step, i_2 - 1, ST_SLOW_START, ST_SLOW_STOP, ST_REFERENCE,
+                                 ST_REFERENCE_I2, ST_CONVERGED_STEP):
+                # The jump ends at a registration of phase 2, which is carried out at the top of the loop
+                n_skipped = (min(step_stop, phase_steps[2]) - step) // sampling_rate_sim
+                if n_skipped > 1:
+                    for i in range(i_2, min(i_2 + n_skipped - 1, r_phase2.shape[1])):
+                        r_phase2[:, i] = r_phase2[:, i_2 - 1]
+                        J_phase2[:, i] = J_phase2[:, i_2 - 1]
+                    i_2 = i_2 + n_skipped - 1
+                    counter1 = counter1 + n_skipped * sampling_rate_sim; counter2 = sampling_rate_sim
+                    counter3 = counter3 + n_skipped * sampling_rate_sim
+                    step = step + n_skipped * sampling_rate_sim
+                    continue
+
+        ### The dynamics are iterated until the next event
+        step_next = next_event_step(step, step_stop, sampling_rate, stim_steps, phase_steps, stim_index,
+                                    counter1, counter2, counter3)
+        if recorder is not None:
+            step_next = next_record_step(recorder[1], step, step_next)
+        if reductions is not None:
+            step_next = next_reduction_step(reductions, step, step_next)
+        # Factor of the Hebbian terms, zero unless the Hebbian learning is active
+        hebbian_rate = hebbian_flag * learning_rate * delta_t * (1 / tau_plas)
+        for step_dynamics in range(step, step_next):
+            if E01 > max_E[0]:
+                max_E[0] = E01
+
+            # if the system explodes or falls silent, stop the simulation
+            if E01 > 1000 or E01 == 0:
+                step_reached = step_dynamics
+                exit_reason = EXIT_EXPLODED if E01 > 1000 else EXIT_SILENT
+                break
+
+            ### Calculating the firing rates at this timestep
+            I1 = g_E - EP110 * P01 - EP120 * P02 - ES110 * S01 - ES120 * S02 + EE110 * E01 + EE120 * E02 + stimulus_E1
+            I2 = g_E - EP210 * P01 - EP220 * P02 - ES210 * S01 - ES220 * S02 + EE210 * E01 + EE220 * E02 + stimulus_E2
+
+            E1 = E01 + dt_tau_E*(-E01 + np.maximum(0,I1 - rheobase_E))
+            E2 = E02 + dt_tau_E*(-E02 + np.maximum(0,I2 - rheobase_E))
+
+            P1 = P01 + dt_tau_P*(-P01 + np.maximum(0, w_PEii * E01 + w_PEij * E02 - w_PSii * S01 - w_PSij * S02
+                                                    -w_PPii * P01 - w_PPij * P02 + g_P - rheobase_P + stimulus_P1))
+            P2 = P02 + dt_tau_P*(-P02 + np.maximum(0, w_PEij * E01 + w_PEii * E02 - w_PSij * S01 - w_PSii * S02
+                                                    -w_PPij * P01 - w_PPii * P02 + g_P - rheobase_P + stimulus_P2))
+
+            S1 = S01 + dt_tau_S*(-S01 + np.maximum(0, w_SEii * E01 + w_SEij * E02 + g_S - rheobase_S + stimulus_S1))
+            S2 = S02 + dt_tau_S*(-S02 + np.maximum(0, w_SEij * E01 + w_SEii * E02 + g_S - rheobase_S + stimulus_S2))
+
+            # Firing rates, set-points and set-point regulators cannot go below 0, the activations of the boundaries
+            # are counted (checked at once first, as they are rarely active)
+            if min(E1, E2, P1, P2, S1, S2, beta1, beta2) < 0 or min(theta1, theta2) < 1e-10:
+                n_clamps += ((E1 < 0) + (E2 < 0) + (P1 < 0) + (P2 < 0) + (S1 < 0) + (S2 < 0) + (beta1 < 0)
+                             + (beta2 < 0) + (theta1 < 1e-10) + (theta2 < 1e-10))
+            E1 = max(E1, 0); E2 = max(E2, 0)
+            P1 = max(P1, 0); P2 = max(P2, 0)
+            S1 = max(S1, 0); S2 = max(S2, 0)
+            beta1=max(beta1,0); beta2=max(beta2, 0)
+            theta1=max(theta1,1e-10); theta2=max(theta2, 1e-10) # Nonzero lower boundary to prevent zero division in scaling equation
+
+
+            ### Calculating the plasticity for this timestep
+            # Only the mechanisms switched on by the flags are calculated. The flags and the learning rate only change
+            # at the events, thus the branches are the same for all the steps of a segment.
+            if adaptive_set_point_flag:
+                # Set point regulators for the E populations
+                beta1 = beta1 + dt_tau_beta * (E1 - beta1)
+                beta2 = beta2 + dt_tau_beta * (E2 - beta2)
+
+            if adaptive_set_point_flag or flag_theta_local:
+                # Set points for the E populations
+                theta1 = theta1 + dt_tau_theta * \
+                           (-adaptive_set_point_flag*(theta1 - beta1) + flag_theta_local*(E1 - theta1))
+                theta2 = theta2 + dt_tau_theta * \
+                           (-adaptive_set_point_flag*(theta2 - beta2) + flag_theta_local*(E2 - theta2))
+
+            # Ratios in the synaptic scaling equations are calculated
+            if E_scaling_flag or P_scaling_flag or S_scaling_flag:
+                ratio_E1 = E1 / theta1; ratio_E2 = E2 / theta2
+
+            # Synaptic scaling terms are calculated and applied
+            if E_scaling_flag:
+                ss1_e = dt_tau_scaling_E * ((1 - ratio_E1))
+                ss2_e = dt_tau_scaling_E * ((1 - ratio_E2))
+                EE110 = EE110 + ss1_e*EE110
+                EE120 = EE120 + ss1_e*EE120
+                EE210 = EE210 + ss2_e*EE210
+                EE220 = EE220 + ss2_e*EE220
+
+            EP11, EP12, EP21, EP22 = EP110, EP120, EP210, EP220
+            if P_scaling_flag:
+                ss1_p = dt_tau_scaling_P * ((1 - ratio_E1))
+                ss2_p = dt_tau_scaling_P * ((1 - ratio_E2))
+                EP11  = EP110 - ss1_p*EP110
+                EP12  = EP120 - ss1_p*EP120
+                EP21  = EP210 - ss2_p*EP210
+                EP22  = EP220 - ss2_p*EP220
+
+            ES11, ES12, ES21, ES22 = ES110, ES120, ES210, ES220
+            if S_scaling_flag:
+                ss1_s = dt_tau_scaling_S * ((1 - ratio_E1))
+                ss2_s = dt_tau_scaling_S * ((1 - ratio_E2))
+                ES11  = ES110 + ss1_s*ES110
+                ES12  = ES120 + ss1_s*ES120
+                ES21  = ES210 + ss2_s*ES210
+                ES22  = ES220 + ss2_s*ES220
+
+            # Hebbian terms are calculated and applied
+            EE11, EE12, EE21, EE22 = EE110, EE120, EE210, EE220
+            if hebbian_rate != 0:
+                heb_term11 = hebbian_rate * (E1 - r_baseline) * E1
+                heb_term12 = hebbian_rate * (E1 - r_baseline) * E2
+                heb_term21 = hebbian_rate * (E2 - r_baseline) * E1
+                heb_term22 = hebbian_rate * (E2 - r_baseline) * E2
+
+                EE11 = EE110 + heb_term11
+                EE12 = EE120 + heb_term12
+                EE21 = EE210 + heb_term21
+                EE22 = EE220 + heb_term22
+
+            # Lower bondary is applied to the weights
+            if min(EE11, EE12, EE21, EE22, EP11, EP12, EP21, EP22, ES11, ES12, ES21, ES22) < 0:
+                n_clamps += ((EE11 < 0) + (EE12 < 0) + (EE21 < 0) + (EE22 < 0) + (EP11 < 0) + (EP12 < 0) + (EP21 < 0)
+                             + (EP22 < 0) + (ES11 < 0) + (ES12 < 0) + (ES21 < 0) + (ES22 < 0))
+            EE11 = max(0,EE11);EE12 = max(0,EE12)
+            EE21 = max(0,EE21);EE22 = max(0,EE22)
+            EP11 = max(0,EP11);EP12 = max(0,EP12)
+            EP21 = max(0,EP21);EP22 = max(0,EP22)
+            ES11 = max(0,ES11);ES12 = max(0,ES12)
+            ES21 = max(0,ES21);ES22 = max(0,ES22)
+
+            # Placeholder parameters are freed
+            E01 = E1; E02 = E2; P01 = P1; P02 = P2; S01 = S1; S02 = S2
+            EE110=EE11; EE120=EE12; EE210=EE21; EE220=EE22
+            EP110=EP11; EP120=EP12; EP210=EP21; EP220=EP22
+            ES110=ES11; ES120=ES12; ES210=ES21; ES220=ES22
+
+        # Update the data-holder counters with the number of time steps iterated
+        if step_reached < step_stop:
+            counter1 = counter1 + step_reached - step; counter2 = counter2 + step_reached - step; counter3 = counter3 + step_reached - step
+            break
+        counter1 = counter1 + step_next - step; counter2 = counter2 + step_next - step; counter3 = counter3 + step_next - step
+        step = step_next
+
+    ##### Writing the state of the simulation back
+    state[ST_E1], state[ST_E2], state[ST_P1], state[ST_P2], state[ST_S1], state[ST_S2] = E01, E02, P01, P02, S01, S02
+    state[ST_EE11], state[ST_EE12], state[ST_EE21], state[ST_EE22] = EE110, EE120, EE210, EE220
+    state[ST_EP11], state[ST_EP12], state[ST_EP21], state[ST_EP22] = EP110, EP120, EP210, EP220
+    state[ST_ES11], state[ST_ES12], state[ST_ES21], state[ST_ES22] = ES110, ES120, ES210, ES220
+    state[ST_THETA1], state[ST_THETA2], state[ST_BETA1], state[ST_BETA2] = theta1, theta2, beta1, beta2
+    state[ST_LEARNING_RATE], state[ST_R_BASELINE] = learning_rate, r_baseline
+    state[ST_STIM_E1], state[ST_STIM_E2] = stimulus_E1, stimulus_E2
+    state[ST_STIM_P1], state[ST_STIM_P2] = stimulus_P1, stimulus_P2
+    state[ST_STIM_S1], state[ST_STIM_S2] = stimulus_S1, stimulus_S2
+    state[ST_HEBBIAN], state[ST_THREE_FACTOR], state[ST_ADAPTIVE_SET_POINT] = hebbian_flag, three_factor_flag, adaptive_set_point_flag
+    state[ST_E_SCALING], state[ST_P_SCALING], state[ST_S_SCALING] = E_scaling_flag, P_scaling_flag, S_scaling_flag
+    state[ST_THETA_SHIFT], state[ST_THETA_LOCAL] = flag_theta_shift, flag_theta_local
+    state[ST_STIM_APPLIED], state[ST_STIM_INDEX] = stim_applied, stim_index
+    state[ST_PHASE1], state[ST_PHASE3] = phase1, phase3
+    state[ST_COUNTER1], state[ST_COUNTER2], state[ST_COUNTER3] = counter1, counter2, counter3
+    state[ST_I1], state[ST_I2], state[ST_I3] = i_1, i_2, i_3
+    state[ST_MAX_E] = max_E[0]
+    state[ST_STEP] = step_reached
+    state[ST_EXIT_REASON], state[ST_N_CLAMPS] = exit_reason, n_clamps
+    return exit_status(state, delta_t)
+
+
+##### Quasi-steady-state (slow-manifold) integration of model()
+# Between the conditioning and the test, the rates (time constants of 5-20 ms) follow the slow variables (synaptic
+# scaling, set points and their regulators with time constants of hours) adiabatically. model_qss() replaces the 0.1 ms
+# Euler steps of this period by the fixed point of the threshold-linear rate dynamics and integrates only the slow
+# variables with a step of delta_t_slow seconds (Heun's method). The conditioning and the test (each with their 5
+# seconds of registered data before and after) are simulated with the Euler steps of model_from_state().
+
+# Positions of the slow variables in the state vector, the plastic weights followed by the set points and regulators
+ST_SLOW_START, ST_SLOW_STOP = ST_EE11, ST_BETA2 + 1
+
+
+# Solves A x = b with Gaussian elimination and partial pivoting (A and b are overwritten). Returns False if A is
+# singular.
+@jit(nopython=True, nogil=True, cache=True)
+def solve_linear(A, b, x):
+    n = b.shape[0]
+    for k in range(n):
+        i_max = k
+        for i in range(k + 1, n):
+            if abs(A[i, k]) > abs(A[i_max, k]):
+                i_max = i
+        if abs(A[i_max, k]) < 1e-12:
+            return False
+        if i_max != k:
+            for j in range(n):
+                A[k, j], A[i_max, j] = A[i_max, j], A[k, j]
+            b[k], b[i_max] = b[i_max], b[k]
+        for i in range(k + 1, n):
+            factor = A[i, k] / A[k, k]
+            for j in range(k, n):
+                A[i, j] -= factor * A[k, j]
+            b[i] -= factor * b[k]
+    for i in range(n - 1, -1, -1):
+        x[i] = b[i]
+        for j in range(i + 1, n):
+            x[i] -= A[i, j] * x[j]
+        x[i] = x[i] / A[i, i]
+    return True
+
+
+# Connectivity W and input b of the rate dynamics tau*dr/dt = -r + max(0, W r + b) with r = (E1, E2, P1, P2, S1, S2),
+# for the plastic weights and the stimuli held in state
+@jit(nopython=True, nogil=True, cache=True)
+def rate_dynamics(state, weights, g, rheobases, W, b):
+    (w_EEii, w_EPii, w_ESii, w_PEii, w_PPii, w_PSii, w_SEii,
+     w_EEij, w_EPij, w_ESij, w_PEij, w_PPij, w_PSij, w_SEij) = weights
+    (g_E, g_P, g_S) = g
+    (rheobase_E, rheobase_P, rheobase_S) = rheobases
 
-        # if the system explodes, stop the simulation
-        if E01 > 1000:
+    W[:, :] = 0
+    W[0, 0], W[0, 1], W[1, 0], W[1, 1] = state[ST_EE11], state[ST_EE12], state[ST_EE21], state[ST_EE22]
+    W[0, 2], W[0, 3], W[1, 2], W[1, 3] = -state[ST_EP11], -state[ST_EP12], -state[ST_EP21], -state[ST_EP22]
+    W[0, 4], W[0, 5], W[1, 4], W[1, 5] = -state[ST_ES11], -state[ST_ES12], -state[ST_ES21], -state[ST_ES22]
+    W[2, 0], W[2, 1], W[3, 0], W[3, 1] = w_PEii, w_PEij, w_PEij, w_PEii
+    W[2, 2], W[2, 3], W[3, 2], W[3, 3] = -w_PPii, -w_PPij, -w_PPij, -w_PPii
+    W[2, 4], W[2, 5], W[3, 4], W[3, 5] = -w_PSii, -w_PSij, -w_PSij, -w_PSii
+    W[4, 0], W[4, 1], W[5, 0], W[5, 1] = w_SEii, w_SEij, w_SEij, w_SEii
+
+    b[0] = g_E - rheobase_E + state[ST_STIM_E1]; b[1] = g_E - rheobase_E + state[ST_STIM_E2]
+    b[2] = g_P - rheobase_P + state[ST_STIM_P1]; b[3] = g_P - rheobase_P + state[ST_STIM_P2]
+    b[4] = g_S - rheobase_S + state[ST_STIM_S1]; b[5] = g_S - rheobase_S + state[ST_STIM_S2]
+
+
+# Finds the fixed point r of the threshold-linear rate dynamics tau*dr/dt = -r + max(0, W r + b) of six populations.
+# The set of active (non-zero) populations is found iteratively starting from the active set of the rates given in r,
+# so the fixed point on the branch the network is on is followed. The fixed point is written to r. Returns False if no
+# fixed point is found or if it is not stable for the (exponential) Euler steps with the factors dt_taus (delta_t/tau
+# of every population, see model_from_state()): the distance to the fixed point has to shrink by exp(log_norm_max)
+# within 2^n_squarings steps.
+@jit(nopython=True, nogil=True, cache=True)
+def threshold_linear_fixed_point(W, b, r, dt_taus, n_iterations=12, n_squarings=24, log_norm_max=-10.):
+    active = np.empty(6, dtype=np.bool_)
+    for i in range(6):
+        active[i] = r[i] > 0
+
+    A = np.empty((6, 6)); b_A = np.empty(6); r_A = np.empty(6); idx = np.empty(6, dtype=np.int64)
+    found = False
+    for iteration in range(n_iterations):
+        # The rates of the active populations solve (I - W_AA) r_A = b_A, the rest is zero
+        n = 0
+        for i in range(6):
+            if active[i]:
+                idx[n] = i
+                n += 1
+        for k in range(n):
+            for l in range(n):
+                A[k, l] = -W[idx[k], idx[l]]
+            A[k, k] += 1
+            b_A[k] = b[idx[k]]
+        r[:] = 0
+        if n > 0 and not solve_linear(A[:n, :n], b_A[:n], r_A[:n]):
+            return False
+        for k in range(n):
+            r[idx[k]] = r_A[k]
+
+        # The active set is consistent if no active rate is negative and no silent population is driven above zero
+        found = True
+        for i in range(6):
+            u = b[i]
+            for j in range(6):
+                u += W[i, j] * r[j]
+            if active[i] and r[i] < 0:
+                active[i] = False; found = False
+            elif not active[i] and u > 0:
+                active[i] = True; found = False
+        if found:
             break
 
-        if E01 == 0:
+    if not found:
+        return False
+
+    # The fixed point is stable if the Euler map r -> r + delta_t/tau (-r + D (W r + b)) contracts. Its Jacobian M is
+    # squared repeatedly (normalized to avoid overflow), so M^(2^k) vanishes after k squarings if it contracts.
+    M = np.zeros((6, 6)); M_2 = np.empty((6, 6))
+    for i in range(6):
+        for j in range(6):
+            M[i, j] = dt_taus[i] * W[i, j] if active[i] else 0.
+        M[i, i] += 1 - dt_taus[i]
+    log_norm = 0.
+    for k in range(n_squarings):
+        for i in range(6):
+            for j in range(6):
+                s = 0.
+                for l in range(6):
+                    s += M[i, l] * M[l, j]
+                M_2[i, j] = s
+        norm = np.max(np.abs(M_2))
+        if norm == 0:
+            log_norm = -np.inf
             break
+        M[:, :] = M_2 / norm
+        log_norm = 2 * log_norm + np.log(norm)
+    return log_norm <= log_norm_max
+
+
+# Factors of the leak of the (exponential) Euler steps of delta_t (see model_from_state()) of the six populations
+@jit(nopython=True, nogil=True, cache=True)
+def euler_factors(taus, delta_t, exponential_euler=False):
+    dt_taus = np.empty(6)
+    for i in range(6):
+        tau = taus[0] if i < 2 else (taus[1] if i < 4 else taus[2])
+        dt_taus[i] = -np.expm1(-delta_t / tau) if exponential_euler else delta_t * (1 / tau)
+    return dt_taus
+
+
+# Finds the fixed point of the rate dynamics for the slow variables held in state and writes it to the rates of state
+# (see threshold_linear_fixed_point()). Returns False if no stable fixed point is found or if the simulation would stop
+# there (E1 above 1000 or at zero).
+@jit(nopython=True, nogil=True, cache=True)
+def rates_fixed_point(state, weights, g, taus, rheobases, delta_t, exponential_euler=False, n_iterations=12):
+    W = np.empty((6, 6)); b = np.empty(6)
+    rate_dynamics(state, weights, g, rheobases, W, b)
+
+    r = state[ST_E1:ST_S2 + 1].copy()
+    if not threshold_linear_fixed_point(W, b, r, euler_factors(taus, delta_t, exponential_euler), n_iterations):
+        return False
+    if r[0] > 1000 or r[0] == 0:
+        return False
+
+    state[ST_E1:ST_S2 + 1] = r
+    return True
+
+
+##### Steady state of the calibration run
+# The aversion threshold is the response of E2 to the conditioning of E1 without plasticity, read 10 seconds into the
+# stimulus of a 30 second simulation. The rates reach the fixed point of the rate dynamics long before, so it can be
+# found directly. calibration_rates() follows the simulation: the fixed point without stimulus is found from the
+# initial rates, the one with the conditioning stimulus from there. Both have to be reached within the time the
+# simulation has, i.e. the distance to them shrinks by 1e-7 (the precision of the float32 data arrays) within 2^16 Euler
+# steps (6.5 seconds for delta_t = 0.1 ms).
+
+# Returns (found, r) with the rates r = (E1, E2, P1, P2, S1, S2) 10 seconds into the conditioning of the calibration
+# run of model(), found is False if the fixed points are not found or not stable (the simulation is needed then)
+@jit(nopython=True, nogil=True, cache=True)
+def calibration_rates(weights, g, g_stim, taus, rheobases, delta_t):
+    (g_stim_E, g_stim_P, g_stim_S) = g_stim
+    state = initial_state(weights)
+    W = np.empty((6, 6)); b = np.empty(6)
+    dt_taus = euler_factors(taus, delta_t)
+    r = state[ST_E1:ST_S2 + 1].copy()
+
+    # The baseline before the stimulus, then the response to the conditioning stimulus
+    for stimulated in range(2):
+        if stimulated:
+            state[ST_STIM_E1], state[ST_STIM_E2] = g_stim_E[0]
+            state[ST_STIM_P1], state[ST_STIM_P2] = g_stim_P[0]
+            state[ST_STIM_S1], state[ST_STIM_S2] = g_stim_S[0]
+        rate_dynamics(state, weights, g, rheobases, W, b)
+        if not threshold_linear_fixed_point(W, b, r, dt_taus, n_squarings=16, log_norm_max=np.log(1e-7)):
+            return False, r
+        # The simulation stops if E1 explodes or falls silent
+        if r[0] > 1000 or r[0] == 0:
+            return False, r
+    return True, r
+
+
+##### Stability pre-screen of parameter sets
+# A parameter set whose rates explode before the plasticity has changed the weights stops the simulation within the
+# first seconds, one whose E populations fall silent is simulated to the end for nothing (the decay of the rates ends
+# at the smallest subnormal number rather than at zero). screen_stability() tells these sets apart without simulating
+# them, from the fixed points of the rate dynamics the simulation reaches at baseline and during the conditioning (see
+# calibration_rates()).
+
+# Outcomes of screen_stability(): the fixed point is stable, E1 is above 1000 or at zero there, or no stable fixed
+# point is found
+SCREEN_STABLE, SCREEN_EXPLODES, SCREEN_SILENT, SCREEN_UNSTABLE = range(4)
+
+
+# Outcome of the stable fixed point of the rates in r (see screen_stability())
+@jit(nopython=True, nogil=True, cache=True)
+def screen_outcome(r):
+    if r[0] > 1000:
+        return SCREEN_EXPLODES
+    elif r[0] == 0:
+        return SCREEN_SILENT
+    return SCREEN_STABLE
+
+
+# Screens the rate dynamics with the weights W and the inputs b from the rates in r, which are set to the fixed point
+# (see threshold_linear_fixed_point()). If the fixed point reached from r is not stable, the fixed points of all the
+# 64 sets of active populations are checked, as another one can be stable (e.g. a silent E population next to an
+# unstable active one). The outcome is only SCREEN_EXPLODES or SCREEN_SILENT if all the stable fixed points agree on it,
+# and SCREEN_UNSTABLE if there is none.
+@jit(nopython=True, nogil=True, cache=True)
+def screen_fixed_point(W, b, r, dt_taus):
+    r_0 = r.copy()
+    if threshold_linear_fixed_point(W, b, r, dt_taus):
+        return screen_outcome(r)
+
+    outcome = SCREEN_UNSTABLE
+    r_found = r_0.copy()
+    for active_set in range(64):
+        for i in range(6):
+            r[i] = 1. if (active_set >> i) & 1 else 0.
+        if threshold_linear_fixed_point(W, b, r, dt_taus, 1):
+            if outcome == SCREEN_UNSTABLE:
+                outcome = screen_outcome(r)
+                r_found[:] = r
+            elif screen_outcome(r) != outcome:
+                outcome = SCREEN_STABLE
+    r[:] = r_found
+    return outcome
+
+
+# Jacobian J of the rate dynamics dr/dt = (-r + D (W r + b)) / tau at the rates r, D for the active populations
+@jit(nopython=True, nogil=True, cache=True)
+def rate_jacobian(W, b, r, taus, J):
+    J[:, :] = 0
+    for i in range(6):
+        tau = taus[0] if i < 2 else (taus[1] if i < 4 else taus[2])
+        u = b[i]
+        for j in range(6):
+            u += W[i, j] * r[j]
+        if u > 0:
+            for j in range(6):
+                J[i, j] = W[i, j] / tau
+        J[i, i] -= 1 / tau
+
+
+# For the weights of every parameter set (rows of weights as in model_batch()), the fixed point of the rate dynamics
+# from the initial rates at baseline (column 0) and from there with the conditioning stimulus (column 1). Returns the
+# outcomes SCREEN_* (n_sets, 2), the rates at the fixed points (n_sets, 2, 6) and the Jacobians of the rate dynamics
+# dr/dt = (-r + D (W r + b)) / tau there (n_sets, 2, 6, 6, D for the active populations), e.g. for their eigenvalues.
+# The rates and Jacobians are zero where no fixed point is found.
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def screen_stability(weights, g, g_stim, taus, rheobases, delta_t):
+    (g_stim_E, g_stim_P, g_stim_S) = g_stim
+    n_sets = weights.shape[0]
+    outcomes = np.full((n_sets, 2), SCREEN_STABLE, dtype=np.int64)
+    rates = np.zeros((n_sets, 2, 6)); jacobians = np.zeros((n_sets, 2, 6, 6))
+    dt_taus = euler_factors(taus, delta_t)
+
+    for i_set in prange(n_sets):
+        weights_set = lane_weights(weights, i_set)
+        state = initial_state(weights_set)
+        W = np.empty((6, 6)); b = np.empty(6)
+        r = state[ST_E1:ST_S2 + 1].copy()
+
+        for stimulated in range(2):
+            if stimulated:
+                state[ST_STIM_E1], state[ST_STIM_E2] = g_stim_E[0]
+                state[ST_STIM_P1], state[ST_STIM_P2] = g_stim_P[0]
+                state[ST_STIM_S1], state[ST_STIM_S2] = g_stim_S[0]
+            rate_dynamics(state, weights_set, g, rheobases, W, b)
+            outcomes[i_set, stimulated] = screen_fixed_point(W, b, r, dt_taus)
+            if outcomes[i_set, stimulated] == SCREEN_UNSTABLE:
+                r[:] = state[ST_E1:ST_S2 + 1]
+                continue
+
+            rates[i_set, stimulated] = r
+            rate_jacobian(W, b, r, taus, jacobians[i_set, stimulated])
+
+    return outcomes, rates, jacobians
+
+
+##### Continuation of the fixed points of the rates over the weights
+# fixed_point_path() follows a fixed point of the rate dynamics along a path through the weights. Every point is
+# started from the fixed point of the previous one, so that the path stays on one branch of fixed points as long as the
+# branch exists, whether it is stable or not, unlike screen_stability() which only looks for stable fixed points (see
+# trace_fixed_points() in simulation.py for the boundaries of the branch along the path).
+
+# For the weights of every point of the path (rows of weights as in model_batch()), the fixed point of the rate
+# dynamics with the inputs stimulus (E1, E2, P1, P2, S1, S2) added, starting from the rates r for the first point.
+# Returns whether a fixed point is found (n_points), the rates (n_points, 6) and the Jacobians of the rate dynamics
+# there (n_points, 6, 6, see rate_jacobian()), zero where no fixed point is found. The point after one without a fixed
+# point is started from the last fixed point found.
+@jit(nopython=True, nogil=True, cache=True)
+def fixed_point_path(weights, g, stimulus, taus, rheobases, r):
+    n_points = weights.shape[0]
+    found = np.zeros(n_points, dtype=np.bool_)
+    rates = np.zeros((n_points, 6)); jacobians = np.zeros((n_points, 6, 6))
+    # Every consistent set of active populations is a fixed point, the stability is not checked
+    dt_taus = np.zeros(6)
+    W = np.empty((6, 6)); b = np.empty(6)
+    r_start = r.copy(); r_point = np.empty(6); r_set = np.empty(6)
+
+    for i_point in range(n_points):
+        weights_point = lane_weights(weights, i_point)
+        state = initial_state(weights_point)
+        state[ST_STIM_E1:ST_STIM_S2 + 1] = stimulus
+        rate_dynamics(state, weights_point, g, rheobases, W, b)
+        r_point[:] = r_start
+        if not threshold_linear_fixed_point(W, b, r_point, dt_taus, 12, 1, np.inf):
+            # The iteration can cycle between sets of active populations, the fixed point of all the 64 sets nearest
+            # to the start is taken instead (the one of another branch if the branch has ended)
+            distance_min = np.inf
+            for active_set in range(64):
+                for i in range(6):
+                    r_set[i] = 1. if (active_set >> i) & 1 else 0.
+                if threshold_linear_fixed_point(W, b, r_set, dt_taus, 1, 1, np.inf):
+                    distance = np.max(np.abs(r_set - r_start))
+                    if distance < distance_min:
+                        distance_min = distance
+                        r_point[:] = r_set
+            if distance_min == np.inf:
+                continue
+
+        found[i_point] = True
+        rates[i_point] = r_point
+        rate_jacobian(W, b, r_point, taus, jacobians[i_point])
+        r_start[:] = r_point
+
+    return found, rates, jacobians
+
+
+# Time derivatives of the slow variables (see ST_SLOW_START) with the rates held in state
+@jit(nopython=True, nogil=True, cache=True)
+def slow_derivatives(state, taus, d):
+    (tau_E, tau_P, tau_S, tau_plas,
+     tau_scaling_E, tau_scaling_P, tau_scaling_S,
+     tau_theta, tau_beta) = taus
 
+    E1, E2 = state[ST_E1], state[ST_E2]
+    theta1, theta2, beta1, beta2 = state[ST_THETA1], state[ST_THETA2], state[ST_BETA1], state[ST_BETA2]
+    adaptive_set_point_flag, flag_theta_local = state[ST_ADAPTIVE_SET_POINT], state[ST_THETA_LOCAL]
+
+    # Set point regulators and set points for the E populations
+    d[ST_BETA1 - ST_SLOW_START] = adaptive_set_point_flag * (1 / tau_beta) * (E1 - beta1)
+    d[ST_BETA2 - ST_SLOW_START] = adaptive_set_point_flag * (1 / tau_beta) * (E2 - beta2)
+    d[ST_THETA1 - ST_SLOW_START] = (1 / tau_theta) * (-adaptive_set_point_flag * (theta1 - beta1) + flag_theta_local * (E1 - theta1))
+    d[ST_THETA2 - ST_SLOW_START] = (1 / tau_theta) * (-adaptive_set_point_flag * (theta2 - beta2) + flag_theta_local * (E2 - theta2))
+
+    # Synaptic scaling
+    ratio_E1 = E1 / theta1; ratio_E2 = E2 / theta2
+    ss1_e = state[ST_E_SCALING] * (1 / tau_scaling_E) * (1 - ratio_E1)
+    ss2_e = state[ST_E_SCALING] * (1 / tau_scaling_E) * (1 - ratio_E2)
+    ss1_p = state[ST_P_SCALING] * (1 / tau_scaling_P) * (1 - ratio_E1)
+    ss2_p = state[ST_P_SCALING] * (1 / tau_scaling_P) * (1 - ratio_E2)
+    ss1_s = state[ST_S_SCALING] * (1 / tau_scaling_S) * (1 - ratio_E1)
+    ss2_s = state[ST_S_SCALING] * (1 / tau_scaling_S) * (1 - ratio_E2)
+
+    # Hebbian learning, active after the conditioning only without the third factor
+    heb = state[ST_HEBBIAN] * state[ST_LEARNING_RATE] * (1 / tau_plas)
+    r_baseline = state[ST_R_BASELINE]
+
+    d[ST_EE11 - ST_SLOW_START] = ss1_e * state[ST_EE11] + heb * (E1 - r_baseline) * E1
+    d[ST_EE12 - ST_SLOW_START] = ss1_e * state[ST_EE12] + heb * (E1 - r_baseline) * E2
+    d[ST_EE21 - ST_SLOW_START] = ss2_e * state[ST_EE21] + heb * (E2 - r_baseline) * E1
+    d[ST_EE22 - ST_SLOW_START] = ss2_e * state[ST_EE22] + heb * (E2 - r_baseline) * E2
+    d[ST_EP11 - ST_SLOW_START] = -ss1_p * state[ST_EP11]
+    d[ST_EP12 - ST_SLOW_START] = -ss1_p * state[ST_EP12]
+    d[ST_EP21 - ST_SLOW_START] = -ss2_p * state[ST_EP21]
+    d[ST_EP22 - ST_SLOW_START] = -ss2_p * state[ST_EP22]
+    d[ST_ES11 - ST_SLOW_START] = ss1_s * state[ST_ES11]
+    d[ST_ES12 - ST_SLOW_START] = ss1_s * state[ST_ES12]
+    d[ST_ES21 - ST_SLOW_START] = ss2_s * state[ST_ES21]
+    d[ST_ES22 - ST_SLOW_START] = ss2_s * state[ST_ES22]
+
+
+# Lower boundaries of the weights, set points and set-point regulators as in model_from_state()
+@jit(nopython=True, nogil=True, cache=True)
+def clip_slow_variables(state):
+    for i in range(ST_EE11, ST_ES22 + 1):
+        state[i] = max(state[i], 0)
+    state[ST_THETA1] = max(state[ST_THETA1], 1e-10); state[ST_THETA2] = max(state[ST_THETA2], 1e-10)
+    state[ST_BETA1] = max(state[ST_BETA1], 0); state[ST_BETA2] = max(state[ST_BETA2], 0)
+
+
+# One step of Heun's method of h seconds for the slow variables, with the rates on their fixed point. The state is left
+# unchanged and False is returned if the fixed point is not valid during the step (see rates_fixed_point()).
+@jit(nopython=True, nogil=True, cache=True)
+def slow_step(state, h, weights, g, taus, rheobases, delta_t, exponential_euler=False):
+    state_0 = state.copy()
+    d_0 = np.empty(ST_SLOW_STOP - ST_SLOW_START); d_1 = np.empty(ST_SLOW_STOP - ST_SLOW_START)
+
+    valid = rates_fixed_point(state, weights, g, taus, rheobases, delta_t, exponential_euler)
+    if valid:
+        slow_derivatives(state, taus, d_0)
+        state[ST_SLOW_START:ST_SLOW_STOP] = state_0[ST_SLOW_START:ST_SLOW_STOP] + h * d_0
+        clip_slow_variables(state)
+        valid = rates_fixed_point(state, weights, g, taus, rheobases, delta_t, exponential_euler)
+    if valid:
+        slow_derivatives(state, taus, d_1)
+        state[ST_SLOW_START:ST_SLOW_STOP] = state_0[ST_SLOW_START:ST_SLOW_STOP] + 0.5 * h * (d_0 + d_1)
+        clip_slow_variables(state)
+        valid = rates_fixed_point(state, weights, g, taus, rheobases, delta_t, exponential_euler)
+
+    if not valid:
+        state[:] = state_0
+    return valid
+
+
+##### Long-time limit of the slow variables
+# slow_fixed_point() finds where synaptic scaling, the set points and their regulators end up, the fixed point of the
+# slow variables with the rates on their fixed point, without simulating the days it takes to reach it. The fixed
+# points are not isolated (e.g. with the adaptive set points, theta = beta = E for any E), so Newton's method has a
+# singular Jacobian. Pseudo-transient continuation is used instead: implicit Euler steps of the slow dynamics with a
+# step h growing as the derivatives shrink, which follow the trajectory from the given state while h is small and
+# become Newton steps as h grows. The fixed point reached is the one the simulation converges to.
+
+# Outcomes of slow_fixed_point(): the fixed point is found, there is none on the way (the rates have no valid fixed
+# point, i.e. the network explodes or falls silent, or the slow variables grow without bound), or it is not found
+# within the iterations
+ENDPOINT_CONVERGED, ENDPOINT_NONE, ENDPOINT_NOT_CONVERGED = range(3)
+
+
+# Time derivatives d of the slow variables with the rates on their fixed point (see rates_fixed_point()), zero for the
+# variables held at their lower boundary (see clip_slow_variables()). Returns False if the rates have no valid fixed
+# point.
+@jit(nopython=True, nogil=True, cache=True)
+def slow_residual(state, weights, g, taus, rheobases, delta_t, d, exponential_euler=False):
+    if not rates_fixed_point(state, weights, g, taus, rheobases, delta_t, exponential_euler):
+        return False
+    slow_derivatives(state, taus, d)
+    for i in range(ST_SLOW_START, ST_SLOW_STOP):
+        bound = 1e-10 if i == ST_THETA1 or i == ST_THETA2 else 0
+        if state[i] <= bound and d[i - ST_SLOW_START] < 0:
+            d[i - ST_SLOW_START] = 0
+    return True
+
+
+# Largest derivative of the slow variables relative to their value, absolute for values below 1 (in 1/s)
+@jit(nopython=True, nogil=True, cache=True)
+def slow_residual_norm(state, d):
+    norm = 0.
+    for i in range(ST_SLOW_START, ST_SLOW_STOP):
+        norm = max(norm, abs(d[i - ST_SLOW_START]) / max(abs(state[i]), 1))
+    return norm
+
+
+# Moves the slow variables of state to their fixed point, starting from the ones in state (e.g. after the
+# conditioning), and returns (outcome, iterations, residual) with the outcome ENDPOINT_*, and the residual
+# (slow_residual_norm()) reached. The fixed point is found if the residual is below tolerance. h_start is the first
+# step in seconds, the step grows by twice the factor the residual shrinks by (at most 10 per iteration) and shrinks
+# tenfold if the rates have no valid fixed point after it or if a slow variable changes by more than max_change
+# relative to its value (to 0.1 for smaller values). The latter keeps the steps on the trajectory, which matters as
+# the fixed points are not isolated. The outcome is ENDPOINT_NONE if the step falls below h_min, i.e. the trajectory
+# itself leaves the valid fixed points of the rates.
+@jit(nopython=True, nogil=True, cache=True)
+def slow_fixed_point(state, weights, g, taus, rheobases, delta_t, tolerance=1e-10, max_iterations=2000, h_start=20.,
+                     h_min=1e-2, h_max=1e12, max_change=0.01, exponential_euler=False):
+    n = ST_SLOW_STOP - ST_SLOW_START
+    d = np.empty(n); d_new = np.empty(n)
+    J = np.empty((n, n)); A = np.empty((n, n)); rhs = np.empty(n); dx = np.empty(n)
+    state_new = state.copy()
+
+    if not slow_residual(state, weights, g, taus, rheobases, delta_t, d, exponential_euler):
+        return ENDPOINT_NONE, 0, np.inf
+    residual = slow_residual_norm(state, d)
+    h = h_start
+
+    for iteration in range(max_iterations):
+        if residual <= tolerance:
+            return ENDPOINT_CONVERGED, iteration, residual
+
+        # Jacobian of the derivatives by forward differences, backward ones next to an invalid fixed point
+        for j in range(n):
+            x_j = state[ST_SLOW_START + j]
+            eps = 1e-7 * max(abs(x_j), 1e-3)
+            state_new[:] = state
+            state_new[ST_SLOW_START + j] = x_j + eps
+            if not slow_residual(state_new, weights, g, taus, rheobases, delta_t, d_new, exponential_euler):
+                eps = -eps
+                state_new[:] = state
+                state_new[ST_SLOW_START + j] = x_j + eps
+                if not slow_residual(state_new, weights, g, taus, rheobases, delta_t, d_new, exponential_euler):
+                    d_new[:] = d
+            for i in range(n):
+                J[i, j] = (d_new[i] - d[i]) / eps
+
+        # Implicit Euler step (I - h J) dx = h d, shortened until the rates have a valid fixed point after it
+        while True:
+            for i in range(n):
+                for j in range(n):
+                    A[i, j] = -h * J[i, j]
+                A[i, i] += 1
+                rhs[i] = h * d[i]
+            if solve_linear(A, rhs, dx):
+                state_new[:] = state
+                state_new[ST_SLOW_START:ST_SLOW_STOP] += dx
+                clip_slow_variables(state_new)
+                change = 0.
+                for i in range(ST_SLOW_START, ST_SLOW_STOP):
+                    change = max(change, abs(state_new[i] - state[i]) / max(abs(state[i]), 0.1))
+                if change <= max_change and slow_residual(state_new, weights, g, taus, rheobases, delta_t, d_new,
+                                                          exponential_euler):
+                    break
+            h = 0.1 * h
+            if h < h_min:
+                return ENDPOINT_NONE, iteration, residual
+
+        if np.max(state_new[ST_SLOW_START:ST_SLOW_STOP]) > 1e6:
+            state[:] = state_new
+            return ENDPOINT_NONE, iteration + 1, slow_residual_norm(state_new, d_new)
+
+        # Switched evolution relaxation: the step grows as the residual shrinks, and doubles while it stays the same
+        residual_new = slow_residual_norm(state_new, d_new)
+        h = min(h * min(max(2 * residual / max(residual_new, 1e-300), 0.1), 10), h_max)
+        state[:] = state_new
+        d[:] = d_new
+        residual = residual_new
+
+    if residual <= tolerance:
+        return ENDPOINT_CONVERGED, max_iterations, residual
+    return ENDPOINT_NOT_CONVERGED, max_iterations, residual
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def model_qss(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
+              g_stim, stim_times, taus, beta_K, rheobases,
+              flags=(0, 0, 0, 0, 0, 0), flags_theta = (1,1), delta_t_slow=20., exponential_euler=False,
+              recorder=None, reductions=None):
+
+    state = initial_state(weights)
+    return model_qss_from_state(state, sim_duration, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                                g_stim, stim_times, taus, beta_K, rheobases, flags=flags, flags_theta=flags_theta,
+                                delta_t_slow=delta_t_slow, exponential_euler=exponential_euler, recorder=recorder,
+                                reductions=reductions)
+
+
+# Counterpart of model_from_state() integrating the time between the registration windows of the conditioning and the
+# test on the slow manifold. The data of phase 2 is registered at the same time steps as in model_from_state(). Where
+# the rates have no valid fixed point (e.g. the network explodes or falls silent), the step is simulated with the
+# Euler steps of model_from_state() instead, which also stops the simulation in these cases. The recorder and the
+# reductions only sample the time simulated with Euler steps, e.g. the registration windows of the test.
+@jit(nopython=True, nogil=True, cache=True)
+def model_qss_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                         g_stim, stim_times, taus, beta_K, rheobases,
+                         flags=(0, 0, 0, 0, 0, 0), flags_theta = (1,1), delta_t_slow=20., exponential_euler=False,
+                         recorder=None, reductions=None):
 
-        ### Calculating the firing rates at this timestep
-        I1 = g_E - EP110 * P01 - EP120 * P02 - ES110 * S01 - ES120 * S02 + EE110 * E01 + EE120 * E02 + stimulus_E1
-        I2 = g_E - EP210 * P01 - EP220 * P02 - ES210 * S01 - ES220 * S02 + EE210 * E01 + EE220 * E02 + stimulus_E2
-
-        E1 = E01 + delta_t*(1/tau_E)*(-E01 + np.maximum(0,I1 - rheobase_E))
-        E2 = E02 + delta_t*(1/tau_E)*(-E02 + np.maximum(0,I2 - rheobase_E))
-
-        P1 = P01 + delta_t*(1/tau_P)*(-P01 + np.maximum(0, w_PEii * E01 + w_PEij * E02 - w_PSii * S01 - w_PSij * S02
-                                                         -w_PPii * P01 - w_PPij * P02 + g_P - rheobase_P + stimulus_P1))
-        P2 = P02 + delta_t*(1/tau_P)*(-P02 + np.maximum(0, w_PEij * E01 + w_PEii * E02 - w_PSij * S01 - w_PSii * S02
-                                                         -w_PPij * P01 - w_PPii * P02 + g_P - rheobase_P + stimulus_P2))
-
-        S1 = S01 + delta_t*(1/tau_S)*(-S01 + np.maximum(0, w_SEii * E01 + w_SEij * E02 + g_S - rheobase_S + stimulus_S1))
-        S2 = S02 + delta_t*(1/tau_S)*(-S02 + np.maximum(0, w_SEij * E01 + w_SEii * E02 + g_S - rheobase_S + stimulus_S2))
-
-        # Firing rates, set-points and set-point regulators cannot go below 0
-        E1 = max(E1, 0); E2 = max(E2, 0)
-        P1 = max(P1, 0); P2 = max(P2, 0)
-        S1 = max(S1, 0); S2 = max(S2, 0)
-        beta1=max(beta1,0); beta2=max(beta2, 0)
-        theta1=max(theta1,1e-10); theta2=max(theta2, 1e-10) # Nonzero lower boundary to prevent zero division in scaling equation
-
-
-        ### Calculating the plasticity for this timestep
-        # Set point regulators for the E populations
-        beta1 = beta1 + adaptive_set_point_flag*delta_t * (1 / tau_beta) * (E1 - beta1)
-        beta2 = beta2 + adaptive_set_point_flag*delta_t * (1 / tau_beta) * (E2 - beta2)
-
-        # Set points for the E populations
-        theta1 = theta1 + delta_t * (1 / tau_theta) * \
-                   (-adaptive_set_point_flag*(theta1 - beta1) + flag_theta_local*(E1 - theta1))
-        theta2 = theta2 + delta_t * (1 / tau_theta) * \
-                   (-adaptive_set_point_flag*(theta2 - beta2) + flag_theta_local*(E2 - theta2))
-
-        # Ratios in the synaptic scaling equations are calculated
-        ratio_E1 = E1 / theta1; ratio_E2 = E2 / theta2
-
-        # Synaptic scaling terms are calculated and applied
-        ss1_e = E_scaling_flag * delta_t * (1 / tau_scaling_E) * ((1 - ratio_E1))
-        ss2_e = E_scaling_flag * delta_t * (1 / tau_scaling_E) * ((1 - ratio_E2))
-
-        ss1_p = P_scaling_flag*delta_t * (1 / tau_scaling_P) * ((1 - ratio_E1))
-        ss2_p = P_scaling_flag*delta_t * (1 / tau_scaling_P) * ((1 - ratio_E2))
-
-        ss1_s = S_scaling_flag*delta_t * (1 / tau_scaling_S) * ((1 - ratio_E1))
-        ss2_s = S_scaling_flag*delta_t * (1 / tau_scaling_S) * ((1 - ratio_E2))
-
-        EE110 = EE110 + ss1_e*EE110
-        EE120 = EE120 + ss1_e*EE120
-        EE210 = EE210 + ss2_e*EE210
-        EE220 = EE220 + ss2_e*EE220
-        EP11  = EP110 - ss1_p*EP110
-        EP12  = EP120 - ss1_p*EP120
-        EP21  = EP210 - ss2_p*EP210
-        EP22  = EP220 - ss2_p*EP220
-        ES11  = ES110 + ss1_s*ES110
-        ES12  = ES120 + ss1_s*ES120
-        ES21  = ES210 + ss2_s*ES210
-        ES22  = ES220 + ss2_s*ES220
-
-        # Hebbian terms are calculated and applied
-        heb_term11 = hebbian_flag * learning_rate * delta_t * (1 / tau_plas) * (E1 - r_baseline) * E1
-        heb_term12 = hebbian_flag * learning_rate * delta_t * (1 / tau_plas) * (E1 - r_baseline) * E2
-        heb_term21 = hebbian_flag * learning_rate * delta_t * (1 / tau_plas) * (E2 - r_baseline) * E1
-        heb_term22 = hebbian_flag * learning_rate * delta_t * (1 / tau_plas) * (E2 - r_baseline) * E2
-
-        EE11 = EE110 + heb_term11
-        EE12 = EE120 + heb_term12
-        EE21 = EE210 + heb_term21
-        EE22 = EE220 + heb_term22
-
-        # Lower bondary is applied to the weights
-        EE11 = max(0,EE11);EE12 = max(0,EE12)
-        EE21 = max(0,EE21);EE22 = max(0,EE22)
-        EP11 = max(0,EP11);EP12 = max(0,EP12)
-        EP21 = max(0,EP21);EP22 = max(0,EP22)
-        ES11 = max(0,ES11);ES12 = max(0,ES12)
-        ES21 = max(0,ES21);ES22 = max(0,ES22)
-
-        # Placeholder parameters are freed
-        E01 = E1; E02 = E2; P01 = P1; P02 = P2; S01 = S1; S02 = S2
-        EE110=EE11; EE120=EE12; EE210=EE21; EE220=EE22
-        EP110=EP11; EP120=EP12; EP210=EP21; EP220=EP22
-        ES110=ES11; ES120=ES12; ES210=ES21; ES220=ES22
-
-        # update the data-holder counters
-        counter1 = counter1 + 1; counter2 = counter2 + 1; counter3 = counter3 + 1
+    (sampling_rate_stim, sampling_rate_sim) = sampling_rate
+    (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+    (J_exc_phase1, J_phase2) = l_res_weights
+
+    # The slow period starts after the time step closing the registration window of the conditioning and ends before
+    # the one opening the registration window of the test
+    step_slow_start = int((stim_times[0][1] + 5 + 2) * (1 / delta_t)) + 1
+    step_slow_stop = step_stop
+    if stim_times.shape[0] > 1:
+        step_slow_stop = min(step_stop, int((stim_times[1][0] - 5 + 2) * (1 / delta_t)))
+    steps_slow = max(1, int(delta_t_slow * (1 / delta_t)))
+
+    step = int(state[ST_STEP])
+    if step < step_slow_start:
+        step = min(step_slow_start, step_stop)
+        model_from_state(state, step, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                         g_stim, stim_times, taus, beta_K, rheobases, flags=flags, flags_theta=flags_theta,
+                         exponential_euler=exponential_euler, recorder=recorder, reductions=reductions)
+        if state[ST_STEP] != step:
+            return exit_status(state, delta_t)
+
+    while step < step_slow_stop:
+        n_steps = min(steps_slow, step_slow_stop - step)
+
+        # Data is registered and the step ends at the next registration of phase 2
+        counter2 = int(state[ST_COUNTER2])
+        if state[ST_STIM_APPLIED] == 1 and counter2 <= sampling_rate_sim:
+            if counter2 == sampling_rate_sim:
+                i_2 = int(state[ST_I2])
+                if i_2 < r_phase2.shape[1]:
+                    r_phase2[:6, i_2] = state[ST_E1:ST_S2 + 1]
+                    r_phase2[6:, i_2] = state[ST_THETA1:ST_BETA2 + 1]
+                    J_phase2[:, i_2] = state[ST_EE11:ST_ES22 + 1]
+                state[ST_I2] = i_2 + 1
+                state[ST_COUNTER2] = 0
+                counter2 = 0
+            n_steps = min(n_steps, sampling_rate_sim - counter2)
+
+        if slow_step(state, n_steps * delta_t, weights, g, taus, rheobases, delta_t, exponential_euler):
+            state[ST_COUNTER1] += n_steps; state[ST_COUNTER2] += n_steps; state[ST_COUNTER3] += n_steps
+            state[ST_STEP] = step + n_steps
+            if state[ST_E1] > state[ST_MAX_E]:
+                state[ST_MAX_E] = state[ST_E1]
+                max_E[0] = state[ST_E1]
+        else:
+            model_from_state(state, step + n_steps, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                             g_stim, stim_times, taus, beta_K, rheobases, flags=flags, flags_theta=flags_theta,
+                             exponential_euler=exponential_euler, recorder=recorder, reductions=reductions)
+            if state[ST_STEP] != step + n_steps:
+                return exit_status(state, delta_t)
+        step = step + n_steps
+
+    if step < step_stop:
+        model_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                         g_stim, stim_times, taus, beta_K, rheobases, flags=flags, flags_theta=flags_theta,
+                         exponential_euler=exponential_euler, recorder=recorder, reductions=reductions)
+    return exit_status(state, delta_t)
+
+
+##### Events of the simulation protocol on the state vector
+# apply_events() carries out what the loop of model_from_state() does at the top of a segment between two events (see
+# next_event_step()), on the state vector instead of the local variables of the loop.
+
+
+# Applies the events of the time step step to state (see the loop of model_from_state()), registers the data and
+# returns False if the simulation stops at this time step
+@jit(nopython=True, nogil=True, cache=True)
+def apply_events(state, step, sampling_rate, l_res_rates, l_res_weights, g_stim, stim_steps, phase_steps, beta_K,
+                 flags, flags_theta):
+    (sampling_rate_stim, sampling_rate_sim) = sampling_rate
+    (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+    (J_exc_phase1, J_phase2) = l_res_weights
+    (g_stim_E, g_stim_P, g_stim_S) = g_stim
+
+    stim_applied = int(state[ST_STIM_APPLIED])
+    stim_index = int(state[ST_STIM_INDEX])
+
+    ### If it is the start of the stimulation
+    if step == stim_steps[stim_index, 0]:
+        # If it is the first stimuli (conditioning)
+        if stim_applied == 0:
+            r_baseline = state[ST_E1]
+            state[ST_R_BASELINE] = r_baseline
+            (state[ST_HEBBIAN], state[ST_THREE_FACTOR], state[ST_ADAPTIVE_SET_POINT],
+             state[ST_E_SCALING], state[ST_P_SCALING], state[ST_S_SCALING]) = flags
+            (state[ST_THETA_SHIFT], state[ST_THETA_LOCAL]) = flags_theta
+
+            if state[ST_ADAPTIVE_SET_POINT] == 1:
+                state[ST_THETA1], state[ST_THETA2] = r_baseline, r_baseline
+                state[ST_BETA1], state[ST_BETA2] = r_baseline - beta_K, r_baseline - beta_K
+            else:
+                state[ST_THETA1], state[ST_THETA2] = r_baseline - beta_K, r_baseline - beta_K
+                state[ST_BETA1], state[ST_BETA2] = r_baseline, r_baseline
+
+            # Hebbian learning is activated at conditioning onset
+            if state[ST_HEBBIAN]:
+                state[ST_LEARNING_RATE] = 1
+
+        if stim_applied == 1:  # If it is the second stimuli (testing)
+            # Stop the data-holder counter by setting the counter2 to a high value
+            state[ST_COUNTER2] = sampling_rate_sim + 5
+
+        # Stimulation of the selected cells for the respected stimuli is set
+        state[ST_STIM_E1], state[ST_STIM_E2] = g_stim_E[stim_applied]
+        state[ST_STIM_P1], state[ST_STIM_P2] = g_stim_P[stim_applied]
+        state[ST_STIM_S1], state[ST_STIM_S2] = g_stim_S[stim_applied]
+
+        stim_applied = stim_applied + 1
+        state[ST_STIM_APPLIED] = stim_applied
+
+    ### If it is the end of the stimulation
+    if step == stim_steps[stim_index, 1]:
+        # The offset of the conditioning
+        if stim_applied == 1:
+            state[ST_COUNTER2] = sampling_rate_sim  # Start the data-holder counter
+
+        # Hebbian learning is turned off due to the third factor
+        if state[ST_THREE_FACTOR]:
+            state[ST_LEARNING_RATE] = 0
+
+        # All stimuli are turned off
+        state[ST_STIM_E1:ST_STIM_S2 + 1] = 0
+
+        # Set the new timing for the next stim if exists
+        if stim_steps.shape[0] > stim_applied:
+            state[ST_STIM_INDEX] = stim_applied
+
+    # setting the counters for phase 1 and 3 with 5 seconds of
+    if step == phase_steps[0]:
+        state[ST_COUNTER1] = sampling_rate_stim  # Start the data-holder counter1
+        state[ST_PHASE1] = 1
+    elif step == phase_steps[1]:
+        state[ST_PHASE1] = 0
+    elif step == phase_steps[2]:
+        state[ST_COUNTER3] = sampling_rate_stim  # Start the data-holder counter3
+        state[ST_PHASE3] = 1
+    elif step == phase_steps[3]:
+        state[ST_PHASE3] = 0
+
+    ### Data is registered to the arrays
+    if state[ST_PHASE1] and state[ST_COUNTER1] == sampling_rate_stim:
+        i_1 = int(state[ST_I1])
+        if i_1 < r_phase1.shape[1]:
+            r_phase1[:, i_1] = state[ST_E1:ST_S2 + 1]
+            J_exc_phase1[:, i_1] = state[ST_EE11:ST_EE22 + 1]
+        state[ST_I1] = i_1 + 1
+        state[ST_COUNTER1] = 0  # restart
+
+    elif state[ST_PHASE3] and state[ST_COUNTER3] == sampling_rate_stim:
+        i_3 = int(state[ST_I3])
+        if i_3 < r_phase3.shape[1]:
+            r_phase3[:, i_3] = state[ST_E1:ST_S2 + 1]
+        state[ST_I3] = i_3 + 1
+        state[ST_COUNTER3] = 0  # restart
+
+    if stim_applied == 1 and state[ST_COUNTER2] == sampling_rate_sim:
+        # The sample taken during the conditioning is dropped if it doesn't fit into the arrays (see model_from_state())
+        i_2 = int(state[ST_I2])
+        if i_2 < r_phase2.shape[1]:
+            r_phase2[:6, i_2] = state[ST_E1:ST_S2 + 1]
+            r_phase2[6:, i_2] = state[ST_THETA1:ST_BETA2 + 1]
+            J_phase2[:, i_2] = state[ST_EE11:ST_ES22 + 1]
+        state[ST_I2] = i_2 + 1
+        state[ST_COUNTER2] = 0  # restart
+
+    if state[ST_E1] > state[ST_MAX_E]:
+        state[ST_MAX_E] = state[ST_E1]
+    max_E[0] = state[ST_MAX_E]
+
+    # if the system explodes or falls silent, stop the simulation
+    return not (state[ST_E1] > 1000 or state[ST_E1] == 0)
+
+
+##### Adaptive integration with an embedded Runge-Kutta pair
+# model_rk() integrates the dynamics of model() as ordinary differential equations with the Bogacki-Shampine 3(2) pair
+# and local error control instead of the Euler steps of delta_t. The time steps of the protocol (stimulus onsets and
+# offsets, data registrations, see next_event_step()) are hard breakpoints, so the step size shrinks around the stimuli
+# and grows in between. As an explicit method, the step size stays bounded by the stability of the fast rate dynamics
+# (around 10 ms), which is still about 100 times fewer steps than the Euler steps of 0.1 ms.
+
+# Time derivatives of the dynamical variables of model() (rates, plastic weights, set points and their regulators,
+# ST_E1 to ST_BETA2) for the state held in state
+@jit(nopython=True, nogil=True, cache=True)
+def derivatives(state, d, weights, g, taus, rheobases):
+    (w_EEii, w_EPii, w_ESii, w_PEii, w_PPii, w_PSii, w_SEii,
+     w_EEij, w_EPij, w_ESij, w_PEij, w_PPij, w_PSij, w_SEij) = weights
+    (g_E, g_P, g_S) = g
+    (rheobase_E, rheobase_P, rheobase_S) = rheobases
+    (tau_E, tau_P, tau_S) = taus[0], taus[1], taus[2]
+
+    E1, E2, P1, P2, S1, S2 = state[ST_E1], state[ST_E2], state[ST_P1], state[ST_P2], state[ST_S1], state[ST_S2]
+
+    I1 = (g_E - state[ST_EP11] * P1 - state[ST_EP12] * P2 - state[ST_ES11] * S1 - state[ST_ES12] * S2
+          + state[ST_EE11] * E1 + state[ST_EE12] * E2 + state[ST_STIM_E1])
+    I2 = (g_E - state[ST_EP21] * P1 - state[ST_EP22] * P2 - state[ST_ES21] * S1 - state[ST_ES22] * S2
+          + state[ST_EE21] * E1 + state[ST_EE22] * E2 + state[ST_STIM_E2])
+
+    d[ST_E1] = (1/tau_E)*(-E1 + max(0, I1 - rheobase_E))
+    d[ST_E2] = (1/tau_E)*(-E2 + max(0, I2 - rheobase_E))
+    d[ST_P1] = (1/tau_P)*(-P1 + max(0, w_PEii * E1 + w_PEij * E2 - w_PSii * S1 - w_PSij * S2
+                                    - w_PPii * P1 - w_PPij * P2 + g_P - rheobase_P + state[ST_STIM_P1]))
+    d[ST_P2] = (1/tau_P)*(-P2 + max(0, w_PEij * E1 + w_PEii * E2 - w_PSij * S1 - w_PSii * S2
+                                    - w_PPij * P1 - w_PPii * P2 + g_P - rheobase_P + state[ST_STIM_P2]))
+    d[ST_S1] = (1/tau_S)*(-S1 + max(0, w_SEii * E1 + w_SEij * E2 + g_S - rheobase_S + state[ST_STIM_S1]))
+    d[ST_S2] = (1/tau_S)*(-S2 + max(0, w_SEij * E1 + w_SEii * E2 + g_S - rheobase_S + state[ST_STIM_S2]))
+
+    slow_derivatives(state, taus, d[ST_SLOW_START:ST_SLOW_STOP])
+
+
+# Lower boundaries of the dynamical variables of model()
+@jit(nopython=True, nogil=True, cache=True)
+def clip_state(state, weights, g, taus, rheobases):
+    for i in range(ST_E1, ST_S2 + 1):
+        state[i] = max(state[i], 0)
+    clip_slow_variables(state)
+
+
+def model_derivatives(state, d, model_args):
+    pass
+
+
+def model_clip_state(state, model_args):
+    pass
+
+
+# The time derivatives and the lower boundaries of model() for model_args = (weights, g, taus, rheobases), and of
+# model_3_compartmental_v3() for model_args = (weights, g, taus, rheobases, lambdas), chosen when rk_integrate() is
+# compiled. Unlike functions passed as arguments, these keep the kernels cacheable (cache=True).
+@overload(model_derivatives)
+def model_derivatives_overload(state, d, model_args):
+    if len(model_args) == 4:
+        return lambda state, d, model_args: derivatives(state, d, *model_args)
+    return lambda state, d, model_args: derivatives_3_compartmental_v3(state, d, *model_args)
+
+
+@overload(model_clip_state)
+def model_clip_state_overload(state, model_args):
+    if len(model_args) == 4:
+        return lambda state, model_args: clip_state(state, *model_args)
+    return lambda state, model_args: clip_state_3_compartmental_v3(state, *model_args)
+
+
+# Integrates the first n_dynamic entries of state (with the time derivatives and the lower boundaries of the model of
+# model_args, see model_derivatives() and model_clip_state()) over duration seconds with the Bogacki-Shampine 3(2) pair, starting with the step size h.
+# The step size is adapted to keep the local error below atol + rtol * |y| for every variable. The maximum of E1 (the
+# first entry of state) is held at state[index_max_E] and the integration stops early if E1 goes above 1000, or reaches
+# zero with stop_at_zero, as the simulation stops there. Returns the integrated time, the step size for the next
+# integration and the number of accepted and rejected steps.
+@jit(nopython=True, nogil=True, cache=True)
+def rk_integrate(state, n_dynamic, index_max_E, duration, h, rtol, atol, max_step, stop_at_zero, model_args):
+    y_0 = state[:n_dynamic].copy()
+    state_stage = state.copy()
+    k_1 = np.zeros(n_dynamic); k_2 = np.zeros(n_dynamic); k_3 = np.zeros(n_dynamic); k_4 = np.zeros(n_dynamic)
+    n_accepted, n_rejected = 0, 0
+
+    model_derivatives(state, k_1, model_args)
+    t = 0.
+    while t < duration:
+        h = min(h, max_step)
+        last = h >= duration - t
+        if last:
+            h = duration - t
+
+        state_stage[:n_dynamic] = y_0 + 0.5 * h * k_1
+        model_derivatives(state_stage, k_2, model_args)
+        state_stage[:n_dynamic] = y_0 + 0.75 * h * k_2
+        model_derivatives(state_stage, k_3, model_args)
+        state_stage[:n_dynamic] = y_0 + h * (2 / 9 * k_1 + 1 / 3 * k_2 + 4 / 9 * k_3)
+        model_derivatives(state_stage, k_4, model_args)
+
+        # Difference of the third and second order solutions
+        error = 0.
+        for i in range(n_dynamic):
+            error_i = h * (-5 / 72 * k_1[i] + 1 / 12 * k_2[i] + 1 / 9 * k_3[i] - 1 / 8 * k_4[i])
+            scale = atol + rtol * max(abs(y_0[i]), abs(state_stage[i]))
+            error = max(error, abs(error_i) / scale)
+
+        factor = 5. if error == 0 else min(5., max(0.2, 0.9 * error ** (-1 / 3)))
+        if error <= 1:
+            n_accepted += 1
+            t = duration if last else t + h
+            state[:n_dynamic] = state_stage[:n_dynamic]
+            model_clip_state(state, model_args)
+            y_0[:] = state[:n_dynamic]
+            state_stage[:] = state
+
+            if state[0] > state[index_max_E]:
+                state[index_max_E] = state[0]
+            if state[0] > 1000 or (stop_at_zero and state[0] == 0):
+                break
+            model_derivatives(state, k_1, model_args)
+        else:
+            n_rejected += 1
+            state_stage[:n_dynamic] = y_0
+        h = h * factor
+
+    return t, h, n_accepted, n_rejected
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def model_rk(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
+             g_stim, stim_times, taus, beta_K, rheobases,
+             flags=(0, 0, 0, 0, 0, 0), flags_theta = (1,1), rtol=1e-6, atol=1e-9, max_step=np.inf, recorder=None,
+             reductions=None):
+
+    state = initial_state(weights)
+    return model_rk_from_state(state, sim_duration, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                               g_stim, stim_times, taus, beta_K, rheobases, flags=flags, flags_theta=flags_theta,
+                               rtol=rtol, atol=atol, max_step=max_step, recorder=recorder, reductions=reductions)
+
+
+# Counterpart of model_from_state() with adaptive Runge-Kutta steps (see rk_integrate()). The events of the protocol
+# and the data registrations take place at the same time steps of delta_t as in model_from_state(), the dynamics are
+# integrated in between. The maximum step size is max_step seconds, the local error is kept below atol + rtol * |y|.
+# Returns the status of the simulation (see exit_status()) as model_from_state() does, the numbers of accepted and
+# rejected steps are added up in state. The time steps of the recorder and the reductions are breakpoints of the
+# integration as well.
+@jit(nopython=True, nogil=True, cache=True)
+def model_rk_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g,
+                        g_stim, stim_times, taus, beta_K, rheobases,
+                        flags=(0, 0, 0, 0, 0, 0), flags_theta = (1,1), rtol=1e-6, atol=1e-9, max_step=np.inf,
+                        recorder=None, reductions=None):
+
+    (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+    (stim_steps, phase_steps) = event_steps(delta_t, stim_times)
+    h = delta_t
+
+    step = int(state[ST_STEP])
+    while step < step_stop:
+        if not apply_events(state, step, sampling_rate, l_res_rates, l_res_weights, g_stim, stim_steps, phase_steps,
+                            beta_K, flags, flags_theta):
+            break
+
+        if recorder is not None and is_record_step(recorder[1], step):
+            record(recorder, step, state)
+        if reductions is not None and is_reduction_step(reductions, step):
+            reduce(reductions, step, state)
+
+        step_next = next_event_step(step, step_stop, sampling_rate, stim_steps, phase_steps, int(state[ST_STIM_INDEX]),
+                                    state[ST_COUNTER1], state[ST_COUNTER2], state[ST_COUNTER3])
+        if recorder is not None:
+            step_next = next_record_step(recorder[1], step, step_next)
+        if reductions is not None:
+            step_next = next_reduction_step(reductions, step, step_next)
+        duration = (step_next - step) * delta_t
+        t, h, n_accepted_segment, n_rejected_segment = rk_integrate(state, ST_BETA2 + 1, ST_MAX_E, duration, h, rtol,
+                                                                    atol, max_step, True, (weights, g, taus, rheobases))
+        state[ST_RK_ACCEPTED] += n_accepted_segment; state[ST_RK_REJECTED] += n_rejected_segment
+        max_E[0] = state[ST_MAX_E]
+
+        # The simulation stopped within the segment
+        if t < duration:
+            step_next = step + int(t * (1 / delta_t))
+        state[ST_COUNTER1] += step_next - step; state[ST_COUNTER2] += step_next - step; state[ST_COUNTER3] += step_next - step
+        step = step_next
+        if t < duration:
+            break
+
+    state[ST_STEP] = step
+    state[ST_EXIT_REASON] = EXIT_STEP_STOP
+    if step < step_stop:
+        state[ST_EXIT_REASON] = EXIT_EXPLODED if state[ST_E1] > 1000 else EXIT_SILENT
+    return exit_status(state, delta_t)
+
+
+# Layout of the state vector of model_3_compartmental_v3(), see the layout of model() above
+(ST3_E1, ST3_E2, ST3_P1, ST3_P2, ST3_S1, ST3_S2,
+ ST3_I_AD1, ST3_I_AD2, ST3_I_BD1, ST3_I_BD2, ST3_I_E1, ST3_I_E2,
+ ST3_DE11, ST3_DE12, ST3_DE21, ST3_DE22,
+ ST3_EE11, ST3_EE12, ST3_EE21, ST3_EE22,
+ ST3_EP11, ST3_EP12, ST3_EP21, ST3_EP22,
+ ST3_DSA11, ST3_DSA12, ST3_DSA21, ST3_DSA22,
+ ST3_DSB11, ST3_DSB12, ST3_DSB21, ST3_DSB22,
+ ST3_THETA_AD1, ST3_THETA_AD2, ST3_THETA_BD1, ST3_THETA_BD2, ST3_THETA_E1, ST3_THETA_E2,
+ ST3_BETA_AD1, ST3_BETA_AD2, ST3_BETA_BD1, ST3_BETA_BD2, ST3_BETA_E1, ST3_BETA_E2,
+ ST3_A_BASE1, ST3_A_BASE2, ST3_B_BASE1, ST3_B_BASE2,
+ ST3_LEARNING_RATE,
+ ST3_STIM_E1, ST3_STIM_E2, ST3_STIM_P1, ST3_STIM_P2, ST3_STIM_S1, ST3_STIM_S2,
+ ST3_HEBBIAN, ST3_THREE_FACTOR, ST3_ADAPTIVE_SET_POINT, ST3_E_SCALING, ST3_P_SCALING, ST3_S_SCALING,
+ ST3_THETA_SHIFT, ST3_THETA_LOCAL,
+ ST3_STIM_APPLIED, ST3_STIM_INDEX,
+ ST3_PHASE1, ST3_PHASE3, ST3_COUNTER1, ST3_COUNTER2, ST3_COUNTER3, ST3_I1, ST3_I2, ST3_I3,
+ ST3_MAX_E, ST3_STEP,
+ ST3_EXIT_REASON, ST3_N_CLAMPS, ST3_RK_ACCEPTED, ST3_RK_REJECTED,
+ ST3_CONVERGED_STEP, ST3_REFERENCE_I2) = range(81)
+# The entries ST3_DE11 to ST3_BETA_E2 of the last check of the convergence of phase 2 (see check_convergence())
+ST3_REFERENCE = 81
+N_STATE_3_COMPARTMENTAL = 113
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def initial_state_3_compartmental_v3(weights):
+    (w_DEii, w_EEii, w_EPii, w_DSii, w_PEii, w_PPii, w_PSii, w_SEii,
+     w_DEij, w_EEij, w_EPij, w_DSij, w_PEij, w_PPij, w_PSij, w_SEij) = weights
+
+    state = np.zeros(N_STATE_3_COMPARTMENTAL)
+
+    # The initial rates and currents are arbitrarily set to 1
+    state[ST3_E1:ST3_I_E2 + 1] = 1
+    state[ST3_DE11] = w_DEii; state[ST3_DE12] = w_DEij; state[ST3_DE21] = w_DEij; state[ST3_DE22] = w_DEii
+    state[ST3_EE11] = w_EEii; state[ST3_EE12] = w_EEij; state[ST3_EE21] = w_EEij; state[ST3_EE22] = w_EEii
+    state[ST3_EP11] = w_EPii; state[ST3_EP12] = w_EPij; state[ST3_EP21] = w_EPij; state[ST3_EP22] = w_EPii
+    state[ST3_DSA11] = w_DSii; state[ST3_DSA12] = w_DSij; state[ST3_DSA21] = w_DSij; state[ST3_DSA22] = w_DSii
+    state[ST3_DSB11] = w_DSii; state[ST3_DSB12] = w_DSij; state[ST3_DSB21] = w_DSij; state[ST3_DSB22] = w_DSii
+    state[ST3_THETA_AD1:ST3_BETA_E2 + 1] = 1
+    state[ST3_LEARNING_RATE] = 1
+
+    return state
+
+
+# Counterpart of exit_status() for model_3_compartmental_v3(), which stops if the rates explode but not if they fall
+# silent
+@jit(nopython=True, nogil=True, cache=True)
+def exit_status_3_compartmental_v3(state, delta_t):
+    return (int(state[ST3_EXIT_REASON]), int(state[ST3_STEP]), state[ST3_STEP] * delta_t, int(state[ST3_N_CLAMPS]),
+            int(state[ST3_RK_ACCEPTED]), int(state[ST3_RK_REJECTED]))
 
 
 #version with correct hebbian plasticity -- with basal-to-sst
-@jit(nopython=True)
+@jit(nopython=True, nogil=True, cache=True)
 def model_3_compartmental_v3(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
-          g_stim, stim_times, taus, K, rheobases, lambdas, flags=(1,1,1,1,1,1), flags_theta=(1,1)):
+          g_stim, stim_times, taus, K, rheobases, lambdas, flags=(1,1,1,1,1,1), flags_theta=(1,1), recorder=None,
+          reductions=None, convergence=None):
+
+    state = initial_state_3_compartmental_v3(weights)
+    return model_3_compartmental_v3_from_state(state, sim_duration, delta_t, sampling_rate, l_res_rates,
+                                               l_res_weights, weights, g, g_stim, stim_times, taus, K, rheobases,
+                                               lambdas, flags=flags, flags_theta=flags_theta, recorder=recorder,
+                                               reductions=reductions, convergence=convergence)
+
+
+# Counterpart of model_from_state() for model_3_compartmental_v3(), the channels of the recorder and the reductions are
+# entries of its state vector (ST3_E1, ...). The convergence of phase 2 is checked on the entries ST3_DE11 to
+# ST3_BETA_E2.
+@jit(nopython=True, nogil=True, cache=True)
+def model_3_compartmental_v3_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights,
+                                        weights, g, g_stim, stim_times, taus, K, rheobases, lambdas,
+                                        flags=(1,1,1,1,1,1), flags_theta=(1,1), recorder=None, reductions=None,
+                                        convergence=None):
 
     ##### Initializing the setup
     (sampling_rate_stim, sampling_rate_sim) = sampling_rate
@@ -260,50 +1609,71 @@ def model_3_compartmental_v3(delta_t, sampling_rate, l_res_rates, l_res_weights,
     (g_AD, g_BD, g_E, g_P, g_S) = g
     g_S_total = g_S # total input to S is equal to g_S before the offset of the conditioning
     (g_stim_E, g_stim_P, g_stim_S) = g_stim
-    (stim_start, stim_stop) = stim_times[0]
     (tau_E, tau_P, tau_S, tau_dend, tau_plas,
      tau_scaling_E, tau_scaling_P, tau_scaling_S,
      tau_theta, tau_beta) = taus
     (rheobase_E, rheobase_P, rheobase_S, rheobase_A, rheobase_B) = rheobases
     (lambda_AD, lambda_BD) = lambdas
-
-    # Setting up initial conditions
-    D01, D02, E01, E02, P01, P02, S01, S02 = 1,1,1,1,1,1,1,1 # The initial rates are arbitrarily set to 1
-    DE110, DE120, DE210, DE220 = w_DEii, w_DEij, w_DEij, w_DEii
-    EE110, EE120, EE210, EE220 = w_EEii, w_EEij, w_EEij, w_EEii
-    EP110, EP120, EP210, EP220 = w_EPii, w_EPij, w_EPij, w_EPii
-    DSA110, DSA120, DSA210, DSA220 = w_DSii, w_DSij, w_DSij, w_DSii
-    DSB110, DSB120, DSB210, DSB220 = w_DSii, w_DSij, w_DSij, w_DSii
-
-    E1, E2 = 0,0 #ToDo check if this is necessary
-    max_E[0] = 0
-    # The stimuli are set to zero initially
-    stimulus_E1, stimulus_P1, stimulus_S1 = 0,0,0 
-    stimulus_E2, stimulus_P2, stimulus_S2 = 0,0,0 
-
-    a_base1, a_base2, b_base1, b_base2 = 0.0, 0.0, 0.0, 0.0
-
-    learning_rate = 1
-    I_AD1, I_AD2, I_BD1, I_BD2, I_E1, I_E2 = 1,1,1,1,1,1
-    thetaAD1, thetaAD2, thetaBD1, thetaBD2, thetaE1, thetaE2 = 1,1,1,1,1,1
-    betaAD1, betaAD2, betaBD1, betaBD2, betaE1, betaE2 = 1,1,1,1,1,1
-
-    # Flags of the plasticity mechanisms are initialized here
-    hebbian_flag, three_factor_flag, adaptive_set_point_flag, E_scaling_flag, P_scaling_flag, S_scaling_flag = 0,0,0,0,0,0
-    flag_theta_shift, flag_theta_local = 0,0
-
-    # Counters and indices are initialized for different phases
-    phase1, phase3 = 0,0
-    counter1, counter2 , counter3 = 0,0,0 # Counter to hold data with the respective sampling rate
-    i_1, i_2, i_3 = 0,0,0 # Index to fill the data arrays
-
-    stim_applied = 0 # The number of stimulation applied is held
+    # Factors of the slow variables, e.g. the synaptic scaling, calculated once instead of at every time step
+    dt_tau_beta, dt_tau_theta = delta_t * (1 / tau_beta), delta_t * (1 / tau_theta)
+    dt_tau_scaling_E, dt_tau_scaling_P, dt_tau_scaling_S = \
+        delta_t * (1 / tau_scaling_E), delta_t * (1 / tau_scaling_P), delta_t * (1.0 / tau_scaling_S)
+
+    # Reading the state of the simulation
+    E01, E02, P01, P02, S01, S02 = state[ST3_E1], state[ST3_E2], state[ST3_P1], state[ST3_P2], state[ST3_S1], state[ST3_S2]
+    DE110, DE120, DE210, DE220 = state[ST3_DE11], state[ST3_DE12], state[ST3_DE21], state[ST3_DE22]
+    EE110, EE120, EE210, EE220 = state[ST3_EE11], state[ST3_EE12], state[ST3_EE21], state[ST3_EE22]
+    EP110, EP120, EP210, EP220 = state[ST3_EP11], state[ST3_EP12], state[ST3_EP21], state[ST3_EP22]
+    DSA110, DSA120, DSA210, DSA220 = state[ST3_DSA11], state[ST3_DSA12], state[ST3_DSA21], state[ST3_DSA22]
+    DSB110, DSB120, DSB210, DSB220 = state[ST3_DSB11], state[ST3_DSB12], state[ST3_DSB21], state[ST3_DSB22]
+
+    E1, E2 = E01, E02
+    max_E[0] = state[ST3_MAX_E]
+    # The stimuli, zero before the first stimulus
+    stimulus_E1, stimulus_E2 = state[ST3_STIM_E1], state[ST3_STIM_E2]
+    stimulus_P1, stimulus_P2 = state[ST3_STIM_P1], state[ST3_STIM_P2]
+    stimulus_S1, stimulus_S2 = state[ST3_STIM_S1], state[ST3_STIM_S2]
+
+    a_base1, a_base2 = state[ST3_A_BASE1], state[ST3_A_BASE2]
+    b_base1, b_base2 = state[ST3_B_BASE1], state[ST3_B_BASE2]
+
+    learning_rate = int(state[ST3_LEARNING_RATE])
+    I_AD1, I_AD2, I_BD1, I_BD2 = state[ST3_I_AD1], state[ST3_I_AD2], state[ST3_I_BD1], state[ST3_I_BD2]
+    I_E1, I_E2 = state[ST3_I_E1], state[ST3_I_E2]
+    thetaAD1, thetaAD2, thetaBD1, thetaBD2 = state[ST3_THETA_AD1], state[ST3_THETA_AD2], state[ST3_THETA_BD1], state[ST3_THETA_BD2]
+    thetaE1, thetaE2 = state[ST3_THETA_E1], state[ST3_THETA_E2]
+    betaAD1, betaAD2, betaBD1, betaBD2 = state[ST3_BETA_AD1], state[ST3_BETA_AD2], state[ST3_BETA_BD1], state[ST3_BETA_BD2]
+    betaE1, betaE2 = state[ST3_BETA_E1], state[ST3_BETA_E2]
+
+    # Flags of the plasticity mechanisms, they are all zero before the conditioning
+    hebbian_flag, three_factor_flag, adaptive_set_point_flag = \
+        int(state[ST3_HEBBIAN]), int(state[ST3_THREE_FACTOR]), int(state[ST3_ADAPTIVE_SET_POINT])
+    E_scaling_flag, P_scaling_flag, S_scaling_flag = \
+        int(state[ST3_E_SCALING]), int(state[ST3_P_SCALING]), int(state[ST3_S_SCALING])
+    flag_theta_shift, flag_theta_local = int(state[ST3_THETA_SHIFT]), int(state[ST3_THETA_LOCAL])
+
+    # Counters and indices for different phases
+    phase1, phase3 = int(state[ST3_PHASE1]), int(state[ST3_PHASE3])
+    counter1, counter2, counter3 = int(state[ST3_COUNTER1]), int(state[ST3_COUNTER2]), int(state[ST3_COUNTER3])
+    i_1, i_2, i_3 = int(state[ST3_I1]), int(state[ST3_I2]), int(state[ST3_I3])
+
+    stim_applied = int(state[ST3_STIM_APPLIED]) # The number of stimulation applied is held
+    stim_index = int(state[ST3_STIM_INDEX]) # The row of stim_times holding the timing of the current/next stimulus
+    (stim_steps, phase_steps) = event_steps(delta_t, stim_times)
+
+    step = int(state[ST3_STEP])
+    step_reached = step_stop
+    exit_reason = EXIT_STEP_STOP
+    n_clamps = int(state[ST3_N_CLAMPS])
 
     ##### The loop of the numerical iterations
-    for step in range(sim_duration):
+    # The iterations run in segments between the time steps where anything of the protocol happens (see
+    # next_event_step()). The events and the data registration are handled at the top of a segment, the steps within
+    # a segment only update the dynamics.
+    while step < step_stop:
 
         ### If it is the start of the stimulation
-        if step == int((stim_start + 2) * (1 / delta_t)):
+        if step == stim_steps[stim_index, 0]:
             # If it is the first stimuli (conditioning)
             if stim_applied == 0:
                 e_base1 = E1
@@ -336,7 +1706,7 @@ def model_3_compartmental_v3(delta_t, sampling_rate, l_res_rates, l_res_weights,
             stim_applied = stim_applied + 1
 
         ### If it is the end of the stimulation
-        if step == int((stim_stop + 2) * (1 / delta_t)):
+        if step == stim_steps[stim_index, 1]:
             # The offset of the conditioning
             if stim_applied == 1:
                 g_S_total = g_S # Add top-down input to S
@@ -352,209 +1722,975 @@ def model_3_compartmental_v3(delta_t, sampling_rate, l_res_rates, l_res_weights,
             stimulus_S1, stimulus_S2 = 0, 0
 
             # Set the new timing for the next stim if exists
-            if stim_times.shape[0] > stim_applied:
-                (stim_start, stim_stop) = stim_times[stim_applied]
+            if stim_steps.shape[0] > stim_applied:
+                stim_index = stim_applied
 
         ### Setting up the counters for phase 1 and 3 with 5 seconds of margin before and after stimulation
-        if step == int(2*(1/delta_t)):
+        if step == phase_steps[0]:
             counter1 = sampling_rate_stim  # Start the data-holder counter1
             phase1 = 1
-        elif step == int((stim_times[0][1] + 5 + 2) * (1 / delta_t)):
+        elif step == phase_steps[1]:
             phase1 = 0
 
-        elif step == int((stim_times[1][0] - 5 + 2) * (1 / delta_t)):
+        elif step == phase_steps[2]:
             counter3 = sampling_rate_stim  # Start the data-holder counter3
             phase3 = 1
-        elif step == int((stim_times[1][1] + 5 + 2) * (1 / delta_t)):
+        elif step == phase_steps[3]:
             phase3 = 0
 
         ### Data is registered to the arrays
-        if phase1 and counter1 == sampling_rate_stim:
-            r_phase1[:,i_1] = [E01, E02, P01, P02, S01, S02]
-            I_phase1[:,i_1] = [I_AD1, I_AD2, I_BD1, I_BD2, I_E1, I_E2]
-            J_exc_phase1[:,i_1] = [DE110, DE120, DE210, DE220, EE110, EE120, EE210, EE220]
+        # The variables are written to the state vector and copied from there (see model_from_state())
+        registration1 = phase1 and counter1 == sampling_rate_stim
+        registration3 = not registration1 and phase3 and counter3 == sampling_rate_stim
+        registration2 = stim_applied == 1 and counter2 == sampling_rate_sim
+        recording = False
+        reducing = False
+        if recorder is not None:
+            recording = is_record_step(recorder[1], step)
+        if reductions is not None:
+            reducing = is_reduction_step(reductions, step)
+        if registration1 or registration2 or registration3 or recording or reducing:
+            state[ST3_E1], state[ST3_E2], state[ST3_P1], state[ST3_P2], state[ST3_S1], state[ST3_S2] = E01, E02, P01, P02, S01, S02
+            state[ST3_I_AD1], state[ST3_I_AD2], state[ST3_I_BD1], state[ST3_I_BD2] = I_AD1, I_AD2, I_BD1, I_BD2
+            state[ST3_I_E1], state[ST3_I_E2] = I_E1, I_E2
+            state[ST3_DE11], state[ST3_DE12], state[ST3_DE21], state[ST3_DE22] = DE110, DE120, DE210, DE220
+            state[ST3_EE11], state[ST3_EE12], state[ST3_EE21], state[ST3_EE22] = EE110, EE120, EE210, EE220
+            state[ST3_EP11], state[ST3_EP12], state[ST3_EP21], state[ST3_EP22] = EP110, EP120, EP210, EP220
+            state[ST3_DSA11], state[ST3_DSA12], state[ST3_DSA21], state[ST3_DSA22] = DSA110, DSA120, DSA210, DSA220
+            state[ST3_DSB11], state[ST3_DSB12], state[ST3_DSB21], state[ST3_DSB22] = DSB110, DSB120, DSB210, DSB220
+            state[ST3_THETA_AD1], state[ST3_THETA_AD2], state[ST3_THETA_BD1], state[ST3_THETA_BD2] = thetaAD1, thetaAD2, thetaBD1, thetaBD2
+            state[ST3_THETA_E1], state[ST3_THETA_E2] = thetaE1, thetaE2
+            state[ST3_BETA_AD1], state[ST3_BETA_AD2], state[ST3_BETA_BD1], state[ST3_BETA_BD2] = betaAD1, betaAD2, betaBD1, betaBD2
+            state[ST3_BETA_E1], state[ST3_BETA_E2] = betaE1, betaE2
+
+        if registration1:
+            if i_1 < r_phase1.shape[1]:
+                r_phase1[:, i_1] = state[ST3_E1:ST3_S2 + 1]
+                I_phase1[:, i_1] = state[ST3_I_AD1:ST3_I_E2 + 1]
+                J_exc_phase1[:, i_1] = state[ST3_DE11:ST3_EE22 + 1]
 
             i_1 = i_1 + 1
             counter1 = 0  # restart
 
-        elif phase3 and counter3 == sampling_rate_stim:
-            r_phase3[:,i_3] = [E01, E02, P01, P02, S01, S02]
+        elif registration3:
+            if i_3 < r_phase3.shape[1]:
+                r_phase3[:, i_3] = state[ST3_E1:ST3_S2 + 1]
 
             i_3 = i_3 + 1
             counter3 = 0  # restart
 
-        if stim_applied == 1 and counter2 == sampling_rate_sim:
-            r_phase2[:,i_2] = [E01, E02, P01, P02, S01, S02]
-            I_phase2[:,i_2] = [I_AD1, I_AD2, I_BD1, I_BD2, I_E1, I_E2]
-            set_phase2[:,i_2] = [thetaAD1, thetaAD2, thetaBD1, thetaBD2, thetaE1, thetaE2,
-                                 betaAD1, betaAD2, betaBD1, betaBD2, betaE1, betaE2]
-            J_phase2[:,i_2] = [DE110, DE120, DE210, DE220, EE110, EE120, EE210, EE220,
-                               EP110, EP120, EP210, EP220, DSA110, DSA120, DSA210, DSB220, DSB110, DSB120, DSB210, DSB220]
+        if registration2:
+            # The sample taken during the conditioning is dropped if it doesn't fit into the arrays (see model())
+            if i_2 < r_phase2.shape[1]:
+                r_phase2[:, i_2] = state[ST3_E1:ST3_S2 + 1]
+                I_phase2[:, i_2] = state[ST3_I_AD1:ST3_I_E2 + 1]
+                set_phase2[:, i_2] = state[ST3_THETA_AD1:ST3_BETA_E2 + 1]
+                # DSB22 takes the place of DSA22 in the data array
+                J_phase2[:15, i_2] = state[ST3_DE11:ST3_DSA21 + 1]
+                J_phase2[15, i_2] = state[ST3_DSB22]
+                J_phase2[16:, i_2] = state[ST3_DSB11:ST3_DSB22 + 1]
 
             i_2 = i_2 + 1
             counter2 = 0  # restart
 
-        # Register the maximum excitatory rate of the first population
-        if E01 > max_E[0]:
-            max_E[0] = E01
+        if recorder is not None and recording:
+            record(recorder, step, state)
+        if reductions is not None and reducing:
+            reduce(reductions, step, state)
+
+        ### The rest of phase 2 is skipped once the slow variables have converged (see model_from_state())
+        if convergence is not None and registration2 and step >= phase_steps[1]:
+            if check_convergence(state, convergence, step, i_2 - 1, ST3_DE11, ST3_BETA_E2 + 1, ST3_REFERENCE,
+                                 ST3_REFERENCE_I2, ST3_CONVERGED_STEP):
+                n_skipped = (min(step_stop, phase_steps[2]) - step) // sampling_rate_sim
+                if n_skipped > 1:
+                    for i in range(i_2, min(i_2 + n_skipped - 1, r_phase2.shape[1])):
+                        r_phase2[:, i] = r_phase2[:, i_2 - 1]
+                        I_phase2[:, i] = I_phase2[:, i_2 - 1]
+                        set_phase2[:, i] = set_phase2[:, i_2 - 1]
+                        J_phase2[:, i] = J_phase2[:, i_2 - 1]
+                    i_2 = i_2 + n_skipped - 1
+                    counter1 = counter1 + n_skipped * sampling_rate_sim; counter2 = sampling_rate_sim
+                    counter3 = counter3 + n_skipped * sampling_rate_sim
+                    step = step + n_skipped * sampling_rate_sim
+                    continue
 
-        # If the system exceeds a certain value, assume that it explodes and stop the simulation
-        if E01 > 1000:
-            break
+        # Register the maximum excitatory rate of the first population
 
-        ### Calculating the firing rates at this timestep
-        # Apical currents use S→A
-        I_AD1 = DE110*E01 + DE120*E02 - DSA110*S01 - DSA120*S02 + g_AD
-        I_AD2 = DE210*E01 + DE220*E02 - DSA210*S01 - DSA220*S02 + g_AD
-
-        # Basal currents use S→B
-        I_BD1 = EE110*E01 + EE120*E02 - DSB110*S01 - DSB120*S02 + g_BD + stimulus_E1
-        I_BD2 = EE210*E01 + EE220*E02 - DSB210*S01 - DSB220*S02 + g_BD + stimulus_E2
-
-
-        # Somatic currents for E populations
-        I_E1 = lambda_AD * I_AD1 + lambda_BD * I_BD1 - EP110 * P01 - EP120 * P02 + g_E
-        I_E2 = lambda_AD * I_AD2 + lambda_BD * I_BD2 - EP210 * P01 - EP220 * P02 + g_E
-
-        # Firings rate of E populations
-        E1 = E01 + delta_t*(1/tau_E)*(-E01 + np.maximum(0, I_E1 - rheobase_E))
-        E2 = E02 + delta_t*(1/tau_E)*(-E02 + np.maximum(0, I_E2 - rheobase_E))
-
-        # # Dendritic "firing rates": rectified current relative to local set point, low-passed
-        # A1 = A01 + delta_t*(1.0/tau_dend)*(-A01 + np.maximum(0.0, I_AD1 - rheobase_A))
-        # A2 = A02 + delta_t*(1.0/tau_dend)*(-A02 + np.maximum(0.0, I_AD2 - rheobase_A))
-        # B1 = B01 + delta_t*(1.0/tau_dend)*(-B01 + np.maximum(0.0, I_BD1 - rheobase_B))
-        # B2 = B02 + delta_t*(1.0/tau_dend)*(-B02 + np.maximum(0.0, I_BD2 - rheobase_B))
-
-        # # keep nonnegative (defensive; rectifier already enforces this)
-        # A1 = max(0.0, A1); A2 = max(0.0, A2)
-        # B1 = max(0.0, B1); B2 = max(0.0, B2)
-
-        # Firings rate of PV populations
-        P1 = P01 + delta_t*(1/tau_P)*(-P01 + np.maximum(0, w_PEii * E01 + w_PEij * E02 - w_PSii * S01 - w_PSij * S02
-                                                         - w_PPii * P01 - w_PPij * P02 + g_P - rheobase_P + stimulus_P1))
-        P2 = P02 + delta_t*(1/tau_P)*(-P02 + np.maximum(0, w_PEij * E01 + w_PEii * E02 - w_PSij * S01 - w_PSii * S02
-                                                         - w_PPij * P01 - w_PPii * P02 + g_P - rheobase_P + stimulus_P2))
-
-        # Firing rates of the SST populations
-        S1 = S01 + delta_t*(1/tau_S)*(-S01 + np.maximum(0, w_SEii * E01 + w_SEij * E02 + g_S_total - rheobase_S + stimulus_S1))
-        S2 = S02 + delta_t*(1/tau_S)*(-S02 + np.maximum(0, w_SEij * E01 + w_SEii * E02 + g_S_total - rheobase_S + stimulus_S2))
-
-        # Firing rates cannot go below 0
-        E1 = max(E1, 0); E2 = max(E2, 0)
-        P1 = max(P1, 0); P2 = max(P2, 0)
-        S1 = max(S1, 0); S2 = max(S2, 0)
-
-
-        ### Calculating the plasticity for this timestep
-        # Set point regulators for the apical dendrite, basal dendrite, and soma of E populations
-        betaAD1 = betaAD1 + adaptive_set_point_flag * delta_t * (1 / tau_beta) * (I_AD1 - betaAD1)
-        betaAD2 = betaAD2 + adaptive_set_point_flag * delta_t * (1 / tau_beta) * (I_AD2 - betaAD2)
-        betaBD1 = betaBD1 + adaptive_set_point_flag * delta_t * (1 / tau_beta) * (I_BD1 - betaBD1)
-        betaBD2 = betaBD2 + adaptive_set_point_flag * delta_t * (1 / tau_beta) * (I_BD2 - betaBD2)
-        betaE1 = betaE1 + adaptive_set_point_flag*delta_t * (1 / tau_beta) * (E1 - betaE1)
-        betaE2 = betaE2 + adaptive_set_point_flag*delta_t * (1 / tau_beta) * (E2 - betaE2)
-
-        # Set points for the apical dendrite, basal dendrite, and soma of E populations
-        thetaAD1 = thetaAD1 + adaptive_set_point_flag * delta_t * (1 / tau_theta) * \
-                  (-flag_theta_shift * (thetaAD1 - betaAD1) + flag_theta_local * (I_AD1 - thetaAD1))
-        thetaAD2 = thetaAD2 + adaptive_set_point_flag * delta_t * (1 / tau_theta) * \
-                  (-flag_theta_shift * (thetaAD2 - betaAD2) + flag_theta_local * (I_AD2 - thetaAD2))
-        thetaBD1 = thetaBD1 + adaptive_set_point_flag * delta_t * (1 / tau_theta) * \
-                  (-flag_theta_shift * (thetaBD1 - betaBD1) + flag_theta_local * (I_BD1 - thetaBD1))
-        thetaBD2 = thetaBD2 + adaptive_set_point_flag * delta_t * (1 / tau_theta) * \
-                  (-flag_theta_shift * (thetaBD2 - betaBD2) + flag_theta_local * (I_BD2 - thetaBD2))
-        thetaE1 = thetaE1 + adaptive_set_point_flag*delta_t * (1 / tau_theta) * \
-                   (-flag_theta_shift*(thetaE1 - betaE1) + flag_theta_local*(E1 - thetaE1))
-        thetaE2 = thetaE2 + adaptive_set_point_flag*delta_t * (1 / tau_theta) * \
-                   (-flag_theta_shift*(thetaE2 - betaE2) + flag_theta_local*(E2 - thetaE2))
-
-        # Ratios in the synaptic scaling equations are calculated. Numba operates with 32-bit floating numbers at least.
-        # By Novermber 2023, there is no half-precision float support. Thus, both nominator and denominator is bounded by
-        # 1e2 as lower limit in order to prevent really high output after division when they are super small.
-        # ratio_AD1 = max(I_AD1, 1e-3) / max(thetaAD1,1e-3); ratio_AD2 = max(I_AD2, 1e-3) / max(thetaAD2,1e-3)
-        # ratio_BD1 = max(I_BD1, 1e-3) / max(thetaBD1,1e-3); ratio_BD2 = max(I_BD2, 1e-3) / max(thetaBD2,1e-3)
-        # ratio_E1 = max(I_E1, 1e-2) / max(thetaE1,1e-2); ratio_E2 = max(I_E2, 1e-2) / max(thetaE2,1e-2)
-        ratio_AD1 = I_AD1 / thetaAD1; ratio_AD2 = I_AD2 / thetaAD2
-        ratio_BD2 = I_BD2 / thetaBD2; ratio_BD1 = I_BD1 / thetaBD1
-        ratio_E1 = E1 / thetaE1; ratio_E2 = E2 / thetaE2
-
-        # Synaptic scaling terms are calculated and applied
-        ss1_W_DE = E_scaling_flag * delta_t * (1/tau_scaling_E) * (1-ratio_AD1)
-        ss2_W_DE = E_scaling_flag * delta_t * (1/tau_scaling_E) * (1-ratio_AD2)
-        ss1_W_EE = E_scaling_flag * delta_t * (1/tau_scaling_E) * (1-ratio_BD1)
-        ss2_W_EE = E_scaling_flag * delta_t * (1/tau_scaling_E) * (1-ratio_BD2)
-        ss1_W_EP = P_scaling_flag * delta_t * (1/tau_scaling_P) * (1-ratio_E1)
-        ss2_W_EP = P_scaling_flag * delta_t * (1/tau_scaling_P) * (1-ratio_E2)
-        ss1_W_DSA = S_scaling_flag * delta_t * (1.0/tau_scaling_S) * (1.0 - ratio_AD1)
-        ss2_W_DSA = S_scaling_flag * delta_t * (1.0/tau_scaling_S) * (1.0 - ratio_AD2)
-        ss1_W_DSB = S_scaling_flag * delta_t * (1.0/tau_scaling_S) * (1.0 - ratio_BD1)
-        ss2_W_DSB = S_scaling_flag * delta_t * (1.0/tau_scaling_S) * (1.0 - ratio_BD2)
-
-
-        DE110 = DE110 + ss1_W_DE*DE110
-        DE120 = DE120 + ss1_W_DE*DE120
-        DE210 = DE210 + ss2_W_DE*DE210
-        DE220 = DE220 + ss2_W_DE*DE220
-        EE110 = EE110 + ss1_W_EE*EE110
-        EE120 = EE120 + ss1_W_EE*EE120
-        EE210 = EE210 + ss2_W_EE*EE210
-        EE220 = EE220 + ss2_W_EE*EE220
-        EP11  = EP110 - ss1_W_EP*EP110
-        EP12  = EP120 - ss1_W_EP*EP120
-        EP21  = EP210 - ss2_W_EP*EP210
-        EP22  = EP220 - ss2_W_EP*EP220
-        DSA11 = DSA110 + ss1_W_DSA*DSA110
-        DSA12 = DSA120 + ss1_W_DSA*DSA120
-        DSA21 = DSA210 + ss2_W_DSA*DSA210
-        DSA22 = DSA220 + ss2_W_DSA*DSA220
-        DSB11 = DSB110 + ss1_W_DSB*DSB110
-        DSB12 = DSB120 + ss1_W_DSB*DSB120
-        DSB21 = DSB210 + ss2_W_DSB*DSB210
-        DSB22 = DSB220 + ss2_W_DSB*DSB220
-
-
-        # Hebbian terms are calculated and applied
+        ### The dynamics are iterated until the next event
+        step_next = next_event_step(step, step_stop, sampling_rate, stim_steps, phase_steps, stim_index,
+                                    counter1, counter2, counter3)
+        if recorder is not None:
+            step_next = next_record_step(recorder[1], step, step_next)
+        if reductions is not None:
+            step_next = next_reduction_step(reductions, step, step_next)
+        # Factors of the Hebbian terms, zero unless the Hebbian learning is active
         coeff = hebbian_flag * learning_rate * delta_t * (1.0 / tau_plas)
-
         alpha_A = 1
         alpha_B = 0.45
-        # postsynaptic = dendritic rate (baseline-subtracted), presynaptic = E rates
-        heb_DE11 = alpha_A*coeff * (I_AD1 - a_base1) * (E1)
-        heb_DE12 = alpha_A*coeff * (I_AD1 - a_base1) * (E2)
-        heb_DE21 = alpha_A*coeff * (I_AD2 - a_base2) * (E1)
-        heb_DE22 = alpha_A*coeff * (I_AD2 - a_base2) * (E2)
-
-        heb_EE11 = alpha_B*coeff * (I_BD1 - b_base1) * (E1)
-        heb_EE12 = alpha_B*coeff * (I_BD1 - b_base1) * (E2)
-        heb_EE21 = alpha_B*coeff * (I_BD2 - b_base2) * (E1)
-        heb_EE22 = alpha_B*coeff * (I_BD2 - b_base2) * (E2)
-
-        DE11 = DE110 + heb_DE11; DE12 = DE120 + heb_DE12
-        DE21 = DE210 + heb_DE21; DE22 = DE220 + heb_DE22
-
-        EE11 = EE110 + heb_EE11; EE12 = EE120 + heb_EE12
-        EE21 = EE210 + heb_EE21; EE22 = EE220 + heb_EE22
-
-        # Lower bondary is applied to the weights
-        DE11 = max(0,DE11);DE12 = max(0,DE12)
-        DE21 = max(0,DE21);DE22 = max(0,DE22)
-        EE11 = max(0,EE11);EE12 = max(0,EE12)
-        EE21 = max(0,EE21);EE22 = max(0,EE22)
-        EP11 = max(0,EP11);EP12 = max(0,EP12)
-        EP21 = max(0,EP21);EP22 = max(0,EP22)
-        DSA11=max(0,DSA11); DSA12=max(0,DSA12); DSA21=max(0,DSA21); DSA22=max(0,DSA22)
-        DSB11=max(0,DSB11); DSB12=max(0,DSB12); DSB21=max(0,DSB21); DSB22=max(0,DSB22)
-
-
-        # Placeholder parameters are freed
-        E01 = E1; E02 = E2; P01 = P1; P02 = P2; S01 = S1; S02 = S2; 
-        # A01 = A1; A02 = A2; B01 = B1; B02 = B2
-        DE110=DE11; DE120=DE12; DE210=DE21; DE220=DE22
-        EE110=EE11; EE120=EE12; EE210=EE21; EE220=EE22
-        EP110=EP11; EP120=EP12; EP210=EP21; EP220=EP22
-        DSA110=DSA11; DSA120=DSA12; DSA210=DSA21; DSA220=DSA22
-        DSB110=DSB11; DSB120=DSB12; DSB210=DSB21; DSB220=DSB22
-
-        # Update the data-holder counters
-        counter1 = counter1 + 1; counter2 = counter2 + 1; counter3 = counter3 + 1
\ No newline at end of file
+        coeff_A, coeff_B = alpha_A*coeff, alpha_B*coeff
+        for step_dynamics in range(step, step_next):
+            # Register the maximum excitatory rate of the first population
+            if E01 > max_E[0]:
+                max_E[0] = E01
+
+            # If the system exceeds a certain value, assume that it explodes and stop the simulation
+            if E01 > 1000:
+                step_reached = step_dynamics
+                exit_reason = EXIT_EXPLODED
+                break
+
+            ### Calculating the firing rates at this timestep
+            # Apical currents use S→A
+            I_AD1 = DE110*E01 + DE120*E02 - DSA110*S01 - DSA120*S02 + g_AD
+            I_AD2 = DE210*E01 + DE220*E02 - DSA210*S01 - DSA220*S02 + g_AD
+
+            # Basal currents use S→B
+            I_BD1 = EE110*E01 + EE120*E02 - DSB110*S01 - DSB120*S02 + g_BD + stimulus_E1
+            I_BD2 = EE210*E01 + EE220*E02 - DSB210*S01 - DSB220*S02 + g_BD + stimulus_E2
+
+
+            # Somatic currents for E populations
+            I_E1 = lambda_AD * I_AD1 + lambda_BD * I_BD1 - EP110 * P01 - EP120 * P02 + g_E
+            I_E2 = lambda_AD * I_AD2 + lambda_BD * I_BD2 - EP210 * P01 - EP220 * P02 + g_E
+
+            # Firings rate of E populations
+            E1 = E01 + delta_t*(1/tau_E)*(-E01 + np.maximum(0, I_E1 - rheobase_E))
+            E2 = E02 + delta_t*(1/tau_E)*(-E02 + np.maximum(0, I_E2 - rheobase_E))
+
+            # # Dendritic "firing rates": rectified current relative to local set point, low-passed
+            # A1 = A01 + delta_t*(1.0/tau_dend)*(-A01 + np.maximum(0.0, I_AD1 - rheobase_A))
+            # A2 = A02 + delta_t*(1.0/tau_dend)*(-A02 + np.maximum(0.0, I_AD2 - rheobase_A))
+            # B1 = B01 + delta_t*(1.0/tau_dend)*(-B01 + np.maximum(0.0, I_BD1 - rheobase_B))
+            # B2 = B02 + delta_t*(1.0/tau_dend)*(-B02 + np.maximum(0.0, I_BD2 - rheobase_B))
+
+            # # keep nonnegative (defensive; rectifier already enforces this)
+            # A1 = max(0.0, A1); A2 = max(0.0, A2)
+            # B1 = max(0.0, B1); B2 = max(0.0, B2)
+
+            # Firings rate of PV populations
+            P1 = P01 + delta_t*(1/tau_P)*(-P01 + np.maximum(0, w_PEii * E01 + w_PEij * E02 - w_PSii * S01 - w_PSij * S02
+                                                             - w_PPii * P01 - w_PPij * P02 + g_P - rheobase_P + stimulus_P1))
+            P2 = P02 + delta_t*(1/tau_P)*(-P02 + np.maximum(0, w_PEij * E01 + w_PEii * E02 - w_PSij * S01 - w_PSii * S02
+                                                             - w_PPij * P01 - w_PPii * P02 + g_P - rheobase_P + stimulus_P2))
+
+            # Firing rates of the SST populations
+            S1 = S01 + delta_t*(1/tau_S)*(-S01 + np.maximum(0, w_SEii * E01 + w_SEij * E02 + g_S_total - rheobase_S + stimulus_S1))
+            S2 = S02 + delta_t*(1/tau_S)*(-S02 + np.maximum(0, w_SEij * E01 + w_SEii * E02 + g_S_total - rheobase_S + stimulus_S2))
+
+            # Firing rates cannot go below 0, the activations of the boundaries are counted
+            if min(E1, E2, P1, P2, S1, S2) < 0:
+                n_clamps += (E1 < 0) + (E2 < 0) + (P1 < 0) + (P2 < 0) + (S1 < 0) + (S2 < 0)
+            E1 = max(E1, 0); E2 = max(E2, 0)
+            P1 = max(P1, 0); P2 = max(P2, 0)
+            S1 = max(S1, 0); S2 = max(S2, 0)
+
+
+            ### Calculating the plasticity for this timestep
+            # Only the mechanisms switched on by the flags are calculated. The flags and the learning rate only change
+            # at the events, thus the branches are the same for all the steps of a segment.
+            if adaptive_set_point_flag:
+                # Set point regulators for the apical dendrite, basal dendrite, and soma of E populations
+                betaAD1 = betaAD1 + dt_tau_beta * (I_AD1 - betaAD1)
+                betaAD2 = betaAD2 + dt_tau_beta * (I_AD2 - betaAD2)
+                betaBD1 = betaBD1 + dt_tau_beta * (I_BD1 - betaBD1)
+                betaBD2 = betaBD2 + dt_tau_beta * (I_BD2 - betaBD2)
+                betaE1 = betaE1 + dt_tau_beta * (E1 - betaE1)
+                betaE2 = betaE2 + dt_tau_beta * (E2 - betaE2)
+
+                # Set points for the apical dendrite, basal dendrite, and soma of E populations
+                thetaAD1 = thetaAD1 + dt_tau_theta * \
+                          (-flag_theta_shift * (thetaAD1 - betaAD1) + flag_theta_local * (I_AD1 - thetaAD1))
+                thetaAD2 = thetaAD2 + dt_tau_theta * \
+                          (-flag_theta_shift * (thetaAD2 - betaAD2) + flag_theta_local * (I_AD2 - thetaAD2))
+                thetaBD1 = thetaBD1 + dt_tau_theta * \
+                          (-flag_theta_shift * (thetaBD1 - betaBD1) + flag_theta_local * (I_BD1 - thetaBD1))
+                thetaBD2 = thetaBD2 + dt_tau_theta * \
+                          (-flag_theta_shift * (thetaBD2 - betaBD2) + flag_theta_local * (I_BD2 - thetaBD2))
+                thetaE1 = thetaE1 + dt_tau_theta * \
+                           (-flag_theta_shift*(thetaE1 - betaE1) + flag_theta_local*(E1 - thetaE1))
+                thetaE2 = thetaE2 + dt_tau_theta * \
+                           (-flag_theta_shift*(thetaE2 - betaE2) + flag_theta_local*(E2 - thetaE2))
+
+            # Ratios in the synaptic scaling equations are calculated. Numba operates with 32-bit floating numbers at least.
+            # By Novermber 2023, there is no half-precision float support. Thus, both nominator and denominator is bounded by
+            # 1e2 as lower limit in order to prevent really high output after division when they are super small.
+            # ratio_AD1 = max(I_AD1, 1e-3) / max(thetaAD1,1e-3); ratio_AD2 = max(I_AD2, 1e-3) / max(thetaAD2,1e-3)
+            # ratio_BD1 = max(I_BD1, 1e-3) / max(thetaBD1,1e-3); ratio_BD2 = max(I_BD2, 1e-3) / max(thetaBD2,1e-3)
+            # ratio_E1 = max(I_E1, 1e-2) / max(thetaE1,1e-2); ratio_E2 = max(I_E2, 1e-2) / max(thetaE2,1e-2)
+            if E_scaling_flag or P_scaling_flag or S_scaling_flag:
+                ratio_AD1 = I_AD1 / thetaAD1; ratio_AD2 = I_AD2 / thetaAD2
+                ratio_BD2 = I_BD2 / thetaBD2; ratio_BD1 = I_BD1 / thetaBD1
+                ratio_E1 = E1 / thetaE1; ratio_E2 = E2 / thetaE2
+
+            # Synaptic scaling terms are calculated and applied
+            if E_scaling_flag:
+                ss1_W_DE = dt_tau_scaling_E * (1-ratio_AD1)
+                ss2_W_DE = dt_tau_scaling_E * (1-ratio_AD2)
+                ss1_W_EE = dt_tau_scaling_E * (1-ratio_BD1)
+                ss2_W_EE = dt_tau_scaling_E * (1-ratio_BD2)
+                DE110 = DE110 + ss1_W_DE*DE110
+                DE120 = DE120 + ss1_W_DE*DE120
+                DE210 = DE210 + ss2_W_DE*DE210
+                DE220 = DE220 + ss2_W_DE*DE220
+                EE110 = EE110 + ss1_W_EE*EE110
+                EE120 = EE120 + ss1_W_EE*EE120
+                EE210 = EE210 + ss2_W_EE*EE210
+                EE220 = EE220 + ss2_W_EE*EE220
+
+            EP11, EP12, EP21, EP22 = EP110, EP120, EP210, EP220
+            if P_scaling_flag:
+                ss1_W_EP = dt_tau_scaling_P * (1-ratio_E1)
+                ss2_W_EP = dt_tau_scaling_P * (1-ratio_E2)
+                EP11  = EP110 - ss1_W_EP*EP110
+                EP12  = EP120 - ss1_W_EP*EP120
+                EP21  = EP210 - ss2_W_EP*EP210
+                EP22  = EP220 - ss2_W_EP*EP220
+
+            DSA11, DSA12, DSA21, DSA22 = DSA110, DSA120, DSA210, DSA220
+            DSB11, DSB12, DSB21, DSB22 = DSB110, DSB120, DSB210, DSB220
+            if S_scaling_flag:
+                ss1_W_DSA = dt_tau_scaling_S * (1.0 - ratio_AD1)
+                ss2_W_DSA = dt_tau_scaling_S * (1.0 - ratio_AD2)
+                ss1_W_DSB = dt_tau_scaling_S * (1.0 - ratio_BD1)
+                ss2_W_DSB = dt_tau_scaling_S * (1.0 - ratio_BD2)
+                DSA11 = DSA110 + ss1_W_DSA*DSA110
+                DSA12 = DSA120 + ss1_W_DSA*DSA120
+                DSA21 = DSA210 + ss2_W_DSA*DSA210
+                DSA22 = DSA220 + ss2_W_DSA*DSA220
+                DSB11 = DSB110 + ss1_W_DSB*DSB110
+                DSB12 = DSB120 + ss1_W_DSB*DSB120
+                DSB21 = DSB210 + ss2_W_DSB*DSB210
+                DSB22 = DSB220 + ss2_W_DSB*DSB220
+
+            # Hebbian terms are calculated and applied
+            DE11, DE12, DE21, DE22 = DE110, DE120, DE210, DE220
+            EE11, EE12, EE21, EE22 = EE110, EE120, EE210, EE220
+            if coeff != 0:
+                # postsynaptic = dendritic rate (baseline-subtracted), presynaptic = E rates
+                heb_DE11 = coeff_A * (I_AD1 - a_base1) * (E1)
+                heb_DE12 = coeff_A * (I_AD1 - a_base1) * (E2)
+                heb_DE21 = coeff_A * (I_AD2 - a_base2) * (E1)
+                heb_DE22 = coeff_A * (I_AD2 - a_base2) * (E2)
+
+                heb_EE11 = coeff_B * (I_BD1 - b_base1) * (E1)
+                heb_EE12 = coeff_B * (I_BD1 - b_base1) * (E2)
+                heb_EE21 = coeff_B * (I_BD2 - b_base2) * (E1)
+                heb_EE22 = coeff_B * (I_BD2 - b_base2) * (E2)
+
+                DE11 = DE110 + heb_DE11; DE12 = DE120 + heb_DE12
+                DE21 = DE210 + heb_DE21; DE22 = DE220 + heb_DE22
+
+                EE11 = EE110 + heb_EE11; EE12 = EE120 + heb_EE12
+                EE21 = EE210 + heb_EE21; EE22 = EE220 + heb_EE22
+
+            # Lower bondary is applied to the weights
+            if min(DE11, DE12, DE21, DE22, EE11, EE12, EE21, EE22, EP11, EP12, EP21, EP22,
+                   DSA11, DSA12, DSA21, DSA22, DSB11, DSB12, DSB21, DSB22) < 0:
+                n_clamps += ((DE11 < 0) + (DE12 < 0) + (DE21 < 0) + (DE22 < 0) + (EE11 < 0) + (EE12 < 0) + (EE21 < 0)
+                             + (EE22 < 0) + (EP11 < 0) + (EP12 < 0) + (EP21 < 0) + (EP22 < 0) + (DSA11 < 0)
+                             + (DSA12 < 0) + (DSA21 < 0) + (DSA22 < 0) + (DSB11 < 0) + (DSB12 < 0) + (DSB21 < 0)
+                             + (DSB22 < 0))
+            DE11 = max(0,DE11);DE12 = max(0,DE12)
+            DE21 = max(0,DE21);DE22 = max(0,DE22)
+            EE11 = max(0,EE11);EE12 = max(0,EE12)
+            EE21 = max(0,EE21);EE22 = max(0,EE22)
+            EP11 = max(0,EP11);EP12 = max(0,EP12)
+            EP21 = max(0,EP21);EP22 = max(0,EP22)
+            DSA11=max(0,DSA11); DSA12=max(0,DSA12); DSA21=max(0,DSA21); DSA22=max(0,DSA22)
+            DSB11=max(0,DSB11); DSB12=max(0,DSB12); DSB21=max(0,DSB21); DSB22=max(0,DSB22)
+
+
+            # Placeholder parameters are freed
+            E01 = E1; E02 = E2; P01 = P1; P02 = P2; S01 = S1; S02 = S2; 
+            # A01 = A1; A02 = A2; B01 = B1; B02 = B2
+            DE110=DE11; DE120=DE12; DE210=DE21; DE220=DE22
+            EE110=EE11; EE120=EE12; EE210=EE21; EE220=EE22
+            EP110=EP11; EP120=EP12; EP210=EP21; EP220=EP22
+            DSA110=DSA11; DSA120=DSA12; DSA210=DSA21; DSA220=DSA22
+            DSB110=DSB11; DSB120=DSB12; DSB210=DSB21; DSB220=DSB22
+
+        # Update the data-holder counters with the number of time steps iterated
+        if step_reached < step_stop:
+            counter1 = counter1 + step_reached - step; counter2 = counter2 + step_reached - step; counter3 = counter3 + step_reached - step
+            break
+        counter1 = counter1 + step_next - step; counter2 = counter2 + step_next - step; counter3 = counter3 + step_next - step
+        step = step_next
+
+    ##### Writing the state of the simulation back
+    state[ST3_E1], state[ST3_E2], state[ST3_P1], state[ST3_P2], state[ST3_S1], state[ST3_S2] = E01, E02, P01, P02, S01, S02
+    state[ST3_I_AD1], state[ST3_I_AD2], state[ST3_I_BD1], state[ST3_I_BD2] = I_AD1, I_AD2, I_BD1, I_BD2
+    state[ST3_I_E1], state[ST3_I_E2] = I_E1, I_E2
+    state[ST3_DE11], state[ST3_DE12], state[ST3_DE21], state[ST3_DE22] = DE110, DE120, DE210, DE220
+    state[ST3_EE11], state[ST3_EE12], state[ST3_EE21], state[ST3_EE22] = EE110, EE120, EE210, EE220
+    state[ST3_EP11], state[ST3_EP12], state[ST3_EP21], state[ST3_EP22] = EP110, EP120, EP210, EP220
+    state[ST3_DSA11], state[ST3_DSA12], state[ST3_DSA21], state[ST3_DSA22] = DSA110, DSA120, DSA210, DSA220
+    state[ST3_DSB11], state[ST3_DSB12], state[ST3_DSB21], state[ST3_DSB22] = DSB110, DSB120, DSB210, DSB220
+    state[ST3_THETA_AD1], state[ST3_THETA_AD2], state[ST3_THETA_BD1], state[ST3_THETA_BD2] = thetaAD1, thetaAD2, thetaBD1, thetaBD2
+    state[ST3_THETA_E1], state[ST3_THETA_E2] = thetaE1, thetaE2
+    state[ST3_BETA_AD1], state[ST3_BETA_AD2], state[ST3_BETA_BD1], state[ST3_BETA_BD2] = betaAD1, betaAD2, betaBD1, betaBD2
+    state[ST3_BETA_E1], state[ST3_BETA_E2] = betaE1, betaE2
+    state[ST3_A_BASE1], state[ST3_A_BASE2], state[ST3_B_BASE1], state[ST3_B_BASE2] = a_base1, a_base2, b_base1, b_base2
+    state[ST3_LEARNING_RATE] = learning_rate
+    state[ST3_STIM_E1], state[ST3_STIM_E2] = stimulus_E1, stimulus_E2
+    state[ST3_STIM_P1], state[ST3_STIM_P2] = stimulus_P1, stimulus_P2
+    state[ST3_STIM_S1], state[ST3_STIM_S2] = stimulus_S1, stimulus_S2
+    state[ST3_HEBBIAN], state[ST3_THREE_FACTOR], state[ST3_ADAPTIVE_SET_POINT] = hebbian_flag, three_factor_flag, adaptive_set_point_flag
+    state[ST3_E_SCALING], state[ST3_P_SCALING], state[ST3_S_SCALING] = E_scaling_flag, P_scaling_flag, S_scaling_flag
+    state[ST3_THETA_SHIFT], state[ST3_THETA_LOCAL] = flag_theta_shift, flag_theta_local
+    state[ST3_STIM_APPLIED], state[ST3_STIM_INDEX] = stim_applied, stim_index
+    state[ST3_PHASE1], state[ST3_PHASE3] = phase1, phase3
+    state[ST3_COUNTER1], state[ST3_COUNTER2], state[ST3_COUNTER3] = counter1, counter2, counter3
+    state[ST3_I1], state[ST3_I2], state[ST3_I3] = i_1, i_2, i_3
+    state[ST3_MAX_E] = max_E[0]
+    state[ST3_STEP] = step_reached
+    state[ST3_EXIT_REASON], state[ST3_N_CLAMPS] = exit_reason, n_clamps
+    return exit_status_3_compartmental_v3(state, delta_t)
+
+
+##### Adaptive integration of model_3_compartmental_v3(), see model_rk()
+# Counterpart of apply_events() for model_3_compartmental_v3(), returns False if the simulation stops at this time step
+@jit(nopython=True, nogil=True, cache=True)
+def apply_events_3_compartmental_v3(state, step, sampling_rate, l_res_rates, l_res_weights, g_stim,
+                                    stim_steps, phase_steps, K, flags, flags_theta):
+    (sampling_rate_stim, sampling_rate_sim) = sampling_rate
+    (r_phase1, I_phase1, r_phase2, I_phase2, set_phase2, r_phase3, max_E) = l_res_rates
+    (J_exc_phase1, J_phase2) = l_res_weights
+    (g_stim_E, g_stim_P, g_stim_S) = g_stim
+
+    stim_applied = int(state[ST3_STIM_APPLIED])
+    stim_index = int(state[ST3_STIM_INDEX])
+
+    ### If it is the start of the stimulation
+    if step == stim_steps[stim_index, 0]:
+        # If it is the first stimuli (conditioning)
+        if stim_applied == 0:
+            state[ST3_A_BASE1], state[ST3_A_BASE2] = state[ST3_I_AD1], state[ST3_I_AD2]
+            state[ST3_B_BASE1], state[ST3_B_BASE2] = state[ST3_I_BD1], state[ST3_I_BD2]
+            # The set points start at the currents of the dendrites and the rates of the somas
+            for i in range(6):
+                base = state[ST3_I_AD1 + i] if i < 4 else state[ST3_E1 + i - 4]
+                state[ST3_THETA_AD1 + i] = base
+                state[ST3_BETA_AD1 + i] = base - K
+
+            (state[ST3_HEBBIAN], state[ST3_THREE_FACTOR], state[ST3_ADAPTIVE_SET_POINT],
+             state[ST3_E_SCALING], state[ST3_P_SCALING], state[ST3_S_SCALING]) = flags
+            (state[ST3_THETA_SHIFT], state[ST3_THETA_LOCAL]) = flags_theta
+
+            # Hebbian learning is activated at conditioning onset
+            if state[ST3_HEBBIAN]:
+                state[ST3_LEARNING_RATE] = 1
+
+        if stim_applied == 1:  # If it is the second stimuli (testing)
+            # Stop the data-holder counter by setting the counter2 to a high value
+            state[ST3_COUNTER2] = sampling_rate_sim + 5
+
+        # Stimulation of the selected cells for the respected stimuli is set
+        state[ST3_STIM_E1], state[ST3_STIM_E2] = g_stim_E[stim_applied]
+        state[ST3_STIM_P1], state[ST3_STIM_P2] = g_stim_P[stim_applied]
+        state[ST3_STIM_S1], state[ST3_STIM_S2] = g_stim_S[stim_applied]
+
+        stim_applied = stim_applied + 1
+        state[ST3_STIM_APPLIED] = stim_applied
+
+    ### If it is the end of the stimulation
+    if step == stim_steps[stim_index, 1]:
+        # The offset of the conditioning
+        if stim_applied == 1:
+            state[ST3_COUNTER2] = sampling_rate_sim  # Start the data-holder counter
+
+            # Hebbian learning is turned off due to the third factor
+            if state[ST3_THREE_FACTOR]:
+                state[ST3_LEARNING_RATE] = 0
+
+        # All stimuli are turned off
+        state[ST3_STIM_E1:ST3_STIM_S2 + 1] = 0
+
+        # Set the new timing for the next stim if exists
+        if stim_steps.shape[0] > stim_applied:
+            state[ST3_STIM_INDEX] = stim_applied
+
+    ### Setting up the counters for phase 1 and 3 with 5 seconds of margin before and after stimulation
+    if step == phase_steps[0]:
+        state[ST3_COUNTER1] = sampling_rate_stim  # Start the data-holder counter1
+        state[ST3_PHASE1] = 1
+    elif step == phase_steps[1]:
+        state[ST3_PHASE1] = 0
+    elif step == phase_steps[2]:
+        state[ST3_COUNTER3] = sampling_rate_stim  # Start the data-holder counter3
+        state[ST3_PHASE3] = 1
+    elif step == phase_steps[3]:
+        state[ST3_PHASE3] = 0
+
+    ### Data is registered to the arrays
+    if state[ST3_PHASE1] and state[ST3_COUNTER1] == sampling_rate_stim:
+        i_1 = int(state[ST3_I1])
+        if i_1 < r_phase1.shape[1]:
+            r_phase1[:, i_1] = state[ST3_E1:ST3_S2 + 1]
+            I_phase1[:, i_1] = state[ST3_I_AD1:ST3_I_E2 + 1]
+            J_exc_phase1[:, i_1] = state[ST3_DE11:ST3_EE22 + 1]
+        state[ST3_I1] = i_1 + 1
+        state[ST3_COUNTER1] = 0  # restart
+
+    elif state[ST3_PHASE3] and state[ST3_COUNTER3] == sampling_rate_stim:
+        i_3 = int(state[ST3_I3])
+        if i_3 < r_phase3.shape[1]:
+            r_phase3[:, i_3] = state[ST3_E1:ST3_S2 + 1]
+        state[ST3_I3] = i_3 + 1
+        state[ST3_COUNTER3] = 0  # restart
+
+    if stim_applied == 1 and state[ST3_COUNTER2] == sampling_rate_sim:
+        # The sample taken during the conditioning is dropped if it doesn't fit into the arrays (see model())
+        i_2 = int(state[ST3_I2])
+        if i_2 < r_phase2.shape[1]:
+            r_phase2[:, i_2] = state[ST3_E1:ST3_S2 + 1]
+            I_phase2[:, i_2] = state[ST3_I_AD1:ST3_I_E2 + 1]
+            set_phase2[:, i_2] = state[ST3_THETA_AD1:ST3_BETA_E2 + 1]
+            # Same order as in model_3_compartmental_v3_from_state()
+            J_phase2[:15, i_2] = state[ST3_DE11:ST3_DSA21 + 1]
+            J_phase2[15, i_2] = state[ST3_DSB22]
+            J_phase2[16:, i_2] = state[ST3_DSB11:ST3_DSB22 + 1]
+        state[ST3_I2] = i_2 + 1
+        state[ST3_COUNTER2] = 0  # restart
+
+    if state[ST3_E1] > state[ST3_MAX_E]:
+        state[ST3_MAX_E] = state[ST3_E1]
+    max_E[0] = state[ST3_MAX_E]
+
+    # If the system exceeds a certain value, assume that it explodes and stop the simulation
+    return not state[ST3_E1] > 1000
+
+
+# The currents of the compartments of model_3_compartmental_v3() for the rates and weights held in state
+@jit(nopython=True, nogil=True, cache=True)
+def currents_3_compartmental_v3(state, g, lambdas):
+    (g_AD, g_BD, g_E, g_P, g_S) = g
+    (lambda_AD, lambda_BD) = lambdas
+    E1, E2, P1, P2, S1, S2 = state[ST3_E1], state[ST3_E2], state[ST3_P1], state[ST3_P2], state[ST3_S1], state[ST3_S2]
+
+    # Apical currents use S→A, basal currents use S→B
+    I_AD1 = state[ST3_DE11]*E1 + state[ST3_DE12]*E2 - state[ST3_DSA11]*S1 - state[ST3_DSA12]*S2 + g_AD
+    I_AD2 = state[ST3_DE21]*E1 + state[ST3_DE22]*E2 - state[ST3_DSA21]*S1 - state[ST3_DSA22]*S2 + g_AD
+    I_BD1 = state[ST3_EE11]*E1 + state[ST3_EE12]*E2 - state[ST3_DSB11]*S1 - state[ST3_DSB12]*S2 + g_BD + state[ST3_STIM_E1]
+    I_BD2 = state[ST3_EE21]*E1 + state[ST3_EE22]*E2 - state[ST3_DSB21]*S1 - state[ST3_DSB22]*S2 + g_BD + state[ST3_STIM_E2]
+
+    state[ST3_I_AD1], state[ST3_I_AD2], state[ST3_I_BD1], state[ST3_I_BD2] = I_AD1, I_AD2, I_BD1, I_BD2
+    state[ST3_I_E1] = lambda_AD * I_AD1 + lambda_BD * I_BD1 - state[ST3_EP11] * P1 - state[ST3_EP12] * P2 + g_E
+    state[ST3_I_E2] = lambda_AD * I_AD2 + lambda_BD * I_BD2 - state[ST3_EP21] * P1 - state[ST3_EP22] * P2 + g_E
+
+
+# Counterpart of derivatives() for model_3_compartmental_v3() (ST3_E1 to ST3_BETA_E2). The currents are algebraic,
+# they are updated in state and their time derivatives are zero.
+@jit(nopython=True, nogil=True, cache=True)
+def derivatives_3_compartmental_v3(state, d, weights, g, taus, rheobases, lambdas):
+    (w_DEii, w_EEii, w_EPii, w_DSii, w_PEii, w_PPii, w_PSii, w_SEii,
+     w_DEij, w_EEij, w_EPij, w_DSij, w_PEij, w_PPij, w_PSij, w_SEij) = weights
+    (g_AD, g_BD, g_E, g_P, g_S) = g
+    (tau_E, tau_P, tau_S, tau_dend, tau_plas,
+     tau_scaling_E, tau_scaling_P, tau_scaling_S,
+     tau_theta, tau_beta) = taus
+    (rheobase_E, rheobase_P, rheobase_S, rheobase_A, rheobase_B) = rheobases
+
+    currents_3_compartmental_v3(state, g, lambdas)
+    E1, E2, P1, P2, S1, S2 = state[ST3_E1], state[ST3_E2], state[ST3_P1], state[ST3_P2], state[ST3_S1], state[ST3_S2]
+
+    ### Firing rates
+    d[ST3_E1] = (1/tau_E)*(-E1 + max(0, state[ST3_I_E1] - rheobase_E))
+    d[ST3_E2] = (1/tau_E)*(-E2 + max(0, state[ST3_I_E2] - rheobase_E))
+    d[ST3_P1] = (1/tau_P)*(-P1 + max(0, w_PEii * E1 + w_PEij * E2 - w_PSii * S1 - w_PSij * S2
+                                     - w_PPii * P1 - w_PPij * P2 + g_P - rheobase_P + state[ST3_STIM_P1]))
+    d[ST3_P2] = (1/tau_P)*(-P2 + max(0, w_PEij * E1 + w_PEii * E2 - w_PSij * S1 - w_PSii * S2
+                                     - w_PPij * P1 - w_PPii * P2 + g_P - rheobase_P + state[ST3_STIM_P2]))
+    d[ST3_S1] = (1/tau_S)*(-S1 + max(0, w_SEii * E1 + w_SEij * E2 + g_S - rheobase_S + state[ST3_STIM_S1]))
+    d[ST3_S2] = (1/tau_S)*(-S2 + max(0, w_SEij * E1 + w_SEii * E2 + g_S - rheobase_S + state[ST3_STIM_S2]))
+    d[ST3_I_AD1:ST3_I_E2 + 1] = 0
+
+    ### Set points and their regulators of the apical dendrite, basal dendrite and soma of E populations
+    adaptive_set_point_flag = state[ST3_ADAPTIVE_SET_POINT]
+    flag_theta_shift, flag_theta_local = state[ST3_THETA_SHIFT], state[ST3_THETA_LOCAL]
+    for i in range(6):
+        activity = state[ST3_I_AD1 + i] if i < 4 else state[ST3_E1 + i - 4]
+        theta, beta = state[ST3_THETA_AD1 + i], state[ST3_BETA_AD1 + i]
+        d[ST3_BETA_AD1 + i] = adaptive_set_point_flag * (1 / tau_beta) * (activity - beta)
+        d[ST3_THETA_AD1 + i] = adaptive_set_point_flag * (1 / tau_theta) * \
+                               (-flag_theta_shift * (theta - beta) + flag_theta_local * (activity - theta))
+
+    ### Synaptic scaling and Hebbian plasticity
+    ratio_AD1 = state[ST3_I_AD1] / state[ST3_THETA_AD1]; ratio_AD2 = state[ST3_I_AD2] / state[ST3_THETA_AD2]
+    ratio_BD1 = state[ST3_I_BD1] / state[ST3_THETA_BD1]; ratio_BD2 = state[ST3_I_BD2] / state[ST3_THETA_BD2]
+    ratio_E1 = E1 / state[ST3_THETA_E1]; ratio_E2 = E2 / state[ST3_THETA_E2]
+
+    ss1_W_DE = state[ST3_E_SCALING] * (1/tau_scaling_E) * (1-ratio_AD1)
+    ss2_W_DE = state[ST3_E_SCALING] * (1/tau_scaling_E) * (1-ratio_AD2)
+    ss1_W_EE = state[ST3_E_SCALING] * (1/tau_scaling_E) * (1-ratio_BD1)
+    ss2_W_EE = state[ST3_E_SCALING] * (1/tau_scaling_E) * (1-ratio_BD2)
+    ss1_W_EP = state[ST3_P_SCALING] * (1/tau_scaling_P) * (1-ratio_E1)
+    ss2_W_EP = state[ST3_P_SCALING] * (1/tau_scaling_P) * (1-ratio_E2)
+    ss_W_DS = state[ST3_S_SCALING] * (1/tau_scaling_S)
+
+    coeff = state[ST3_HEBBIAN] * state[ST3_LEARNING_RATE] * (1.0 / tau_plas)
+    alpha_A = 1
+    alpha_B = 0.45
+    heb_A1 = alpha_A * coeff * (state[ST3_I_AD1] - state[ST3_A_BASE1])
+    heb_A2 = alpha_A * coeff * (state[ST3_I_AD2] - state[ST3_A_BASE2])
+    heb_B1 = alpha_B * coeff * (state[ST3_I_BD1] - state[ST3_B_BASE1])
+    heb_B2 = alpha_B * coeff * (state[ST3_I_BD2] - state[ST3_B_BASE2])
+
+    d[ST3_DE11] = ss1_W_DE * state[ST3_DE11] + heb_A1 * E1; d[ST3_DE12] = ss1_W_DE * state[ST3_DE12] + heb_A1 * E2
+    d[ST3_DE21] = ss2_W_DE * state[ST3_DE21] + heb_A2 * E1; d[ST3_DE22] = ss2_W_DE * state[ST3_DE22] + heb_A2 * E2
+    d[ST3_EE11] = ss1_W_EE * state[ST3_EE11] + heb_B1 * E1; d[ST3_EE12] = ss1_W_EE * state[ST3_EE12] + heb_B1 * E2
+    d[ST3_EE21] = ss2_W_EE * state[ST3_EE21] + heb_B2 * E1; d[ST3_EE22] = ss2_W_EE * state[ST3_EE22] + heb_B2 * E2
+    d[ST3_EP11] = -ss1_W_EP * state[ST3_EP11]; d[ST3_EP12] = -ss1_W_EP * state[ST3_EP12]
+    d[ST3_EP21] = -ss2_W_EP * state[ST3_EP21]; d[ST3_EP22] = -ss2_W_EP * state[ST3_EP22]
+    d[ST3_DSA11] = ss_W_DS * (1 - ratio_AD1) * state[ST3_DSA11]; d[ST3_DSA12] = ss_W_DS * (1 - ratio_AD1) * state[ST3_DSA12]
+    d[ST3_DSA21] = ss_W_DS * (1 - ratio_AD2) * state[ST3_DSA21]; d[ST3_DSA22] = ss_W_DS * (1 - ratio_AD2) * state[ST3_DSA22]
+    d[ST3_DSB11] = ss_W_DS * (1 - ratio_BD1) * state[ST3_DSB11]; d[ST3_DSB12] = ss_W_DS * (1 - ratio_BD1) * state[ST3_DSB12]
+    d[ST3_DSB21] = ss_W_DS * (1 - ratio_BD2) * state[ST3_DSB21]; d[ST3_DSB22] = ss_W_DS * (1 - ratio_BD2) * state[ST3_DSB22]
+
+
+# Lower boundaries of the rates and weights of model_3_compartmental_v3(), the currents are updated accordingly
+@jit(nopython=True, nogil=True, cache=True)
+def clip_state_3_compartmental_v3(state, weights, g, taus, rheobases, lambdas):
+    for i in range(ST3_E1, ST3_S2 + 1):
+        state[i] = max(state[i], 0)
+    for i in range(ST3_DE11, ST3_DSB22 + 1):
+        state[i] = max(state[i], 0)
+    currents_3_compartmental_v3(state, g, lambdas)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def model_3_compartmental_v3_rk(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
+                                g_stim, stim_times, taus, K, rheobases, lambdas, flags=(1,1,1,1,1,1),
+                                flags_theta=(1,1), rtol=1e-6, atol=1e-9, max_step=np.inf, recorder=None,
+                                reductions=None):
+
+    state = initial_state_3_compartmental_v3(weights)
+    return model_3_compartmental_v3_rk_from_state(state, sim_duration, delta_t, sampling_rate, l_res_rates,
+                                                  l_res_weights, weights, g, g_stim, stim_times, taus, K, rheobases,
+                                                  lambdas, flags=flags, flags_theta=flags_theta,
+                                                  rtol=rtol, atol=atol, max_step=max_step, recorder=recorder,
+                                                  reductions=reductions)
+
+
+# Counterpart of model_rk_from_state() for model_3_compartmental_v3()
+@jit(nopython=True, nogil=True, cache=True)
+def model_3_compartmental_v3_rk_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights,
+                                           weights, g, g_stim, stim_times, taus, K, rheobases, lambdas,
+                                           flags=(1,1,1,1,1,1), flags_theta=(1,1),
+                                           rtol=1e-6, atol=1e-9, max_step=np.inf, recorder=None, reductions=None):
+
+    (r_phase1, I_phase1, r_phase2, I_phase2, set_phase2, r_phase3, max_E) = l_res_rates
+    (stim_steps, phase_steps) = event_steps(delta_t, stim_times)
+    h = delta_t
+
+    step = int(state[ST3_STEP])
+    while step < step_stop:
+        if not apply_events_3_compartmental_v3(state, step, sampling_rate, l_res_rates, l_res_weights,
+                                               g_stim, stim_steps, phase_steps, K, flags, flags_theta):
+            break
+
+        if recorder is not None and is_record_step(recorder[1], step):
+            record(recorder, step, state)
+        if reductions is not None and is_reduction_step(reductions, step):
+            reduce(reductions, step, state)
+
+        step_next = next_event_step(step, step_stop, sampling_rate, stim_steps, phase_steps, int(state[ST3_STIM_INDEX]),
+                                    state[ST3_COUNTER1], state[ST3_COUNTER2], state[ST3_COUNTER3])
+        if recorder is not None:
+            step_next = next_record_step(recorder[1], step, step_next)
+        if reductions is not None:
+            step_next = next_reduction_step(reductions, step, step_next)
+        duration = (step_next - step) * delta_t
+        t, h, n_accepted_segment, n_rejected_segment = rk_integrate(state, ST3_BETA_E2 + 1, ST3_MAX_E, duration, h,
+                                                                    rtol, atol, max_step, False,
+                                                                    (weights, g, taus, rheobases, lambdas))
+        state[ST3_RK_ACCEPTED] += n_accepted_segment; state[ST3_RK_REJECTED] += n_rejected_segment
+        max_E[0] = state[ST3_MAX_E]
+
+        # The simulation stopped within the segment
+        if t < duration:
+            step_next = step + int(t * (1 / delta_t))
+        state[ST3_COUNTER1] += step_next - step; state[ST3_COUNTER2] += step_next - step; state[ST3_COUNTER3] += step_next - step
+        step = step_next
+        if t < duration:
+            break
+
+    state[ST3_STEP] = step
+    state[ST3_EXIT_REASON] = EXIT_STEP_STOP
+    if step < step_stop:
+        state[ST3_EXIT_REASON] = EXIT_EXPLODED if state[ST3_E1] > 1000 else EXIT_SILENT
+    return exit_status_3_compartmental_v3(state, delta_t)
+
+
+##### Steady state of the calibration run of model_3_compartmental_v3(), see calibration_rates()
+# The currents of the compartments are linear in the rates, so the rate dynamics are threshold-linear in the six
+# populations as in model()
+
+# Connectivity W and input b of the rate dynamics of model_3_compartmental_v3() (see rate_dynamics()), for the plastic
+# weights and the stimuli held in state
+@jit(nopython=True, nogil=True, cache=True)
+def rate_dynamics_3_compartmental_v3(state, weights, g, rheobases, lambdas, W, b):
+    (w_DEii, w_EEii, w_EPii, w_DSii, w_PEii, w_PPii, w_PSii, w_SEii,
+     w_DEij, w_EEij, w_EPij, w_DSij, w_PEij, w_PPij, w_PSij, w_SEij) = weights
+    (g_AD, g_BD, g_E, g_P, g_S) = g
+    (rheobase_E, rheobase_P, rheobase_S, rheobase_A, rheobase_B) = rheobases
+    (lambda_AD, lambda_BD) = lambdas
+
+    W[:, :] = 0
+    for i in range(2):
+        for j in range(2):
+            W[i, j] = lambda_AD * state[ST3_DE11 + 2*i + j] + lambda_BD * state[ST3_EE11 + 2*i + j]
+            W[i, 2 + j] = -state[ST3_EP11 + 2*i + j]
+            W[i, 4 + j] = -lambda_AD * state[ST3_DSA11 + 2*i + j] - lambda_BD * state[ST3_DSB11 + 2*i + j]
+    W[2, 0], W[2, 1], W[3, 0], W[3, 1] = w_PEii, w_PEij, w_PEij, w_PEii
+    W[2, 2], W[2, 3], W[3, 2], W[3, 3] = -w_PPii, -w_PPij, -w_PPij, -w_PPii
+    W[2, 4], W[2, 5], W[3, 4], W[3, 5] = -w_PSii, -w_PSij, -w_PSij, -w_PSii
+    W[4, 0], W[4, 1], W[5, 0], W[5, 1] = w_SEii, w_SEij, w_SEij, w_SEii
+
+    b[0] = lambda_AD * g_AD + lambda_BD * (g_BD + state[ST3_STIM_E1]) + g_E - rheobase_E
+    b[1] = lambda_AD * g_AD + lambda_BD * (g_BD + state[ST3_STIM_E2]) + g_E - rheobase_E
+    b[2] = g_P - rheobase_P + state[ST3_STIM_P1]; b[3] = g_P - rheobase_P + state[ST3_STIM_P2]
+    b[4] = g_S - rheobase_S + state[ST3_STIM_S1]; b[5] = g_S - rheobase_S + state[ST3_STIM_S2]
+
+
+# Counterpart of calibration_rates() for model_3_compartmental_v3(), which only stops if E1 explodes
+@jit(nopython=True, nogil=True, cache=True)
+def calibration_rates_3_compartmental_v3(weights, g, g_stim, taus, rheobases, lambdas, delta_t):
+    (g_stim_E, g_stim_P, g_stim_S) = g_stim
+    state = initial_state_3_compartmental_v3(weights)
+    W = np.empty((6, 6)); b = np.empty(6)
+    dt_taus = euler_factors(taus, delta_t)
+    r = state[ST3_E1:ST3_S2 + 1].copy()
+
+    # The baseline before the stimulus, then the response to the conditioning stimulus
+    for stimulated in range(2):
+        if stimulated:
+            state[ST3_STIM_E1], state[ST3_STIM_E2] = g_stim_E[0]
+            state[ST3_STIM_P1], state[ST3_STIM_P2] = g_stim_P[0]
+            state[ST3_STIM_S1], state[ST3_STIM_S2] = g_stim_S[0]
+        rate_dynamics_3_compartmental_v3(state, weights, g, rheobases, lambdas, W, b)
+        if not threshold_linear_fixed_point(W, b, r, dt_taus, n_squarings=16, log_norm_max=np.log(1e-7)):
+            return False, r
+        if r[0] > 1000:
+            return False, r
+    return True, r
+
+
+# Batched counterpart of model(). Every quantity that model() receives as a tuple of scalars is given here as an array
+# with one row per parameter set (weights: (n_sets, 14), g: (n_sets, 3), taus: (n_sets, 9), beta_K: (n_sets,),
+# rheobases: (n_sets, 3), flags: (n_sets, 6), flags_theta: (n_sets, 2)) and the stimuli as g_stim: (n_sets, 3, 2, 2),
+# i.e. g_stim[i] = (g_stim_E, g_stim_P, g_stim_S) of the i-th set. The protocol (delta_t, sampling_rate, sim_duration and
+# stim_times) is shared by all sets. The data arrays carry the parameter set as leading dimension, e.g. r_phase1 has
+# the shape (n_sets, 6, n_time_points_stim) and max_E the shape (n_sets, 1). The sets are distributed over all cores.
+# Returns the state vectors as columns of an array (N_STATE, n_sets) as model_lanes() does, e.g.
+# exit_status(states[:, i], delta_t) tells the data of the i-th set apart from the fill after an explosion or silence.
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def model_batch(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
+                g_stim, stim_times, taus, beta_K, rheobases, flags, flags_theta):
+
+    (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+    (J_exc_phase1, J_phase2) = l_res_weights
+
+    states = np.empty((N_STATE, weights.shape[0]))
+    for i in prange(weights.shape[0]):
+        weights_i = (weights[i, 0], weights[i, 1], weights[i, 2], weights[i, 3], weights[i, 4], weights[i, 5],
+                     weights[i, 6], weights[i, 7], weights[i, 8], weights[i, 9], weights[i, 10], weights[i, 11],
+                     weights[i, 12], weights[i, 13])
+        state = initial_state(weights_i)
+        model_from_state(state, sim_duration, delta_t, sampling_rate, (r_phase1[i], r_phase2[i], r_phase3[i], max_E[i]),
+                         (J_exc_phase1[i], J_phase2[i]), weights_i,
+                         (g[i, 0], g[i, 1], g[i, 2]),
+                         (g_stim[i, 0], g_stim[i, 1], g_stim[i, 2]), stim_times,
+                         (taus[i, 0], taus[i, 1], taus[i, 2], taus[i, 3], taus[i, 4], taus[i, 5], taus[i, 6], taus[i, 7],
+                          taus[i, 8]),
+                         beta_K[i], (rheobases[i, 0], rheobases[i, 1], rheobases[i, 2]),
+                         flags=(flags[i, 0], flags[i, 1], flags[i, 2], flags[i, 3], flags[i, 4], flags[i, 5]),
+                         flags_theta=(flags_theta[i, 0], flags_theta[i, 1]))
+        states[:, i] = state
+    return states
+
+
+# The weights of the i-th parameter set of a batch (see model_batch()) as the tuple model() receives
+@jit(nopython=True, nogil=True, cache=True)
+def lane_weights(weights, i):
+    return (weights[i, 0], weights[i, 1], weights[i, 2], weights[i, 3], weights[i, 4], weights[i, 5], weights[i, 6],
+            weights[i, 7], weights[i, 8], weights[i, 9], weights[i, 10], weights[i, 11], weights[i, 12], weights[i, 13])
+
+
+# Number of lanes model_lanes() advances in lockstep. It is the stride of the rows, a constant so that the compiler
+# can tell the rows apart and vectorise the loop over the lanes.
+LANES = 16
+
+# Rows of the parameters of the lanes that enter the dynamics, following the rows of the state vector
+(LN_G_E, LN_G_P, LN_G_S, LN_RHEOBASE_E, LN_RHEOBASE_P, LN_RHEOBASE_S,
+ LN_W_PEII, LN_W_PEIJ, LN_W_PPII, LN_W_PPIJ, LN_W_PSII, LN_W_PSIJ, LN_W_SEII, LN_W_SEIJ,
+ LN_DT_TAU_E, LN_DT_TAU_P, LN_DT_TAU_S, LN_DT_TAU_THETA,
+ LN_HEBBIAN_RATE, LN_BETA_RATE, LN_SCALING_RATE_E, LN_SCALING_RATE_P, LN_SCALING_RATE_S) = range(N_STATE, N_STATE + 23)
+N_LANE_ROWS = N_STATE + 23
+
+
+# Lane-batched counterpart of model_batch(), following the same conventions. Instead of distributing the parameter sets
+# over the cores, it advances up to LANES of them (the lanes) in lockstep on one core, and the next LANES after them.
+# The variables are held as rows over the lanes (structure of arrays, row k of lane i at k*LANES + i, with the rows of
+# the state vector first, see initial_state()), so the update of the rates and the weights is the same loop over the
+# lanes at every time step, which the compiler vectorises. The flags only enter the dynamics as factors here, as they
+# may differ between the lanes. The protocol is shared by the lanes, thus so are the segments between its events (see
+# next_event_step()). The events and the data registration at the top of a segment are applied per lane by one time
+# step of model_from_state(). A lane that explodes or falls silent is masked out with the state model_from_state()
+# would have left, the other lanes continue. The results are the same as the ones of model_batch(). Returns the state
+# vectors as columns of an array (N_STATE, n_sets), e.g. exit_status(states[:, i], delta_t) is the status of the
+# i-th set.
+@jit(nopython=True, nogil=True, cache=True)
+def model_lanes(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
+                g_stim, stim_times, taus, beta_K, rheobases, flags, flags_theta, exponential_euler=False):
+
+    states = np.empty((N_STATE, weights.shape[0]))
+    for lane_start in range(0, weights.shape[0], LANES):
+        n_lanes = min(LANES, weights.shape[0] - lane_start)
+        x = model_lanes_group(lane_start, n_lanes, delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration,
+                              weights, g, g_stim, stim_times, taus, beta_K, rheobases, flags, flags_theta,
+                              exponential_euler)
+        for i in range(n_lanes):
+            states[:, lane_start + i] = x[i:N_STATE * LANES:LANES]
+    return states
+
+
+# Simulates the parameter sets lane_start to lane_start + n_lanes of model_lanes(), returns their rows. The numpy
+# error model drops the check for a division by zero (the set points are bounded above zero), the exception it could
+# raise would keep the loop over the lanes from being vectorised.
+@jit(nopython=True, nogil=True, cache=True, error_model='numpy')
+def model_lanes_group(lane_start, n_lanes, delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights,
+                      g, g_stim, stim_times, taus, beta_K, rheobases, flags, flags_theta, exponential_euler):
+
+    (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+    (J_exc_phase1, J_phase2) = l_res_weights
+    (stim_steps, phase_steps) = event_steps(delta_t, stim_times)
+
+    x = np.zeros(N_LANE_ROWS * LANES)
+    for i in range(n_lanes):
+        j = lane_start + i
+        x[i:N_STATE * LANES:LANES] = initial_state(lane_weights(weights, j))
+        (w_EEii, w_EPii, w_ESii, w_PEii, w_PPii, w_PSii, w_SEii,
+         w_EEij, w_EPij, w_ESij, w_PEij, w_PPij, w_PSij, w_SEij) = lane_weights(weights, j)
+        (tau_E, tau_P, tau_S, tau_plas, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta) = \
+            (taus[j, 0], taus[j, 1], taus[j, 2], taus[j, 3], taus[j, 4], taus[j, 5], taus[j, 6], taus[j, 7], taus[j, 8])
+        x[LN_G_E*LANES + i], x[LN_G_P*LANES + i], x[LN_G_S*LANES + i] = g[j, 0], g[j, 1], g[j, 2]
+        x[LN_RHEOBASE_E*LANES + i], x[LN_RHEOBASE_P*LANES + i], x[LN_RHEOBASE_S*LANES + i] = \
+            rheobases[j, 0], rheobases[j, 1], rheobases[j, 2]
+        x[LN_W_PEII*LANES + i], x[LN_W_PEIJ*LANES + i] = w_PEii, w_PEij
+        x[LN_W_PPII*LANES + i], x[LN_W_PPIJ*LANES + i] = w_PPii, w_PPij
+        x[LN_W_PSII*LANES + i], x[LN_W_PSIJ*LANES + i] = w_PSii, w_PSij
+        x[LN_W_SEII*LANES + i], x[LN_W_SEIJ*LANES + i] = w_SEii, w_SEij
+        # The factors of the time constants, calculated as in model_from_state()
+        if exponential_euler:
+            x[LN_DT_TAU_E*LANES + i], x[LN_DT_TAU_P*LANES + i], x[LN_DT_TAU_S*LANES + i] = \
+                -np.expm1(-delta_t / tau_E), -np.expm1(-delta_t / tau_P), -np.expm1(-delta_t / tau_S)
+        else:
+            x[LN_DT_TAU_E*LANES + i], x[LN_DT_TAU_P*LANES + i], x[LN_DT_TAU_S*LANES + i] = \
+                delta_t*(1/tau_E), delta_t*(1/tau_P), delta_t*(1/tau_S)
+        x[LN_DT_TAU_THETA*LANES + i] = delta_t * (1 / tau_theta)
+    active = np.zeros(LANES, dtype=np.bool_)
+    active[:n_lanes] = True
+    state = np.empty(N_STATE)
+
+    step = 0
+    while step < sim_duration:
+
+        ### The events and the data registration of this time step, followed by its dynamics, per lane
+        for i in range(n_lanes):
+            if not active[i]:
+                continue
+            j = lane_start + i
+            state[:] = x[i:N_STATE * LANES:LANES]
+            model_from_state(state, step + 1, delta_t, sampling_rate, (r_phase1[j], r_phase2[j], r_phase3[j], max_E[j]),
+                             (J_exc_phase1[j], J_phase2[j]), lane_weights(weights, j),
+                             (g[j, 0], g[j, 1], g[j, 2]), (g_stim[j, 0], g_stim[j, 1], g_stim[j, 2]), stim_times,
+                             (taus[j, 0], taus[j, 1], taus[j, 2], taus[j, 3], taus[j, 4], taus[j, 5], taus[j, 6],
+                              taus[j, 7], taus[j, 8]),
+                             beta_K[j], (rheobases[j, 0], rheobases[j, 1], rheobases[j, 2]),
+                             flags=(flags[j, 0], flags[j, 1], flags[j, 2], flags[j, 3], flags[j, 4], flags[j, 5]),
+                             flags_theta=(flags_theta[j, 0], flags_theta[j, 1]), exponential_euler=exponential_euler)
+            x[i:N_STATE * LANES:LANES] = state
+            active[i] = state[ST_EXIT_REASON] == EXIT_STEP_STOP
+        step = step + 1
+        if not active.any():
+            break
+
+        ### The dynamics of all the lanes are iterated until the next event
+        # The counters of the lanes still running are the same, they are the ones of step after its events minus one
+        i_active = np.argmax(active)
+        step_next = next_event_step(step - 1, sim_duration, sampling_rate, stim_steps, phase_steps,
+                                    int(x[ST_STIM_INDEX*LANES + i_active]), int(x[ST_COUNTER1*LANES + i_active]) - 1,
+                                    int(x[ST_COUNTER2*LANES + i_active]) - 1, int(x[ST_COUNTER3*LANES + i_active]) - 1)
+        # The factors of the plasticity terms, zero for the mechanisms switched off
+        for i in range(n_lanes):
+            j = lane_start + i
+            x[LN_HEBBIAN_RATE*LANES + i] = \
+                x[ST_HEBBIAN*LANES + i] * x[ST_LEARNING_RATE*LANES + i] * delta_t * (1 / taus[j, 3])
+            x[LN_SCALING_RATE_E*LANES + i] = x[ST_E_SCALING*LANES + i] * (delta_t * (1 / taus[j, 4]))
+            x[LN_SCALING_RATE_P*LANES + i] = x[ST_P_SCALING*LANES + i] * (delta_t * (1 / taus[j, 5]))
+            x[LN_SCALING_RATE_S*LANES + i] = x[ST_S_SCALING*LANES + i] * (delta_t * (1 / taus[j, 6]))
+            x[LN_BETA_RATE*LANES + i] = x[ST_ADAPTIVE_SET_POINT*LANES + i] * (delta_t * (1 / taus[j, 8]))
+
+        for step_dynamics in range(step, step_next):
+            # The same loop for all the lanes, without branches. The lanes stopped keep their state.
+            for i in range(n_lanes):
+                E01 = x[ST_E1*LANES + i]
+                # The maximum is held as the float32 of max_E. A lane that explodes or falls silent is stopped as in
+                # model_from_state(), the others continue.
+                max_E_lane = x[ST_MAX_E*LANES + i]
+                x[ST_MAX_E*LANES + i] = np.float32(E01) if active[i] & (E01 > max_E_lane) else max_E_lane
+                stop = active[i] & ((E01 > 1000) | (E01 == 0))
+                live = active[i] & ~stop
+                active[i] = live
+                x[ST_STEP*LANES + i] = step_dynamics if stop else x[ST_STEP*LANES + i]
+                x[ST_EXIT_REASON*LANES + i] = (EXIT_EXPLODED if E01 > 1000 else EXIT_SILENT) if stop \
+                    else x[ST_EXIT_REASON*LANES + i]
+                x[ST_COUNTER1*LANES + i] += stop * (step_dynamics - step)
+                x[ST_COUNTER2*LANES + i] += stop * (step_dynamics - step)
+                x[ST_COUNTER3*LANES + i] += stop * (step_dynamics - step)
+
+                E02, P01, P02, S01, S02 = x[ST_E2*LANES + i], x[ST_P1*LANES + i], \
+                    x[ST_P2*LANES + i], x[ST_S1*LANES + i], x[ST_S2*LANES + i]
+                EE110, EE120, EE210, EE220 = \
+                    x[ST_EE11*LANES + i], x[ST_EE12*LANES + i], x[ST_EE21*LANES + i], x[ST_EE22*LANES + i]
+                EP110, EP120, EP210, EP220 = \
+                    x[ST_EP11*LANES + i], x[ST_EP12*LANES + i], x[ST_EP21*LANES + i], x[ST_EP22*LANES + i]
+                ES110, ES120, ES210, ES220 = \
+                    x[ST_ES11*LANES + i], x[ST_ES12*LANES + i], x[ST_ES21*LANES + i], x[ST_ES22*LANES + i]
+                theta10, theta20, beta10, beta20 = \
+                    x[ST_THETA1*LANES + i], x[ST_THETA2*LANES + i], x[ST_BETA1*LANES + i], x[ST_BETA2*LANES + i]
+                g_E, g_P, g_S = x[LN_G_E*LANES + i], x[LN_G_P*LANES + i], x[LN_G_S*LANES + i]
+                rheobase_E, rheobase_P, rheobase_S = \
+                    x[LN_RHEOBASE_E*LANES + i], x[LN_RHEOBASE_P*LANES + i], x[LN_RHEOBASE_S*LANES + i]
+                w_PEii, w_PEij, w_PPii, w_PPij = \
+                    x[LN_W_PEII*LANES + i], x[LN_W_PEIJ*LANES + i], x[LN_W_PPII*LANES + i], x[LN_W_PPIJ*LANES + i]
+                w_PSii, w_PSij, w_SEii, w_SEij = \
+                    x[LN_W_PSII*LANES + i], x[LN_W_PSIJ*LANES + i], x[LN_W_SEII*LANES + i], x[LN_W_SEIJ*LANES + i]
+                dt_tau_E, dt_tau_P, dt_tau_S = \
+                    x[LN_DT_TAU_E*LANES + i], x[LN_DT_TAU_P*LANES + i], x[LN_DT_TAU_S*LANES + i]
+
+                ### Calculating the firing rates at this timestep
+                I1 = g_E - EP110 * P01 - EP120 * P02 - ES110 * S01 - ES120 * S02 + EE110 * E01 + EE120 * E02 + x[ST_STIM_E1*LANES + i]
+                I2 = g_E - EP210 * P01 - EP220 * P02 - ES210 * S01 - ES220 * S02 + EE210 * E01 + EE220 * E02 + x[ST_STIM_E2*LANES + i]
+
+                E1 = E01 + dt_tau_E*(-E01 + np.maximum(0,I1 - rheobase_E))
+                E2 = E02 + dt_tau_E*(-E02 + np.maximum(0,I2 - rheobase_E))
+
+                P1 = P01 + dt_tau_P*(-P01 + np.maximum(0, w_PEii * E01 + w_PEij * E02 - w_PSii * S01 - w_PSij * S02
+                                                        -w_PPii * P01 - w_PPij * P02 + g_P - rheobase_P + x[ST_STIM_P1*LANES + i]))
+                P2 = P02 + dt_tau_P*(-P02 + np.maximum(0, w_PEij * E01 + w_PEii * E02 - w_PSij * S01 - w_PSii * S02
+                                                        -w_PPij * P01 - w_PPii * P02 + g_P - rheobase_P + x[ST_STIM_P2*LANES + i]))
+
+                S1 = S01 + dt_tau_S*(-S01 + np.maximum(0, w_SEii * E01 + w_SEij * E02 + g_S - rheobase_S + x[ST_STIM_S1*LANES + i]))
+                S2 = S02 + dt_tau_S*(-S02 + np.maximum(0, w_SEij * E01 + w_SEii * E02 + g_S - rheobase_S + x[ST_STIM_S2*LANES + i]))
+
+                n_clamps = ((E1 < 0) + (E2 < 0) + (P1 < 0) + (P2 < 0) + (S1 < 0) + (S2 < 0) + (beta10 < 0)
+                            + (beta20 < 0) + (theta10 < 1e-10) + (theta20 < 1e-10))
+                E1 = max(E1, 0); E2 = max(E2, 0)
+                P1 = max(P1, 0); P2 = max(P2, 0)
+                S1 = max(S1, 0); S2 = max(S2, 0)
+                beta1 = max(beta10, 0); beta2 = max(beta20, 0)
+                theta1 = max(theta10, 1e-10); theta2 = max(theta20, 1e-10)
+
+                ### Calculating the plasticity for this timestep, the terms of the mechanisms switched off are zero
+                beta1 = beta1 + x[LN_BETA_RATE*LANES + i] * (E1 - beta1)
+                beta2 = beta2 + x[LN_BETA_RATE*LANES + i] * (E2 - beta2)
+
+                theta1 = theta1 + x[LN_DT_TAU_THETA*LANES + i] * \
+                    (-x[ST_ADAPTIVE_SET_POINT*LANES + i]*(theta1 - beta1) + x[ST_THETA_LOCAL*LANES + i]*(E1 - theta1))
+                theta2 = theta2 + x[LN_DT_TAU_THETA*LANES + i] * \
+                    (-x[ST_ADAPTIVE_SET_POINT*LANES + i]*(theta2 - beta2) + x[ST_THETA_LOCAL*LANES + i]*(E2 - theta2))
+
+                ratio_E1 = E1 / theta1; ratio_E2 = E2 / theta2
+
+                ss1_e = x[LN_SCALING_RATE_E*LANES + i] * ((1 - ratio_E1))
+                ss2_e = x[LN_SCALING_RATE_E*LANES + i] * ((1 - ratio_E2))
+                ss1_p = x[LN_SCALING_RATE_P*LANES + i] * ((1 - ratio_E1))
+                ss2_p = x[LN_SCALING_RATE_P*LANES + i] * ((1 - ratio_E2))
+                ss1_s = x[LN_SCALING_RATE_S*LANES + i] * ((1 - ratio_E1))
+                ss2_s = x[LN_SCALING_RATE_S*LANES + i] * ((1 - ratio_E2))
+
+                hebbian_rate, r_baseline = x[LN_HEBBIAN_RATE*LANES + i], x[ST_R_BASELINE*LANES + i]
+                EE11 = EE110 + ss1_e*EE110 + hebbian_rate * (E1 - r_baseline) * E1
+                EE12 = EE120 + ss1_e*EE120 + hebbian_rate * (E1 - r_baseline) * E2
+                EE21 = EE210 + ss2_e*EE210 + hebbian_rate * (E2 - r_baseline) * E1
+                EE22 = EE220 + ss2_e*EE220 + hebbian_rate * (E2 - r_baseline) * E2
+                EP11  = EP110 - ss1_p*EP110
+                EP12  = EP120 - ss1_p*EP120
+                EP21  = EP210 - ss2_p*EP210
+                EP22  = EP220 - ss2_p*EP220
+                ES11  = ES110 + ss1_s*ES110
+                ES12  = ES120 + ss1_s*ES120
+                ES21  = ES210 + ss2_s*ES210
+                ES22  = ES220 + ss2_s*ES220
+
+                n_clamps += ((EE11 < 0) + (EE12 < 0) + (EE21 < 0) + (EE22 < 0) + (EP11 < 0) + (EP12 < 0) + (EP21 < 0)
+                             + (EP22 < 0) + (ES11 < 0) + (ES12 < 0) + (ES21 < 0) + (ES22 < 0))
+                EE11 = max(0,EE11);EE12 = max(0,EE12)
+                EE21 = max(0,EE21);EE22 = max(0,EE22)
+                EP11 = max(0,EP11);EP12 = max(0,EP12)
+                EP21 = max(0,EP21);EP22 = max(0,EP22)
+                ES11 = max(0,ES11);ES12 = max(0,ES12)
+                ES21 = max(0,ES21);ES22 = max(0,ES22)
+
+                x[ST_E1*LANES + i] = E1 if live else E01; x[ST_E2*LANES + i] = E2 if live else E02
+                x[ST_P1*LANES + i] = P1 if live else P01; x[ST_P2*LANES + i] = P2 if live else P02
+                x[ST_S1*LANES + i] = S1 if live else S01; x[ST_S2*LANES + i] = S2 if live else S02
+                x[ST_EE11*LANES + i] = EE11 if live else EE110; x[ST_EE12*LANES + i] = EE12 if live else EE120
+                x[ST_EE21*LANES + i] = EE21 if live else EE210; x[ST_EE22*LANES + i] = EE22 if live else EE220
+                x[ST_EP11*LANES + i] = EP11 if live else EP110; x[ST_EP12*LANES + i] = EP12 if live else EP120
+                x[ST_EP21*LANES + i] = EP21 if live else EP210; x[ST_EP22*LANES + i] = EP22 if live else EP220
+                x[ST_ES11*LANES + i] = ES11 if live else ES110; x[ST_ES12*LANES + i] = ES12 if live else ES120
+                x[ST_ES21*LANES + i] = ES21 if live else ES210; x[ST_ES22*LANES + i] = ES22 if live else ES220
+                x[ST_THETA1*LANES + i] = theta1 if live else theta10; x[ST_THETA2*LANES + i] = theta2 if live else theta20
+                x[ST_BETA1*LANES + i] = beta1 if live else beta10; x[ST_BETA2*LANES + i] = beta2 if live else beta20
+                x[ST_N_CLAMPS*LANES + i] += live * n_clamps
+
+        # Update the data-holder counters of the lanes still running with the number of time steps iterated
+        for i in range(n_lanes):
+            max_E[lane_start + i, 0] = x[ST_MAX_E*LANES + i]
+            if active[i]:
+                x[ST_COUNTER1*LANES + i] += step_next - step
+                x[ST_COUNTER2*LANES + i] += step_next - step
+                x[ST_COUNTER3*LANES + i] += step_next - step
+                x[ST_STEP*LANES + i] = step_next
+        step = step_next
+
+    return x
+
+
+# Batched counterpart of model_3_compartmental_v3(), following the same conventions as model_batch() (weights:
+# (n_sets, 16), g: (n_sets, 5), taus: (n_sets, 10), K: (n_sets,), rheobases: (n_sets, 5), lambdas: (n_sets, 2)).
+# Returns the state vectors as columns of an array (N_STATE_3_COMPARTMENTAL, n_sets), see
+# exit_status_3_compartmental_v3().
+@jit(nopython=True, nogil=True, parallel=True, cache=True)
+def model_3_compartmental_v3_batch(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g,
+                                   g_stim, stim_times, taus, K, rheobases, lambdas, flags, flags_theta):
+
+    (r_phase1, I_phase1, r_phase2, I_phase2, set_phase2, r_phase3, max_E) = l_res_rates
+    (J_exc_phase1, J_phase2) = l_res_weights
+
+    states = np.empty((N_STATE_3_COMPARTMENTAL, weights.shape[0]))
+    for i in prange(weights.shape[0]):
+        weights_i = (weights[i, 0], weights[i, 1], weights[i, 2], weights[i, 3], weights[i, 4], weights[i, 5],
+                     weights[i, 6], weights[i, 7], weights[i, 8], weights[i, 9], weights[i, 10], weights[i, 11],
+                     weights[i, 12], weights[i, 13], weights[i, 14], weights[i, 15])
+        state = initial_state_3_compartmental_v3(weights_i)
+        model_3_compartmental_v3_from_state(state, sim_duration, delta_t, sampling_rate,
+                                            (r_phase1[i], I_phase1[i], r_phase2[i], I_phase2[i], set_phase2[i],
+                                             r_phase3[i], max_E[i]),
+                                            (J_exc_phase1[i], J_phase2[i]), weights_i,
+                                            (g[i, 0], g[i, 1], g[i, 2], g[i, 3], g[i, 4]),
+                                            (g_stim[i, 0], g_stim[i, 1], g_stim[i, 2]), stim_times,
+                                            (taus[i, 0], taus[i, 1], taus[i, 2], taus[i, 3], taus[i, 4], taus[i, 5],
+                                             taus[i, 6], taus[i, 7], taus[i, 8], taus[i, 9]),
+                                            K[i],
+                                            (rheobases[i, 0], rheobases[i, 1], rheobases[i, 2], rheobases[i, 3],
+                                             rheobases[i, 4]),
+                                            (lambdas[i, 0], lambdas[i, 1]),
+                                            flags=(flags[i, 0], flags[i, 1], flags[i, 2], flags[i, 3], flags[i, 4],
+                                                   flags[i, 5]),
+                                            flags_theta=(flags_theta[i, 0], flags_theta[i, 1]))
+        states[:, i] = state
+    return states
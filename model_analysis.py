@@ -1,17 +1,17 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from util import *
 import sys
-from model import *
-from plotting_functions import *
+from simulation import *
 import os
 # from parameters import *
 import pickle
+import time
 
 def analyze_model(hour_sim, flags_list, flags_theta=(1,1), dir_data=r'\figures\data\\', dir_plot=r'\figures\\',
-                  K=0.25, flag_only_S_on=False, run_simulation=True, save_results = False, plot_results=False,modulation_SST=0):
+                  K=0.25, flag_only_S_on=False, run_simulation=True, save_results = False, plot_results=False,modulation_SST=0,
+                  checkpoint_fork=True, integrator='euler', resume=False):
     """
-    :param hour_sim: Defines how many hours does the simulation lasts
+    :param hour_sim: Defines how many hours does the simulation lasts. A list of hours (e.g. [4, 24, 48]) is analyzed as
+    one simulation per hour, each saved and plotted on its own
     :param flags_list: contains a list of tuples. Each tuple is a collection of all the flags (e.g. synaptic scaling, hebbian learning, ...)
     :param flags_theta: used to study the behaviour of the model (no longer useful). Theta1 for population1 and Theta2 for population2
     :param dir_data
@@ -22,6 +22,12 @@ def analyze_model(hour_sim, flags_list, flags_theta=(1,1), dir_data=r'\figures\d
     :param run_simulation: True to run the numerical simulation, False to read the already saved data
     :param save_results: True to save the results
     :param plot_results: True to plot the results
+    :param checkpoint_fork: True to simulate the shorter durations of a list of hour_sim as forks of the longest one
+    (see run_test_probes()), False to simulate them one by one
+    :param integrator: 'euler', 'qss' (slow-manifold integration of phase 2) or 'parareal' (phase 2 in time slices on
+    all the cores), see run_test_probes()
+    :param resume: True to keep the state before the latest test in a checkpoint file in dir_data and to resume the
+    simulation from it when it is run again with a later test (e.g. 72h after 48h, see run_test_probes())
 
     Multi-purpose function to analyze the model. Here we run (if run_simulation is True) our computational model to
     investigate the role of cell-type dependent synaptic scaling mechanisms in associative learning. We replicate the
@@ -52,24 +58,16 @@ def analyze_model(hour_sim, flags_list, flags_theta=(1,1), dir_data=r'\figures\d
 
     os.makedirs(dir_data, exist_ok=True)
     os.makedirs(dir_plot, exist_ok=True)
+    hour_sims = list(hour_sim) if np.iterable(hour_sim) else [hour_sim]
     stim_duration = 15  # stimulation duration in seconds
-    # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially (thermalization)
-    sim_duration = int((hour_sim) * 60 * 60 + (stim_duration + 10) * 2 + 2)
     delta_t = 0.0001  # time step in seconds (0.1 ms)
     sampling_rate_stim = 20  # register data at every 20 step during phase 1 and 3 (conditioning and testing)
     sampling_rate_sim = 200_000  # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
     sampling_rate = (sampling_rate_stim, sampling_rate_sim)
 
-    # Total number of timepoints for stimulation and simulation
+    # Total number of timepoints for stimulation
     n_time_points_stim = int((stim_duration + 10) * (1 / delta_t) * (1 / sampling_rate_stim))
-    n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1 # total no the rest
-
     l_time_points_stim = np.linspace(0, stim_duration + 10, n_time_points_stim) #time points for the first 15s
-    l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2) ##time points for the seoncd phase 4/24/48h
-
-    # Timepoints of the onset (first column) and offset (second column) of the first (first row) and second (second) stimuli.
-    stim_times = np.array([[5, 5 + stim_duration],
-                           [int(hour_sim * 60 * 60) + 5, int(hour_sim * 60 * 60) + 5 + stim_duration]]).reshape(2, 2)
 
     # The stimuli are given as inputs to the populations.
     g_stim_E = np.array([(1, 0), (0, 1)])
@@ -126,23 +124,8 @@ def analyze_model(hour_sim, flags_list, flags_theta=(1,1), dir_data=r'\figures\d
     weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
                w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
 
-    # Arrays created to hold data
-    r_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-    J_EE_phase1 = np.zeros((4, n_time_points_stim), dtype=np.float32)  # WEE11,WEE12,WEE21,WEE22
-    r_phase2 = np.zeros((10, n_time_points_phase2),
-                        dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2,theta1,theta2,beta1,beta2
-    J_phase2 = np.zeros((12, n_time_points_phase2),
-                        dtype=np.float32)  # WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-    r_phase3 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-    max_E = np.zeros(1, dtype=np.float32)
-
-    # Lists to hold data arrays
-    l_res_rates = (r_phase1, r_phase2, r_phase3, max_E)
-    l_res_weights = (J_EE_phase1, J_phase2)
-
     for flags in flags_list:
         id, title = determine_name(flags)
-        name = 'Case' + id + '_' + str(hour_sim) + 'h' + '_k' + str(K).replace(".","")
 
         print('*****', title, '*****')
 
@@ -152,42 +135,56 @@ def analyze_model(hour_sim, flags_list, flags_theta=(1,1), dir_data=r'\figures\d
             print('\n')
 
             #All flags = 0 and simulation is 30 seconds long. It is used to evaluate what happens when activating E1 what's the response of E2. Afterwards it is evaluating the av_threshold given the result
-            model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(30 * (1 / delta_t)), weights,
-                  back_inputs, g_stim, stim_times, taus, K, rheobases, flags=(0,0,0,0,0,0), flags_theta=flags_theta)
-
-            idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
             # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
-            av_threshold = r_phase1[1][idx_av_threshold]
-
-            model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(sim_duration * (1 / delta_t)), weights,
-                  back_inputs, g_stim, stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta)
-
-            if save_results:
-                l_results = [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates,
-                             l_res_weights,
-                             av_threshold, stim_times, stim_duration, sim_duration]
-
-                # Open a file and save
-                with open(dir_data + name + '.pkl', 'wb') as file:
-                    # A new file will be created
-                    pickle.dump(l_results, file)
-                print('Data is saved.')
-
-        else:
-            # Open the file and read
-            with open(dir_data + name + '.pkl', 'rb') as file:
-                l_results = pickle.load(file)
-            print('Data is read.')
-
-            [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates, l_res_weights,
-             av_threshold, stim_times, stim_duration, sim_duration] = l_results
-
-        if plot_results:
-            print('Plotting the results.')
-            time_plots([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights, av_threshold,
-                       stim_times, dir_plot + name, hour_sim,modulation_SST, flag_only_S_on=flag_only_S_on, format='.png')
-            time_plots([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights, av_threshold,
-                       stim_times, dir_plot + name, hour_sim,modulation_SST, flag_only_S_on=flag_only_S_on, format='.pdf')
+            av_threshold = aversion_threshold(hour_sims[-1], delta_t, sampling_rate, weights, back_inputs, g_stim,
+                                              taus, K, rheobases, flags_theta=flags_theta, stim_duration=stim_duration,
+                                              cache_dir=dir_data + 'threshold_cache')
+
+            # The shorter simulations are the beginning of the longest one
+            checkpoint_file = dir_data + 'Case' + id + '_k' + str(K).replace(".","") + '_checkpoint.pkl' if resume else None
+            l_probes = run_test_probes(hour_sims, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K,
+                                       rheobases, flags, flags_theta=flags_theta, stim_duration=stim_duration,
+                                       checkpoint_fork=checkpoint_fork, integrator=integrator,
+                                       checkpoint_file=checkpoint_file)
+
+        for i_hour, hour_sim in enumerate(hour_sims):
+            name = 'Case' + id + '_' + str(hour_sim) + 'h' + '_k' + str(K).replace(".","")
+
+            if run_simulation:
+                # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially (thermalization)
+                sim_duration = int((hour_sim) * 60 * 60 + (stim_duration + 10) * 2 + 2)
+                n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1 # total no the rest
+                l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2) ##time points for the seoncd phase 4/24/48h
+                stim_times = get_stim_times(hour_sim, stim_duration)
+                l_res_rates, l_res_weights = l_probes[i_hour]
+
+                if save_results:
+                    l_results = [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates,
+                                 l_res_weights,
+                                 av_threshold, stim_times, stim_duration, sim_duration]
+
+                    # Open a file and save
+                    with open(dir_data + name + '.pkl', 'wb') as file:
+                        # A new file will be created
+                        pickle.dump(l_results, file)
+                    print('Data is saved.')
+
+            else:
+                # Open the file and read
+                with open(dir_data + name + '.pkl', 'rb') as file:
+                    l_results = pickle.load(file)
+                print('Data is read.')
+
+                [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates, l_res_weights,
+                 av_threshold, stim_times, stim_duration, sim_duration] = l_results
+
+            if plot_results:
+                from plotting_functions import time_plots
+                print('Plotting the results.')
+                time_plots([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights, av_threshold,
+                           stim_times, dir_plot + name, hour_sim,modulation_SST, flag_only_S_on=flag_only_S_on, format='.png')
+                time_plots([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights, av_threshold,
+                           stim_times, dir_plot + name, hour_sim,modulation_SST, flag_only_S_on=flag_only_S_on, format='.pdf')
 
 
 #this function is a generalized version of the one above. this one, with the right flags, is the only one necessary. For clarity, they are separated
@@ -312,19 +309,6 @@ def analyze_model_timescales(hour_sim, flags_list, flags_theta=(1,1), dir_data=r
             weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
                     w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
 
-            # Arrays created to hold data
-            r_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-            J_EE_phase1 = np.zeros((4, n_time_points_stim), dtype=np.float32)  # WEE11,WEE12,WEE21,WEE22
-            r_phase2 = np.zeros((10, n_time_points_phase2),
-                                dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2,theta1,theta2,beta1,beta2
-            J_phase2 = np.zeros((12, n_time_points_phase2),
-                                dtype=np.float32)  # WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-            r_phase3 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-            max_E = np.zeros(1, dtype=np.float32)
-
-            # Lists to hold data arrays
-            l_res_rates = (r_phase1, r_phase2, r_phase3, max_E)
-            l_res_weights = (J_EE_phase1, J_phase2)
             for flags in flags_list:
                 id, title = determine_name(flags)
                 name = 'Case' + id + '_' + str(hour_sim) + 'h' + '_k' + str(K).replace(".","") + '_theta_' + str(int(tau_theta/3600)).replace(".","") + '_beta_' + str(int(tau_beta/3600)).replace(".","")
@@ -337,15 +321,17 @@ def analyze_model_timescales(hour_sim, flags_list, flags_theta=(1,1), dir_data=r
                     print('\n')
 
                     #All flags = 0 and simulation is 30 seconds long. It is used to evaluate what happens when activating E1 what's the response of E2. Afterwards it is evaluating the av_threshold given the result
-                    model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(30 * (1 / delta_t)), weights,
-                        back_inputs, g_stim, stim_times, taus, K, rheobases, flags=(0,0,0,0,0,0), flags_theta=flags_theta)
-
-                    idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
+                    # Both simulations continue the first 7 seconds shared by all the flags (see run_prefix())
                     # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
-                    av_threshold = r_phase1[1][idx_av_threshold]
+                    av_threshold = aversion_threshold(hour_sim, delta_t, sampling_rate, weights, back_inputs, g_stim,
+                                                      taus, K, rheobases, flags_theta=flags_theta,
+                                                      stim_duration=stim_duration,
+                                                      cache_dir=dir_data + 'threshold_cache')
 
-                    model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(sim_duration * (1 / delta_t)), weights,
-                        back_inputs, g_stim, stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta)
+                    [(l_res_rates, l_res_weights)] = run_test_probes([hour_sim], delta_t, sampling_rate, weights,
+                                                                     back_inputs, g_stim, taus, K, rheobases, flags,
+                                                                     flags_theta=flags_theta,
+                                                                     stim_duration=stim_duration)
 
                     if save_results:
                         l_results = [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates,
@@ -368,6 +354,7 @@ def analyze_model_timescales(hour_sim, flags_list, flags_theta=(1,1), dir_data=r
                     av_threshold, stim_times, stim_duration, sim_duration] = l_results
 
                 if plot_results:
+                    from plotting_functions import time_plots
                     print('Plotting the results.')
                     os.makedirs(dir_plot + 'theta_' + str(int(tau_theta/3600)).replace(".","") + '_beta_' + str(int(tau_beta/3600)).replace(".","") + "/", exist_ok=True)
                     time_plots([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights, av_threshold,
@@ -377,12 +364,18 @@ def analyze_model_timescales(hour_sim, flags_list, flags_theta=(1,1), dir_data=r
 
 
 
-def analyze_model_3_compartmental_v3(hour_sim, flags_list, dir_data=r'\figures\data\\', dir_plot=r'\figures\\', modulation_SST=0, run_simulation=True, save_results=False, plot_results=False):
+def analyze_model_3_compartmental_v3(hour_sim, flags_list, dir_data=r'\figures\data\\', dir_plot=r'\figures\\', modulation_SST=0, run_simulation=True, save_results=False, plot_results=False,
+                                     checkpoint_fork=True, resume=False):
     """
-    :param hour_sim: Defines how many hours does the simulation lasts
+    :param hour_sim: Defines how many hours does the simulation lasts. A list of hours (e.g. [4, 24, 48]) is analyzed as
+    one simulation per hour, each saved and plotted on its own
     :param run_simulation: True to run the numerical simulation, False to read the already saved data
     :param save_results: True to save the results
     :param plot_results: True to plot the results
+    :param checkpoint_fork: True to simulate the shorter durations of a list of hour_sim as forks of the longest one
+    (see run_test_probes()), False to simulate them one by one
+    :param resume: True to keep the state before the latest test in a checkpoint file in dir_data and to resume the
+    simulation from it when it is run again with a later test (see analyze_model())
 
     Multi-purpose function to analyze the model. Here we run (if run_simulation is True) our computational model to
     investigate the role of cell-type dependent synaptic scaling mechanisms in associative learning. We replicate the
@@ -412,24 +405,16 @@ def analyze_model_3_compartmental_v3(hour_sim, flags_list, dir_data=r'\figures\d
     """
     os.makedirs(dir_data, exist_ok=True)
     os.makedirs(dir_plot, exist_ok=True)
+    hour_sims = list(hour_sim) if np.iterable(hour_sim) else [hour_sim]
     delta_t = 0.0001  # time step in seconds (0.1 ms)
     stim_duration = 15  # stimulation duration in seconds
-    # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially
-    sim_duration = int(((hour_sim) * 60 * 60 + (stim_duration + 10) * 2 + 2)*(1/delta_t))
     sampling_rate_stim = 20  # register data at every 20 step during phase 1 and 3 (conditioning and testing)
     sampling_rate_sim = 200_000  # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
     sampling_rate = (sampling_rate_stim, sampling_rate_sim)
 
-    # Total number of timepoints for stimulation and simulation
+    # Total number of timepoints for stimulation
     n_time_points_stim = int((stim_duration + 10) * (1 / delta_t) * (1 / sampling_rate_stim))
-    n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1  # total no the rest
-
     l_time_points_stim = np.linspace(0, stim_duration + 10, n_time_points_stim)
-    l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2)
-
-    # Timepoints of the onset (first column) and offset (second column) of the first (first row) and second (second) stimuli.
-    stim_times = np.array([[5, 5 + stim_duration],
-                           [int(hour_sim * 60 * 60) + 5, int(hour_sim * 60 * 60) + 5 + stim_duration]]).reshape(2, 2)
 
     # Time constants
     tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
@@ -493,22 +478,6 @@ def analyze_model_3_compartmental_v3(hour_sim, flags_list, dir_data=r'\figures\d
     weights = (w_DE_within, w_EE_within, w_EP_within, w_DS_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
                w_DE_cross,  w_EE_cross,  w_EP_cross,  w_DS_cross,  w_PE_cross,  w_PP_cross,  w_PS_cross,  w_SE_cross)
 
-    # Arrays created to hold data
-    r_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-    I_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # IAD1, IAD2, IBD1, IBD2, IE1, IE2
-    J_exc_phase1 = np.zeros((8, n_time_points_stim), dtype=np.float32)  # WDE11,WDE12,WDE21,WDE22,WEE11,WEE12,WEE21,WEE22
-    r_phase2 = np.zeros((6, n_time_points_phase2), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-    set_phase2 = np.zeros((12, n_time_points_phase2), dtype=np.float32) # thetaDD1,thetaDD2,thetaBD1,thetaBD2,thetaE1,thetaE2,betaAD1,betaAD2,betaBD1,betaBD2,betaE1,betaE2
-    I_phase2 = np.zeros((6, n_time_points_phase2), dtype=np.float32) # IAD1, IAD2, IBD1, IBD2, IE1, IE2
-    J_phase2 = np.zeros((20, n_time_points_phase2),
-                        dtype=np.float32)  # WDE11,WDE12,WDE21,WDE22,WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-    r_phase3 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-    max_E = np.zeros(1, dtype=np.float32)
-
-    # Lists to hold data arrays
-    l_res_rates = (r_phase1, I_phase1, r_phase2, I_phase2, set_phase2, r_phase3, max_E)
-    l_res_weights = (J_exc_phase1, J_phase2)
-
     # The flags for activating the following plasticity mechanisms in the given order: Hebbian learning, three-factor Hebbian learning,
     # adaptive set point, E-to-E scaling, P-to-E scaling, S-to-E scaling
 
@@ -516,51 +485,66 @@ def analyze_model_3_compartmental_v3(hour_sim, flags_list, dir_data=r'\figures\d
 
     for flags in flags_list:
         id, title = determine_name(flags)
-        name = 'Case' + id + '_' + str(hour_sim) + 'h' # + '_k' + str(K).replace(".","") + '_td' + str(g_top_down_to_S)
         print('*****', title, '*****')
 
         if run_simulation:
 
             print('Simulation started.')
             print('\n')
-            model_3_compartmental_v3(delta_t, sampling_rate, l_res_rates, l_res_weights, sim_duration, weights, g, g_stim,
-                                  stim_times, taus, K, rheobases, lambdas, flags=flags,flags_theta=flags_theta)
+            # The shorter simulations are the beginning of the longest one
+            checkpoint_file = dir_data + 'Case' + id + '_checkpoint.pkl' if resume else None
+            l_probes = run_test_probes(hour_sims, delta_t, sampling_rate, weights, g, g_stim, taus, K, rheobases, flags,
+                                       flags_theta=flags_theta, lambdas=lambdas, stim_duration=stim_duration,
+                                       checkpoint_fork=checkpoint_fork, checkpoint_file=checkpoint_file)
 
-            idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
-            # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
-            av_threshold = r_phase1[1][idx_av_threshold]
+        for i_hour, hour_sim in enumerate(hour_sims):
+            name = 'Case' + id + '_' + str(hour_sim) + 'h' # + '_k' + str(K).replace(".","") + '_td' + str(g_top_down_to_S)
 
-            if save_results:
-                l_results = [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates,
-                             l_res_weights, av_threshold, stim_times, stim_duration, sim_duration]
+            if run_simulation:
+                # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially
+                sim_duration = int(((hour_sim) * 60 * 60 + (stim_duration + 10) * 2 + 2)*(1/delta_t))
+                n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1  # total no the rest
+                l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2)
+                stim_times = get_stim_times(hour_sim, stim_duration)
+                l_res_rates, l_res_weights = l_probes[i_hour]
 
-                # Open a file and save
-                with open(dir_data + name + '.pkl', 'wb') as file:
-                    # A new file will be created
-                    pickle.dump(l_results, file)
-                print('Data is saved.')
+                idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
+                # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
+                av_threshold = l_res_rates[0][1][idx_av_threshold]
 
-        else:
-            # Open the file and read
-            with open(dir_data + name + '.pkl', 'rb') as file:
-                l_results = pickle.load(file)
-            print('Data is read.')
+                if save_results:
+                    l_results = [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates,
+                                 l_res_weights, av_threshold, stim_times, stim_duration, sim_duration]
 
-            [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates, l_res_weights,
-             av_threshold, stim_times, stim_duration, sim_duration] = l_results
+                    # Open a file and save
+                    with open(dir_data + name + '.pkl', 'wb') as file:
+                        # A new file will be created
+                        pickle.dump(l_results, file)
+                    print('Data is saved.')
 
-        if plot_results:
-            print('Plotting the results.')
-            plot_all_3_compartmental([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights,
-                                      av_threshold, stim_times,modulation_SST, dir_plot + name, hour_sim, format='.png', scale_y=False)
-            plot_all_3_compartmental([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights,
-                                      av_threshold, stim_times, modulation_SST, dir_plot + name, hour_sim, format='.pdf')
+            else:
+                # Open the file and read
+                with open(dir_data + name + '.pkl', 'rb') as file:
+                    l_results = pickle.load(file)
+                print('Data is read.')
+
+                [l_time_points_stim, l_time_points_phase2, delta_t, sampling_rate, l_res_rates, l_res_weights,
+                 av_threshold, stim_times, stim_duration, sim_duration] = l_results
+
+            if plot_results:
+                from plotting_functions import plot_all_3_compartmental
+                print('Plotting the results.')
+                plot_all_3_compartmental([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights,
+                                          av_threshold, stim_times,modulation_SST, dir_plot + name, hour_sim, format='.png', scale_y=False)
+                plot_all_3_compartmental([l_time_points_stim, l_time_points_phase2], l_res_rates, l_res_weights,
+                                          av_threshold, stim_times, modulation_SST, dir_plot + name, hour_sim, format='.pdf')
 
 
 
 def plot_testing_at_regular_intervals(flags_list, flags_theta=(1,1), dir_data=r'\figures\data\\', dir_plot=r'\figures\\',
                                       K=0.25, flag_only_S_on=False, run_simulation=True,
-                                      save_results = False, plot_results=False,modulation_SST=0):
+                                      save_results = False, plot_results=False,modulation_SST=0, hour_sims=None,
+                                      checkpoint_fork=True, integrator='euler', parareal_options=None):
 
     """
     :param hour_sim: Defines how many hours does the simulation lasts
@@ -574,6 +558,13 @@ def plot_testing_at_regular_intervals(flags_list, flags_theta=(1,1), dir_data=r'
     :param run_simulation: True to run the numerical simulation, False to read the already saved data
     :param save_results: True to save the results
     :param plot_results: True to plot the results
+    :param hour_sims: Times of the tests after conditioning in hours, every hour until 48h by default. Arbitrary times
+    (e.g. sub-hour) are possible
+    :param checkpoint_fork: True to run the simulation with the latest test once and to simulate only the test protocol
+    of every earlier test from a snapshot of it (see run_test_probes()), False to run every test from the beginning
+    :param integrator: 'euler', 'qss' (slow-manifold integration of phase 2) or 'parareal' (phase 2 in time slices on
+    all the cores), see run_test_probes()
+    :param parareal_options: Options of the integrator 'parareal' (e.g. {'n_slices': 16}), see run_test_probes()
 
     Multi-purpose function to analyze the model. Here we run (if run_simulation is True) our computational model to
     investigate the role of cell-type dependent synaptic scaling mechanisms in associative learning. We replicate the
@@ -603,7 +594,8 @@ def plot_testing_at_regular_intervals(flags_list, flags_theta=(1,1), dir_data=r'
     """
     os.makedirs(dir_data, exist_ok=True)
     os.makedirs(dir_plot, exist_ok=True)
-    hour_sims = np.arange(48) + 1
+    if hour_sims is None:
+        hour_sims = np.arange(48) + 1
 
     for flags in flags_list:
         id, title = determine_name(flags)
@@ -616,107 +608,88 @@ def plot_testing_at_regular_intervals(flags_list, flags_theta=(1,1), dir_data=r'
         if run_simulation:
             print('Simulation started.')
             print('\n')
-            for hour_sim in hour_sims:
-                stim_duration = 15 # stimulation duration in seconds
-                # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially
-                sim_duration = int((hour_sim) * 60 * 60 + (stim_duration + 5 + 5) * 2 + 2)
-                delta_t = 0.0001 # time step in seconds (0.1 ms)
-                sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
-                sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
-                sampling_rate = (sampling_rate_stim, sampling_rate_sim)
-
-                # Total number of timepoints for stimulation and simulation
-                n_time_points_stim = int((stim_duration + 10) * (1 / delta_t) * (1 / sampling_rate_stim))
-                n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1 # total no the rest
+            stim_duration = 15 # stimulation duration in seconds
+            delta_t = 0.0001 # time step in seconds (0.1 ms)
+            sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
+            sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
+            sampling_rate = (sampling_rate_stim, sampling_rate_sim)
+
+            # The stimuli are given as inputs to the populations.
+            g_stim_E = np.array([(1, 0), (0, 1)])
+            g_stim_P = np.array([(0.5, 0), (0, 0.5)])
+            if modulation_SST == 0:
+                g_stim_S = np.array([(0, 0), (0, 0)])
+            elif modulation_SST > 0:
+                g_stim_S = np.array([(0.5, 0), (0, 0.5)])
+            elif modulation_SST < 0:
+                g_stim_S = np.array([(-0.5, 0), (0, -0.5)])
+            g_stim = (g_stim_E, g_stim_P, g_stim_S)
+
+            # Time constants
+            tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
+            tau_P = 0.005  # time constant of P population firing rate in seconds(5ms)
+            tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
+            tau_hebb = 240  # time constant of three-factor Hebbian learning in seconds(2min)
+            tau_theta = 24 * (60 * 60)  # time constant of target activity in seconds(24h)
+            tau_beta = 28 * (60 * 60)  # time constant of target activity regulator in seconds(28h)
+            tau_scaling_E = 8 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
+            tau_scaling_P = 8 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
+            tau_scaling_S = 8 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
+            taus = (tau_E, tau_P, tau_S, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
 
-                # l_time_points_stim = np.linspace(0, stim_duration + 10, n_time_points_stim)
-                l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2)
+            # Rheobases (minimum input needed for firing rates to be above zero)
+            rheobase_E, rheobase_P, rheobase_S = 1.5, 1.5, 1.5
+            rheobases = (rheobase_E, rheobase_P, rheobase_S)
 
-                # Timepoints of the onset (first column) and offset (second column) of the first (first row) and second (second) stimuli.
-                stim_times = np.array([[5, 5 + stim_duration],
-                                       [int(hour_sim * 60 * 60) + 5, int(hour_sim * 60 * 60) + 5 + stim_duration]]).reshape(2, 2)
-
-                # The stimuli are given as inputs to the populations.
-                g_stim_E = np.array([(1, 0), (0, 1)])
-                g_stim_P = np.array([(0.5, 0), (0, 0.5)])
-                if modulation_SST == 0:
-                    g_stim_S = np.array([(0, 0), (0, 0)])
-                elif modulation_SST > 0:
-                    g_stim_S = np.array([(0.5, 0), (0, 0.5)])
-                elif modulation_SST < 0:
-                    g_stim_S = np.array([(-0.5, 0), (0, -0.5)])
-                g_stim = (g_stim_E, g_stim_P, g_stim_S)
-
-                # Time constants
-                tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
-                tau_P = 0.005  # time constant of P population firing rate in seconds(5ms)
-                tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
-                tau_hebb = 240  # time constant of three-factor Hebbian learning in seconds(2min)
-                tau_theta = 24 * (60 * 60)  # time constant of target activity in seconds(24h)
-                tau_beta = 28 * (60 * 60)  # time constant of target activity regulator in seconds(28h)
-                tau_scaling_E = 8 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
-                tau_scaling_P = 8 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
-                tau_scaling_S = 8 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
-                taus = (tau_E, tau_P, tau_S, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
-
-                # Rheobases (minimum input needed for firing rates to be above zero)
-                rheobase_E, rheobase_P, rheobase_S = 1.5, 1.5, 1.5
-                rheobases = (rheobase_E, rheobase_P, rheobase_S)
-
-                # Background inputs
-                g_E = 4.5
-                g_P = 3.2
-                g_S = 3
-                back_inputs = (g_E, g_P, g_S)
-
-                # Initial conditions for plastic weights
-                # w_EP_within = 0.81; w_EP_cross = 0.41
-                # w_ES_within = 0.81; w_ES_cross = 0.31
-                # w_EE_within = 0.71; w_EE_cross = 0.41
-                w_EP_within = 0.91; w_EP_cross = 0.41
-                w_ES_within = 0.51; w_ES_cross = 0.31
-                w_EE_within = 0.51; w_EE_cross = 0.51
-
-                # # Initial conditions for plastic weights
-                # w_EP_within = 0.7; w_EP_cross = w_EP_within*0.3
-                # w_ES_within = 0.7; w_ES_cross = w_ES_within*0.3
-                # w_EE_within = 0.5; w_EE_cross = 0.4
-
-                # Weights
-                w_PE_within = 0.3; w_PE_cross = 0.1
-                w_PP_within = 0.2; w_PP_cross = 0.1
-                w_PS_within = 0.3; w_PS_cross = 0.1
-                w_SE_within = 0.4; w_SE_cross = 0.1
-
-                weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
-                           w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
-
-                # Arrays created to hold data
-                r_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-                J_EE_phase1 = np.zeros((4, n_time_points_stim), dtype=np.float32) # WEE11,WEE12,WEE21,WEE22
-                r_phase2 = np.zeros((10, n_time_points_phase2), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2,theta1,theta2,beta1,beta2
-                J_phase2 = np.zeros((12, n_time_points_phase2),dtype=np.float32) # WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-                r_phase3 = np.zeros((6, n_time_points_stim), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-                max_E = np.zeros(1, dtype=np.float32)
-
-                # Lists to hold data arrays
-                l_res_rates = (r_phase1, r_phase2, r_phase3, max_E)
-                l_res_weights = (J_EE_phase1, J_phase2)
-
-                model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(30 * (1 / delta_t)), weights,
-                      back_inputs, g_stim, stim_times, taus, K, rheobases, flags=(0,0,0,0,0,0), flags_theta=flags_theta)
+            # Background inputs
+            g_E = 4.5
+            g_P = 3.2
+            g_S = 3
+            back_inputs = (g_E, g_P, g_S)
 
-                idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
-                # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
-                av_threshold = r_phase1[1][idx_av_threshold]
+            # Initial conditions for plastic weights
+            # w_EP_within = 0.81; w_EP_cross = 0.41
+            # w_ES_within = 0.81; w_ES_cross = 0.31
+            # w_EE_within = 0.71; w_EE_cross = 0.41
+            w_EP_within = 0.91; w_EP_cross = 0.41
+            w_ES_within = 0.51; w_ES_cross = 0.31
+            w_EE_within = 0.51; w_EE_cross = 0.51
+
+            # # Initial conditions for plastic weights
+            # w_EP_within = 0.7; w_EP_cross = w_EP_within*0.3
+            # w_ES_within = 0.7; w_ES_cross = w_ES_within*0.3
+            # w_EE_within = 0.5; w_EE_cross = 0.4
+
+            # Weights
+            w_PE_within = 0.3; w_PE_cross = 0.1
+            w_PP_within = 0.2; w_PP_cross = 0.1
+            w_PS_within = 0.3; w_PS_cross = 0.1
+            w_SE_within = 0.4; w_SE_cross = 0.1
+
+            weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
+                       w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
 
-                model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(sim_duration * (1 / delta_t)), weights,
-                      back_inputs, g_stim, stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta)
+            # The aversion threshold doesn't depend on the time of the test
+            # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
+            av_threshold = aversion_threshold(hour_sims[-1], delta_t, sampling_rate, weights, back_inputs, g_stim,
+                                              taus, K, rheobases, flags_theta=flags_theta, stim_duration=stim_duration,
+                                              cache_dir=dir_data + 'threshold_cache')
+
+            l_probes = run_test_probes(hour_sims, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K,
+                                       rheobases, flags, flags_theta=flags_theta, stim_duration=stim_duration,
+                                       checkpoint_fork=checkpoint_fork, integrator=integrator,
+                                       parareal_options=parareal_options,
+                                       reductions=[('max', ST_E1, (0, stim_duration), sampling_rate_stim)])
 
-                l_delta_rE1.append(np.max(r_phase3[0][int(stim_times[0][0] * (1 / (delta_t * sampling_rate_stim))):
-                                               int(stim_times[0][1] * (1 / (delta_t * sampling_rate_stim)))]).copy())
+            for hour_sim, (l_res_rates, l_res_weights, delta_rE1) in zip(hour_sims, l_probes):
+                (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+                # The response of E1 to the test, in the precision of the data arrays
+                l_delta_rE1.append(np.float32(delta_rE1[0]))
 
                 print('Simulation of ' + str(hour_sim) + ' hours is completed')
+
+            # The data of the last test is saved
+            l_time_points_phase2 = np.linspace(0, hour_sims[-1], r_phase2.shape[1])
             if save_results:
                 l_results = [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights] #added weights for analysis with Kris
 
@@ -735,6 +708,7 @@ def plot_testing_at_regular_intervals(flags_list, flags_theta=(1,1), dir_data=r'
             [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights] = l_results
 
         if plot_results:
+            from plotting_functions import change_in_reactivation_every_h_vslides
             print('Plotting the results.')
             change_in_reactivation_every_h_vslides(l_time_points_phase2, hour_sims, l_delta_rE1, av_threshold,
                                            dir_plot + name, flag_only_S_on=flag_only_S_on, format='.png')
@@ -745,7 +719,8 @@ def plot_testing_at_regular_intervals(flags_list, flags_theta=(1,1), dir_data=r'
 #this function is a generalized version of the one above. this one, with the right flags, is the only one necessary. For clarity, they are separated
 def plot_testing_at_regular_intervals_timescales(flags_list, flags_theta=(1,1), dir_data=r'\figures\data\\', dir_plot=r'\figures\\',
                                       K=0.25, flag_only_S_on=False, run_simulation=True,
-                                      save_results = False, plot_results=False,modulation_SST=0):
+                                      save_results = False, plot_results=False,modulation_SST=0, hour_sims=None,
+                                      checkpoint_fork=True, integrator='euler', parareal_options=None):
 
     """
     :param hour_sim: Defines how many hours does the simulation lasts
@@ -759,6 +734,13 @@ def plot_testing_at_regular_intervals_timescales(flags_list, flags_theta=(1,1),
     :param run_simulation: True to run the numerical simulation, False to read the already saved data
     :param save_results: True to save the results
     :param plot_results: True to plot the results
+    :param hour_sims: Times of the tests after conditioning in hours, every hour until 48h by default. Arbitrary times
+    (e.g. sub-hour) are possible
+    :param checkpoint_fork: True to run the simulation with the latest test once and to simulate only the test protocol
+    of every earlier test from a snapshot of it (see run_test_probes()), False to run every test from the beginning
+    :param integrator: 'euler', 'qss' (slow-manifold integration of phase 2) or 'parareal' (phase 2 in time slices on
+    all the cores), see run_test_probes()
+    :param parareal_options: Options of the integrator 'parareal' (e.g. {'n_slices': 16}), see run_test_probes()
 
     Multi-purpose function to analyze the model. Here we run (if run_simulation is True) our computational model to
     investigate the role of cell-type dependent synaptic scaling mechanisms in associative learning. We replicate the
@@ -788,7 +770,8 @@ def plot_testing_at_regular_intervals_timescales(flags_list, flags_theta=(1,1),
     """
     os.makedirs(dir_data, exist_ok=True)
     os.makedirs(dir_plot, exist_ok=True)
-    hour_sims = np.arange(48) + 1
+    if hour_sims is None:
+        hour_sims = np.arange(48) + 1
     tau_theta_list = (np.arange(22, 31,2) * 3600).tolist()
     # tau_beta_list = (np.arange(16, 37) * 3600).tolist()
     tau_beta_list  = [30*3600]
@@ -813,105 +796,87 @@ def plot_testing_at_regular_intervals_timescales(flags_list, flags_theta=(1,1),
                 if run_simulation:
                     print('Simulation started.')
                     print('\n')
-                    for hour_sim in hour_sims:
-                        stim_duration = 15 # stimulation duration in seconds
-                        # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially
-                        sim_duration = int((hour_sim) * 60 * 60 + (stim_duration + 5 + 5) * 2 + 2)
-                        delta_t = 0.0001 # time step in seconds (0.1 ms)
-                        sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
-                        sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
-                        sampling_rate = (sampling_rate_stim, sampling_rate_sim)
-
-                        # Total number of timepoints for stimulation and simulation
-                        n_time_points_stim = int((stim_duration + 10) * (1 / delta_t) * (1 / sampling_rate_stim))
-                        n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1 # total no the rest
-
-                        # l_time_points_stim = np.linspace(0, stim_duration + 10, n_time_points_stim)
-                        l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2)
-
-                        # Timepoints of the onset (first column) and offset (second column) of the first (first row) and second (second) stimuli.
-                        stim_times = np.array([[5, 5 + stim_duration],
-                                            [int(hour_sim * 60 * 60) + 5, int(hour_sim * 60 * 60) + 5 + stim_duration]]).reshape(2, 2)
-
-                        # The stimuli are given as inputs to the populations.
-                        g_stim_E = np.array([(1, 0), (0, 1)])
-                        g_stim_P = np.array([(0.5, 0), (0, 0.5)])
-                        if modulation_SST == 0:
-                            g_stim_S = np.array([(0, 0), (0, 0)])
-                        elif modulation_SST > 0:
-                            g_stim_S = np.array([(0.5, 0), (0, 0.5)])
-                        elif modulation_SST < 0:
-                            g_stim_S = np.array([(-0.5, 0), (0, -0.5)])
-                        g_stim = (g_stim_E, g_stim_P, g_stim_S)
-
-                        # Time constants
-                        tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
-                        tau_P = 0.005  # time constant of P population firing rate in seconds(5ms)
-                        tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
-                        tau_hebb = 240  # time constant of three-factor Hebbian learning in seconds(2min)
-                        tau_scaling_E = 8 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
-                        tau_scaling_P = 8 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
-                        tau_scaling_S = 8 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
-                        taus = (tau_E, tau_P, tau_S, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
-
-                        # Rheobases (minimum input needed for firing rates to be above zero)
-                        rheobase_E, rheobase_P, rheobase_S = 1.5, 1.5, 1.5
-                        rheobases = (rheobase_E, rheobase_P, rheobase_S)
-
-                        # Background inputs
-                        g_E = 4.5
-                        g_P = 3.2
-                        g_S = 3
-                        back_inputs = (g_E, g_P, g_S)
-
-                        # Initial conditions for plastic weights
-                        # w_EP_within = 0.81; w_EP_cross = 0.41
-                        # w_ES_within = 0.81; w_ES_cross = 0.31
-                        # w_EE_within = 0.71; w_EE_cross = 0.41
-                        w_EP_within = 0.91; w_EP_cross = 0.41
-                        w_ES_within = 0.51; w_ES_cross = 0.31
-                        w_EE_within = 0.51; w_EE_cross = 0.51
-
-                        # # Initial conditions for plastic weights
-                        # w_EP_within = 0.7; w_EP_cross = w_EP_within*0.3
-                        # w_ES_within = 0.7; w_ES_cross = w_ES_within*0.3
-                        # w_EE_within = 0.5; w_EE_cross = 0.4
-
-                        # Weights
-                        w_PE_within = 0.3; w_PE_cross = 0.1
-                        w_PP_within = 0.2; w_PP_cross = 0.1
-                        w_PS_within = 0.3; w_PS_cross = 0.1
-                        w_SE_within = 0.4; w_SE_cross = 0.1
-
-                        weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
-                                w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
-
-                        # Arrays created to hold data
-                        r_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-                        J_EE_phase1 = np.zeros((4, n_time_points_stim), dtype=np.float32) # WEE11,WEE12,WEE21,WEE22
-                        r_phase2 = np.zeros((10, n_time_points_phase2), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2,theta1,theta2,beta1,beta2
-                        J_phase2 = np.zeros((12, n_time_points_phase2),dtype=np.float32) # WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-                        r_phase3 = np.zeros((6, n_time_points_stim), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-                        max_E = np.zeros(1, dtype=np.float32)
-
-                        # Lists to hold data arrays
-                        l_res_rates = (r_phase1, r_phase2, r_phase3, max_E)
-                        l_res_weights = (J_EE_phase1, J_phase2)
-
-                        model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(30 * (1 / delta_t)), weights,
-                            back_inputs, g_stim, stim_times, taus, K, rheobases, flags=(0,0,0,0,0,0), flags_theta=flags_theta)
-
-                        idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
-                        # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
-                        av_threshold = r_phase1[1][idx_av_threshold]
-
-                        model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(sim_duration * (1 / delta_t)), weights,
-                            back_inputs, g_stim, stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta)
-
-                        l_delta_rE1.append(np.max(r_phase3[0][int(stim_times[0][0] * (1 / (delta_t * sampling_rate_stim))):
-                                                    int(stim_times[0][1] * (1 / (delta_t * sampling_rate_stim)))]).copy())
+                    stim_duration = 15 # stimulation duration in seconds
+                    delta_t = 0.0001 # time step in seconds (0.1 ms)
+                    sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
+                    sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
+                    sampling_rate = (sampling_rate_stim, sampling_rate_sim)
+
+                    # The stimuli are given as inputs to the populations.
+                    g_stim_E = np.array([(1, 0), (0, 1)])
+                    g_stim_P = np.array([(0.5, 0), (0, 0.5)])
+                    if modulation_SST == 0:
+                        g_stim_S = np.array([(0, 0), (0, 0)])
+                    elif modulation_SST > 0:
+                        g_stim_S = np.array([(0.5, 0), (0, 0.5)])
+                    elif modulation_SST < 0:
+                        g_stim_S = np.array([(-0.5, 0), (0, -0.5)])
+                    g_stim = (g_stim_E, g_stim_P, g_stim_S)
+
+                    # Time constants
+                    tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
+                    tau_P = 0.005  # time constant of P population firing rate in seconds(5ms)
+                    tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
+                    tau_hebb = 240  # time constant of three-factor Hebbian learning in seconds(2min)
+                    tau_scaling_E = 8 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
+                    tau_scaling_P = 8 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
+                    tau_scaling_S = 8 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
+                    taus = (tau_E, tau_P, tau_S, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
+
+                    # Rheobases (minimum input needed for firing rates to be above zero)
+                    rheobase_E, rheobase_P, rheobase_S = 1.5, 1.5, 1.5
+                    rheobases = (rheobase_E, rheobase_P, rheobase_S)
+
+                    # Background inputs
+                    g_E = 4.5
+                    g_P = 3.2
+                    g_S = 3
+                    back_inputs = (g_E, g_P, g_S)
+
+                    # Initial conditions for plastic weights
+                    # w_EP_within = 0.81; w_EP_cross = 0.41
+                    # w_ES_within = 0.81; w_ES_cross = 0.31
+                    # w_EE_within = 0.71; w_EE_cross = 0.41
+                    w_EP_within = 0.91; w_EP_cross = 0.41
+                    w_ES_within = 0.51; w_ES_cross = 0.31
+                    w_EE_within = 0.51; w_EE_cross = 0.51
+
+                    # # Initial conditions for plastic weights
+                    # w_EP_within = 0.7; w_EP_cross = w_EP_within*0.3
+                    # w_ES_within = 0.7; w_ES_cross = w_ES_within*0.3
+                    # w_EE_within = 0.5; w_EE_cross = 0.4
+
+                    # Weights
+                    w_PE_within = 0.3; w_PE_cross = 0.1
+                    w_PP_within = 0.2; w_PP_cross = 0.1
+                    w_PS_within = 0.3; w_PS_cross = 0.1
+                    w_SE_within = 0.4; w_SE_cross = 0.1
+
+                    weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
+                               w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
+
+                    # The aversion threshold doesn't depend on the time of the test
+                    # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
+                    av_threshold = aversion_threshold(hour_sims[-1], delta_t, sampling_rate, weights, back_inputs,
+                                                      g_stim, taus, K, rheobases, flags_theta=flags_theta,
+                                                      stim_duration=stim_duration,
+                                                      cache_dir=dir_data + 'threshold_cache')
+
+                    l_probes = run_test_probes(hour_sims, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K,
+                                               rheobases, flags, flags_theta=flags_theta, stim_duration=stim_duration,
+                                               checkpoint_fork=checkpoint_fork, integrator=integrator,
+                                               parareal_options=parareal_options,
+                                               reductions=[('max', ST_E1, (0, stim_duration), sampling_rate_stim)])
+
+                    for hour_sim, (l_res_rates, l_res_weights, delta_rE1) in zip(hour_sims, l_probes):
+                        (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+                        # The response of E1 to the test, in the precision of the data arrays
+                        l_delta_rE1.append(np.float32(delta_rE1[0]))
 
                         print('Simulation of ' + str(hour_sim) + ' hours is completed')
+
+                    # The data of the last test is saved
+                    l_time_points_phase2 = np.linspace(0, hour_sims[-1], r_phase2.shape[1])
                     if save_results:
                         l_results = [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights] #added weights for analysis with Kris
 
@@ -930,6 +895,7 @@ def plot_testing_at_regular_intervals_timescales(flags_list, flags_theta=(1,1),
                     [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights] = l_results
 
                 if plot_results:
+                    from plotting_functions import change_in_reactivation_every_h_vslides
                     print('Plotting the results.')
                      
                     os.makedirs(dir_plot + 'theta_' + str(int(tau_theta/3600)).replace(".","") + '_beta_' + str(int(tau_beta/3600)).replace(".","") + "/", exist_ok=True)
@@ -941,7 +907,8 @@ def plot_testing_at_regular_intervals_timescales(flags_list, flags_theta=(1,1),
 
 
 def plot_testing_at_regular_intervals_dendrites_v3(flags_list, flags_theta=(1,1), dir_data=r'\figures\data\\', dir_plot=r'\figures\\', flag_only_S_on=False, modulation_SST=0, run_simulation=True,
-                                      save_results = False, plot_results=False):
+                                      save_results = False, plot_results=False, hour_sims=None, checkpoint_fork=True,
+                                      integrator='euler'):
 
     """
     :param hour_sim: Defines how many hours does the simulation lasts
@@ -955,6 +922,12 @@ def plot_testing_at_regular_intervals_dendrites_v3(flags_list, flags_theta=(1,1)
     :param run_simulation: True to run the numerical simulation, False to read the already saved data
     :param save_results: True to save the results
     :param plot_results: True to plot the results
+    :param hour_sims: Times of the tests after conditioning in hours, every hour until 48h by default. Arbitrary times
+    (e.g. sub-hour) are possible
+    :param checkpoint_fork: True to run the simulation with the latest test once and to simulate only the test protocol
+    of every earlier test from a snapshot of it (see run_test_probes()), False to run every test from the beginning
+    :param integrator: 'euler' or 'rk' (adaptive Runge-Kutta), the only integrators of model_3_compartmental_v3(), see
+    run_test_probes()
 
     Multi-purpose function to analyze the model. Here we run (if run_simulation is True) our computational model to
     investigate the role of cell-type dependent synaptic scaling mechanisms in associative learning. We replicate the
@@ -984,7 +957,8 @@ def plot_testing_at_regular_intervals_dendrites_v3(flags_list, flags_theta=(1,1)
     """
     os.makedirs(dir_data, exist_ok=True)
     os.makedirs(dir_plot, exist_ok=True)
-    hour_sims = np.arange(48) + 1
+    if hour_sims is None:
+        hour_sims = np.arange(48) + 1
     # hour_sims = np.array([1, 4, 24, 48], dtype=int)
     # K parameter in target regulator equation, it tunes the steady state value of target activity and its regulator
     K = 0.25
@@ -1000,112 +974,90 @@ def plot_testing_at_regular_intervals_dendrites_v3(flags_list, flags_theta=(1,1)
         if run_simulation:
             print('Simulation started.')
             print('\n')
-            for hour_sim in hour_sims:
-                stim_duration = 15 # stimulation duration in seconds
-                # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially
-                sim_duration = int((hour_sim) * 60 * 60 + (stim_duration + 5 + 5) * 2 + 2)
-                delta_t = 0.0001 # time step in seconds (0.1 ms)
-                sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
-                sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
-                sampling_rate = (sampling_rate_stim, sampling_rate_sim)
-
-                # Total number of timepoints for stimulation and simulation
-                n_time_points_stim = int((stim_duration + 10) * (1 / delta_t) * (1 / sampling_rate_stim))
-                n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1 # total no the rest
+            stim_duration = 15 # stimulation duration in seconds
+            delta_t = 0.0001 # time step in seconds (0.1 ms)
+            sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
+            sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
+            sampling_rate = (sampling_rate_stim, sampling_rate_sim)
+
+            # The stimuli are given as inputs to the populations.
+            g_stim_E = np.array([(2.5, 0), (0, 2.5)])
+            g_stim_P = np.array([(0.5, 0), (0, 0.5)])
+            if modulation_SST == 0:
+                g_stim_S = np.array([(0, 0), (0, 0)])
+            elif modulation_SST > 0:
+                g_stim_S = np.array([(1.25, 0), (0, 1.25)])
+            elif modulation_SST < 0:
+                g_stim_S = np.array([(-1.25, 0), (0, -1.25)])
+            g_stim = (g_stim_E, g_stim_P, g_stim_S)
+
+            # Time constants
+            tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
+            tau_P = 0.005  # time constant of P population firing rate in seconds(5ms)
+            tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
+            tau_dend = tau_E
+            tau_hebb = 120  # time constant of three-factor Hebbian learning in seconds(2min)
+            tau_theta = 24 * (60 * 60)  # time constant of target activity in seconds(24h)
+            tau_beta = 28 * (60 * 60)  # time constant of target activity regulator in seconds(28h)
+            tau_scaling_E = 2.5 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
+            tau_scaling_P = 6.5 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
+            tau_scaling_S = 2.5 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
+            taus = (tau_E, tau_P, tau_S, tau_dend, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
+
+            # Rheobases (minimum input needed for firing rates to be above zero)
+            rheobase_E, rheobase_P, rheobase_S, rheobase_A,rheobase_B  = 1, 1.5, 1.5, 3, 9
+            rheobases = (rheobase_E, rheobase_P, rheobase_S, rheobase_A,rheobase_B)
+
+            # Background inputs
+            g_AD = 4
+            g_BD = 6
+            g_E = 0
+            g_P = 4
+            g_S = 3.2
+            back_inputs = (g_AD, g_BD, g_E, g_P, g_S)
+
+            # Constant that define the contribution of each current
+            lambda_AD = 0.4 # in stronger lambda config it is 0.5
+            lambda_BD = 0.3 # in stronger lambda config it is 0.3
+            lambdas = (lambda_AD, lambda_BD)
 
-                # l_time_points_stim = np.linspace(0, stim_duration + 10, n_time_points_stim)
-                l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2)
+            # Initial conditions for plastic weights
+            w_EP_within = 0.6; w_EP_cross = 0.18
+            w_DS_within = 0.4; w_DS_cross = 0.18
+            w_DE_within = 0.5; w_DE_cross = 0.3
+            w_EE_within = 0.5; w_EE_cross = 0.3
 
-                # Timepoints of the onset (first column) and offset (second column) of the first (first row) and second (second) stimuli.
-                stim_times = np.array([[5, 5 + stim_duration],
-                                       [int(hour_sim * 60 * 60) + 5, int(hour_sim * 60 * 60) + 5 + stim_duration]]).reshape(2, 2)
-
-                # The stimuli are given as inputs to the populations.
-                g_stim_E = np.array([(2.5, 0), (0, 2.5)])
-                g_stim_P = np.array([(0.5, 0), (0, 0.5)])
-                if modulation_SST == 0:
-                    g_stim_S = np.array([(0, 0), (0, 0)])
-                elif modulation_SST > 0:
-                    g_stim_S = np.array([(1.25, 0), (0, 1.25)])
-                elif modulation_SST < 0:
-                    g_stim_S = np.array([(-1.25, 0), (0, -1.25)])
-                g_stim = (g_stim_E, g_stim_P, g_stim_S)
-
-                # Time constants
-                tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
-                tau_P = 0.005  # time constant of P population firing rate in seconds(5ms)
-                tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
-                tau_dend = tau_E
-                tau_hebb = 120  # time constant of three-factor Hebbian learning in seconds(2min)
-                tau_theta = 24 * (60 * 60)  # time constant of target activity in seconds(24h)
-                tau_beta = 28 * (60 * 60)  # time constant of target activity regulator in seconds(28h)
-                tau_scaling_E = 2.5 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
-                tau_scaling_P = 6.5 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
-                tau_scaling_S = 2.5 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
-                taus = (tau_E, tau_P, tau_S, tau_dend, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
-
-                # Rheobases (minimum input needed for firing rates to be above zero)
-                rheobase_E, rheobase_P, rheobase_S, rheobase_A,rheobase_B  = 1, 1.5, 1.5, 3, 9
-                rheobases = (rheobase_E, rheobase_P, rheobase_S, rheobase_A,rheobase_B)
-
-                # Background inputs
-                g_AD = 4
-                g_BD = 6
-                g_E = 0
-                g_P = 4
-                g_S = 3.2
-                back_inputs = (g_AD, g_BD, g_E, g_P, g_S)
-
-                # Constant that define the contribution of each current
-                lambda_AD = 0.4 # in stronger lambda config it is 0.5
-                lambda_BD = 0.3 # in stronger lambda config it is 0.3
-                lambdas = (lambda_AD, lambda_BD)
-
-                # Initial conditions for plastic weights
-                w_EP_within = 0.6; w_EP_cross = 0.18
-                w_DS_within = 0.4; w_DS_cross = 0.18
-                w_DE_within = 0.5; w_DE_cross = 0.3
-                w_EE_within = 0.5; w_EE_cross = 0.3
-
-                # Weights
-                w_PE_within = 0.35; w_PE_cross = 0.10
-                w_PP_within = 0.20; w_PP_cross = 0.10
-                w_PS_within = 0.30; w_PS_cross = 0.10
-                w_SE_within = 0.15; w_SE_cross = 0.10
-
-                weights = (w_DE_within, w_EE_within, w_EP_within, w_DS_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
-                        w_DE_cross,  w_EE_cross,  w_EP_cross,  w_DS_cross,  w_PE_cross,  w_PP_cross,  w_PS_cross,  w_SE_cross)
-
-                # Arrays created to hold data
-                r_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-                I_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # IAD1, IAD2, IBD1, IBD2, IE1, IE2
-                J_exc_phase1 = np.zeros((8, n_time_points_stim), dtype=np.float32)  # WDE11,WDE12,WDE21,WDE22,WEE11,WEE12,WEE21,WEE22
-                r_phase2 = np.zeros((6, n_time_points_phase2), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-                set_phase2 = np.zeros((12, n_time_points_phase2), dtype=np.float32) # thetaDD1,thetaDD2,thetaBD1,thetaBD2,thetaE1,thetaE2,betaAD1,betaAD2,betaBD1,betaBD2,betaE1,betaE2
-                I_phase2 = np.zeros((6, n_time_points_phase2), dtype=np.float32) # IAD1, IAD2, IBD1, IBD2, IE1, IE2
-                J_phase2 = np.zeros((20, n_time_points_phase2),
-                                    dtype=np.float32)  # WDE11,WDE12,WDE21,WDE22,WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-                r_phase3 = np.zeros((6, n_time_points_stim), dtype=np.float32)  # rE1,rE2,rP1,rP2,rS1,rS2
-                max_E = np.zeros(1, dtype=np.float32)
-
-                # Lists to hold data arrays
-                l_res_rates = (r_phase1, I_phase1, r_phase2, I_phase2, set_phase2, r_phase3, max_E)
-                l_res_weights = (J_exc_phase1, J_phase2)
-
-                model_3_compartmental_v3(delta_t, sampling_rate, l_res_rates, l_res_weights, int(30 * (1 / delta_t)), weights, back_inputs, g_stim,
-                        stim_times, taus, K, rheobases, lambdas, flags=(0,0,0,0,0,0),flags_theta=flags_theta)
+            # Weights
+            w_PE_within = 0.35; w_PE_cross = 0.10
+            w_PP_within = 0.20; w_PP_cross = 0.10
+            w_PS_within = 0.30; w_PS_cross = 0.10
+            w_SE_within = 0.15; w_SE_cross = 0.10
 
-                idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
-                # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
-                av_threshold = r_phase1[1][idx_av_threshold]
+            weights = (w_DE_within, w_EE_within, w_EP_within, w_DS_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
+                    w_DE_cross,  w_EE_cross,  w_EP_cross,  w_DS_cross,  w_PE_cross,  w_PP_cross,  w_PS_cross,  w_SE_cross)
 
-                model_3_compartmental_v3(delta_t, sampling_rate, l_res_rates, l_res_weights, int(sim_duration * (1 / delta_t)), weights, back_inputs, g_stim,
-                                  stim_times, taus, K, rheobases, lambdas, flags=flags,flags_theta=flags_theta)
-                # print(r_phase3)
-                l_delta_rE1.append(np.max(r_phase3[0][int(stim_times[0][0] * (1 / (delta_t * sampling_rate_stim))):
-                                               int(stim_times[0][1] * (1 / (delta_t * sampling_rate_stim)))]).copy())
+            # The aversion threshold doesn't depend on the time of the test
+            # av_threshold = r_phase1[1][idx_av_threshold] * 1.15 #it is defined with an extra 15% for old reason. not required anymore
+            av_threshold = aversion_threshold(hour_sims[-1], delta_t, sampling_rate, weights, back_inputs, g_stim,
+                                              taus, K, rheobases, flags_theta=flags_theta, lambdas=lambdas,
+                                              stim_duration=stim_duration,
+                                              cache_dir=dir_data + 'threshold_cache')
+
+            l_probes = run_test_probes(hour_sims, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K,
+                                       rheobases, flags, flags_theta=flags_theta, lambdas=lambdas,
+                                       stim_duration=stim_duration, checkpoint_fork=checkpoint_fork,
+                                       integrator=integrator,
+                                       reductions=[('max', ST3_E1, (0, stim_duration), sampling_rate_stim)])
+
+            for hour_sim, (l_res_rates, l_res_weights, delta_rE1) in zip(hour_sims, l_probes):
+                (r_phase1, I_phase1, r_phase2, I_phase2, set_phase2, r_phase3, max_E) = l_res_rates
+                # The response of E1 to the test, in the precision of the data arrays
+                l_delta_rE1.append(np.float32(delta_rE1[0]))
 
                 print('Simulation of ' + str(hour_sim) + ' hours is completed')
+
+            # The data of the last test is saved
+            l_time_points_phase2 = np.linspace(0, hour_sims[-1], r_phase2.shape[1])
             if save_results:
                 l_results = [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights] #added weights for analysis with Kris
 
@@ -1124,6 +1076,7 @@ def plot_testing_at_regular_intervals_dendrites_v3(flags_list, flags_theta=(1,1)
             [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights] = l_results
 
         if plot_results:
+            from plotting_functions import change_in_reactivation_every_h_vslides
             print('Plotting the results.')
             change_in_reactivation_every_h_vslides(l_time_points_phase2, hour_sims, l_delta_rE1, av_threshold,
                                            dir_plot + name, flag_only_S_on=flag_only_S_on, format='.png')
@@ -1133,7 +1086,8 @@ def plot_testing_at_regular_intervals_dendrites_v3(flags_list, flags_theta=(1,1)
 
 def plot_testing_at_regular_intervals_weights(ww_weights,flags_list, plastic_flag, flags_theta=(1,1), dir_data=r'\figures\data\\', dir_plot=r'\figures\\',
                                       K=0.25, flag_only_S_on=False, run_simulation=True,
-                                      save_results = False, plot_results=False,modulation_SST=0):
+                                      save_results = False, plot_results=False,modulation_SST=0, hour_sims=None,
+                                      checkpoint_fork=True):
 
     """
     :param hour_sim: Defines how many hours does the simulation lasts
@@ -1147,6 +1101,10 @@ def plot_testing_at_regular_intervals_weights(ww_weights,flags_list, plastic_fla
     :param run_simulation: True to run the numerical simulation, False to read the already saved data
     :param save_results: True to save the results
     :param plot_results: True to plot the results
+    :param hour_sims: Times of the tests after conditioning in hours, every hour until 48h by default. Arbitrary times
+    (e.g. sub-hour) are possible
+    :param checkpoint_fork: True to run the simulation with the latest test once and to simulate only the test protocol
+    of every earlier test from a snapshot of it (see run_test_probes()), False to run every test from the beginning
 
     Multi-purpose function to analyze the model. Here we run (if run_simulation is True) our computational model to
     investigate the role of cell-type dependent synaptic scaling mechanisms in associative learning. We replicate the
@@ -1175,7 +1133,8 @@ def plot_testing_at_regular_intervals_weights(ww_weights,flags_list, plastic_fla
     specificity of an associative memory. Current biology, 31(11), 2274-2285.
     """
 
-    hour_sims = np.arange(48) + 1
+    if hour_sims is None:
+        hour_sims = np.arange(48) + 1
     os.makedirs(dir_data, exist_ok=True)
     os.makedirs(dir_plot, exist_ok=True)
     # print('Simulation started.')
@@ -1190,121 +1149,43 @@ def plot_testing_at_regular_intervals_weights(ww_weights,flags_list, plastic_fla
         if run_simulation:
             # print('Simulation started.')
             # print('\n')
-            for hour_sim in hour_sims:
-                stim_duration = 15 # stimulation duration in seconds
-                # Simulation duration in seconds, 5 extra seconds for pre- and post-stimulation each, 2 extra seconds to reach steady state initially
-                sim_duration = int((hour_sim) * 60 * 60 + (stim_duration + 5 + 5) * 2 + 2)
-                delta_t = 0.0001 # time step in seconds (0.1 ms)
-                sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
-                sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
-                sampling_rate = (sampling_rate_stim, sampling_rate_sim)
-
-                # Total number of timepoints for stimulation and simulation
-                n_time_points_stim = int((stim_duration + 10) * (1 / delta_t) * (1 / sampling_rate_stim))
-                n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1 # total no the rest
-
-                # l_time_points_stim = np.linspace(0, stim_duration + 10, n_time_points_stim)
-                l_time_points_phase2 = np.linspace(0, hour_sim, n_time_points_phase2)
+            stim_duration = 15 # stimulation duration in seconds
+            delta_t = 0.0001 # time step in seconds (0.1 ms)
+            sampling_rate_stim = 20 # register data at every 20 step during phase 1 and 3 (conditioning and testing)
+            sampling_rate_sim = 200000 # register data at every 2e5 time step (20 seconds) during phase 2 (in between conditioning and testing)
+            sampling_rate = (sampling_rate_stim, sampling_rate_sim)
+
+            # The stimuli, time constants, rheobases and background inputs, and the weights not swept
+            back_inputs, g_stim, taus, rheobases = sweep_inputs(modulation_SST)
+            weights = sweep_weights(ww_weights, plastic_flag)
+
+            # The aversion threshold doesn't depend on the time of the test
+            av_threshold = aversion_threshold(hour_sims[-1], delta_t, sampling_rate, weights, back_inputs, g_stim,
+                                              taus, K, rheobases, flags_theta=flags_theta,
+                                              stim_duration=stim_duration, fill_value=np.nan,
+                                              cache_dir=dir_data + 'threshold_cache') * 1.15
+
+            l_probes = run_test_probes(hour_sims, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K,
+                                       rheobases, flags, flags_theta=flags_theta, stim_duration=stim_duration,
+                                       fill_value=np.nan, checkpoint_fork=checkpoint_fork,
+                                       reductions=[('max', ST_E1, (0, stim_duration), sampling_rate_stim)],
+                                       status=True)
+
+            for hour_sim, (l_res_rates, l_res_weights, delta_rE1, status) in zip(hour_sims, l_probes):
+                (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+                # The response of E1 to the test, in the precision of the data arrays
+                l_delta_rE1.append(np.float32(delta_rE1[0]))
 
-                # Timepoints of the onset (first column) and offset (second column) of the first (first row) and second (second) stimuli.
-                stim_times = np.array([[5, 5 + stim_duration],
-                                       [int(hour_sim * 60 * 60) + 5, int(hour_sim * 60 * 60) + 5 + stim_duration]]).reshape(2, 2)
-
-                # The stimuli are given as inputs to the populations.
-                g_stim_E = np.array([(1, 0), (0, 1)])
-                g_stim_P = np.array([(0.5, 0), (0, 0.5)])
-                if modulation_SST == 0:
-                    g_stim_S = np.array([(0, 0), (0, 0)])
-                elif modulation_SST > 0:
-                    g_stim_S = np.array([(0.5, 0), (0, 0.5)])
-                elif modulation_SST < 0:
-                    g_stim_S = np.array([(-0.5, 0), (0, -0.5)])
-                g_stim = (g_stim_E, g_stim_P, g_stim_S)
-
-                # Time constants
-                tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
-                tau_P = 0.005 # time constant of P population firing rate in seconds(5ms)
-                tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
-                tau_hebb = 240 # time constant of three-factor Hebbian learning in seconds(2min)
-                tau_theta = 24 * (60 * 60) # time constant of target activity in seconds(24h)
-                tau_beta = 28 * (60 * 60) # time constant of target activity regulator in seconds(28h)
-                tau_scaling_E = 8 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
-                tau_scaling_P = 8 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
-                tau_scaling_S = 8 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
-                taus = (tau_E, tau_P, tau_S, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
-
-                # Rheobases (minimum input needed for firing rates to be above zero)
-                rheobase_E, rheobase_P, rheobase_S = 1.5, 1.5, 1.5
-                rheobases = (rheobase_E, rheobase_P, rheobase_S)
-
-                # Background inputs
-                g_E = 4.5
-                g_P = 3.2
-                g_S = 3
-                back_inputs = (g_E, g_P, g_S)
-
-                if plastic_flag == True: #I want to modify plastic weights
-                    # Initial conditions for plastic weights
-                    (w_EP_within, w_EP_cross, w_ES_within, w_ES_cross, w_EE_within, w_EE_cross) = ww_weights
-
-                    # Weights
-                    w_PE_within = 0.3; w_PE_cross = 0.1
-                    w_PP_within = 0.2; w_PP_cross = 0.1
-                    # w_PS_within = 0.3; w_PS_cross = 0.1
-                    # w_SE_within = 0.4; w_SE_cross = 0.1
-                    #strong_connection version
-                    w_PS_within = 0.95; w_PS_cross = 0.1
-                    w_SE_within = 0.1; w_SE_cross = 0.1
-
-                    weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
-                            w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
-                else:
-                    # Initial conditions for plastic weights
-                    (w_PE_within,w_PP_within,w_PS_within, w_SE_within) = ww_weights
-
-                    w_PE_cross = 0.1
-                    w_PP_cross = 0.1
-                    w_PS_cross = 0.1
-                    w_SE_cross = 0.1
-
-                    w_EP_within = 0.91; w_EP_cross = 0.41
-                    w_ES_within = 0.51; w_ES_cross = 0.31
-                    w_EE_within = 0.51; w_EE_cross = 0.51
-
-                    weights = (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
-                            w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
-
-                # Arrays created to hold data
-                # r_phase1 = np.zeros((6, n_time_points_stim), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-                # J_EE_phase1 = np.zeros((4, n_time_points_stim), dtype=np.float32) # WEE11,WEE12,WEE21,WEE22
-                # r_phase2 = np.zeros((10, n_time_points_phase2), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2,theta1,theta2,beta1,beta2
-                # J_phase2 = np.zeros((12, n_time_points_phase2),dtype=np.float32) # WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-                # r_phase3 = np.zeros((6, n_time_points_stim), dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-                max_E = np.zeros(1, dtype=np.float32)
-
-                r_phase1 = np.full((6, n_time_points_stim), np.nan, dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-                J_EE_phase1 = np.full((4, n_time_points_stim), np.nan, dtype=np.float32) # WEE11,WEE12,WEE21,WEE22
-                r_phase2 = np.full((10, n_time_points_phase2), np.nan, dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2,theta1,theta2,beta1,beta2
-                J_phase2 = np.full((12, n_time_points_phase2), np.nan, dtype=np.float32) # WEE11,WEE12,WEE21,WEE22,WEP11,WEP12,WEP21,WEP22,WES11,WES12,WES21,WES22
-                r_phase3 = np.full((6, n_time_points_stim), np.nan, dtype=np.float32) # rE1,rE2,rP1,rP2,rS1,rS2
-
-                # Lists to hold data arrays
-                l_res_rates = (r_phase1, r_phase2, r_phase3, max_E)
-                l_res_weights = (J_EE_phase1, J_phase2)
-
-                model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(30 * (1 / delta_t)), weights,
-                      back_inputs, g_stim, stim_times, taus, K, rheobases, flags=(0,0,0,0,0,0), flags_theta=flags_theta)
-
-                idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
-                av_threshold = r_phase1[1][idx_av_threshold] * 1.15
-
-                model(delta_t, sampling_rate, l_res_rates, l_res_weights, int(sim_duration * (1 / delta_t)), weights,
-                      back_inputs, g_stim, stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta)
+                # print('Simulation of ' + str(hour_sim) + ' hours is completed')
 
-                l_delta_rE1.append(np.max(r_phase3[0][int(stim_times[0][0] * (1 / (delta_t * sampling_rate_stim))):
-                                               int(stim_times[0][1] * (1 / (delta_t * sampling_rate_stim)))]).copy())
+            # The data after an explosion (or silence) of the network is np.nan and not plotted
+            completed = status['exit_reason'] == 'step_stop'
+            if not completed:
+                print('The simulation stopped (' + status['exit_reason'] + ') after ' + str(round(status['time'])) +
+                      ' s: ' + name)
 
-                # print('Simulation of ' + str(hour_sim) + ' hours is completed')
+            # The data of the last test is saved
+            l_time_points_phase2 = np.linspace(0, hour_sims[-1], r_phase2.shape[1])
             if save_results:
                 l_results = [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights]
 
@@ -1320,12 +1201,123 @@ def plot_testing_at_regular_intervals_weights(ww_weights,flags_list, plastic_fla
             print('Data is read.')
 
             [r_phase1, l_time_points_phase2, r_phase2, l_delta_rE1, av_threshold, delta_t, sampling_rate_sim,l_res_weights] = l_results
+            completed = True
 
         #it doesn't go through here
-        if plot_results:
+        if plot_results and completed:
+            from plotting_functions import change_in_reactivation_every_h
             print('Plotting the results.')
             change_in_reactivation_every_h(l_time_points_phase2, hour_sims, l_delta_rE1, av_threshold,
                                            dir_plot + name, flag_only_S_on=flag_only_S_on, format='.png')
             change_in_reactivation_every_h(l_time_points_phase2, hour_sims, l_delta_rE1, av_threshold,
                                            dir_plot + name, flag_only_S_on=flag_only_S_on, format='.pdf')
     print("Data for", '_'.join(str(weight).replace(".", "") for weight in ww_weights), "is saved\n")
+
+
+def sweep_weights(ww_weights, plastic_flag):
+    """
+    :param ww_weights: The swept weights of plot_testing_at_regular_intervals_weights(), six plastic or four static ones
+    :return: The 14 weights of model(), the weights not swept at their values in the sweeps
+    """
+    if plastic_flag == True:
+        (w_EP_within, w_EP_cross, w_ES_within, w_ES_cross, w_EE_within, w_EE_cross) = ww_weights
+
+        #strong_connection version
+        w_PE_within = 0.3; w_PE_cross = 0.1
+        w_PP_within = 0.2; w_PP_cross = 0.1
+        w_PS_within = 0.95; w_PS_cross = 0.1
+        w_SE_within = 0.1; w_SE_cross = 0.1
+    else:
+        (w_PE_within,w_PP_within,w_PS_within, w_SE_within) = ww_weights
+
+        w_PE_cross = 0.1
+        w_PP_cross = 0.1
+        w_PS_cross = 0.1
+        w_SE_cross = 0.1
+
+        w_EP_within = 0.91; w_EP_cross = 0.41
+        w_ES_within = 0.51; w_ES_cross = 0.31
+        w_EE_within = 0.51; w_EE_cross = 0.51
+
+    return (w_EE_within, w_EP_within, w_ES_within, w_PE_within, w_PP_within, w_PS_within, w_SE_within,
+            w_EE_cross, w_EP_cross, w_ES_cross, w_PE_cross, w_PP_cross, w_PS_cross, w_SE_cross)
+
+
+def sweep_inputs(modulation_SST=0):
+    """
+    :return: back_inputs, g_stim, taus and rheobases of the weight sweeps (see
+    plot_testing_at_regular_intervals_weights())
+    """
+    # The stimuli are given as inputs to the populations.
+    g_stim_E = np.array([(1, 0), (0, 1)])
+    g_stim_P = np.array([(0.5, 0), (0, 0.5)])
+    if modulation_SST == 0:
+        g_stim_S = np.array([(0, 0), (0, 0)])
+    elif modulation_SST > 0:
+        g_stim_S = np.array([(0.5, 0), (0, 0.5)])
+    elif modulation_SST < 0:
+        g_stim_S = np.array([(-0.5, 0), (0, -0.5)])
+    g_stim = (g_stim_E, g_stim_P, g_stim_S)
+
+    # Time constants
+    tau_E = 0.02  # time constant of E population firing rate in seconds(20ms)
+    tau_P = 0.005 # time constant of P population firing rate in seconds(5ms)
+    tau_S = 0.01  # time constant of S population firing rate in seconds(10ms)
+    tau_hebb = 240 # time constant of three-factor Hebbian learning in seconds(2min)
+    tau_theta = 24 * (60 * 60) # time constant of target activity in seconds(24h)
+    tau_beta = 28 * (60 * 60) # time constant of target activity regulator in seconds(28h)
+    tau_scaling_E = 8 * (60 * 60)  # time constant of E-to-E scaling in seconds (15h)
+    tau_scaling_P = 8 * (60 * 60)  # time constant of P-to-E scaling in seconds (15h)
+    tau_scaling_S = 8 * (60 * 60)  # time constant of S-to-E scaling in seconds (15h)
+    taus = (tau_E, tau_P, tau_S, tau_hebb, tau_scaling_E, tau_scaling_P, tau_scaling_S, tau_theta, tau_beta)
+
+    # Rheobases (minimum input needed for firing rates to be above zero)
+    rheobase_E, rheobase_P, rheobase_S = 1.5, 1.5, 1.5
+    rheobases = (rheobase_E, rheobase_P, rheobase_S)
+
+    # Background inputs
+    g_E = 4.5
+    g_P = 3.2
+    g_S = 3
+    back_inputs = (g_E, g_P, g_S)
+
+    return back_inputs, g_stim, taus, rheobases
+
+
+def prescreen_weights(l_ww_weights, plastic_flag, modulation_SST=0):
+    """
+    :param l_ww_weights: List of the ww_weights of plot_testing_at_regular_intervals_weights(), e.g. one per line of a
+    parameter file
+    :param plastic_flag: As in plot_testing_at_regular_intervals_weights()
+    :return: The outcome of every ww_weights and the largest real parts of the eigenvalues, see prescreen_stability()
+    in simulation.py
+
+    Screens the weights of plot_testing_at_regular_intervals_weights() for the sets whose rates explode or fall silent
+    before the plasticity acts, e.g. to leave them out of a sweep, with the same stimuli and parameters. The sets of
+    modulation_SST != 0 are screened with the positive modulation of SST neurons.
+    """
+    back_inputs, g_stim, taus, rheobases = sweep_inputs(modulation_SST)
+    l_weights = [sweep_weights(ww_weights, plastic_flag) for ww_weights in l_ww_weights]
+    return prescreen_stability(l_weights, back_inputs, g_stim, taus, rheobases, delta_t=0.0001)
+
+
+def trace_weights(ww_weights, plastic_flag, weight_x, values_x, weight_y=None, values_y=None, stimulated=False,
+                  modulation_SST=0, tolerance=1e-6):
+    """
+    :param ww_weights: Weights of plot_testing_at_regular_intervals_weights() the tracing starts from
+    :param weight_x: Name of the weight varied (see WEIGHT_NAMES in simulation.py), e.g. 'w_EP_within'
+    :param weight_y: Name of a second weight varied, e.g. 'w_ES_within', or None
+    :return: The fixed point along weight_x (see trace_fixed_points() in simulation.py) if weight_y is None, else the
+    boundaries in the plane of the two weights (see trace_boundaries() in simulation.py)
+
+    Locates the boundaries of the fixed point of the rates, e.g. where the network falls silent or explodes, in the
+    sweeps of plot_testing_at_regular_intervals_weights() without simulating a grid of weights. The boundaries can be
+    drawn over the maps of plot_span_init_conds() in util.py.
+    """
+    weights = sweep_weights(ww_weights, plastic_flag)
+    back_inputs, g_stim, taus, rheobases = sweep_inputs(modulation_SST)
+    if weight_y is None:
+        return trace_fixed_points(weights, weight_x, values_x, back_inputs, g_stim, taus, rheobases,
+                                  stimulated=stimulated, tolerance=tolerance)
+    return trace_boundaries(weights, weight_x, values_x, weight_y, values_y, back_inputs, g_stim, taus, rheobases,
+                            stimulated=stimulated, tolerance=tolerance)
@@ -5,9 +5,9 @@ directory = "/home/ge74coy/mnt/nasgroup/labmembers/fabioveneto/synaptic_scaling/
 os.chdir(directory)
 
 from model_analysis import *
-from plotting_functions import *
 
 import sys 
+from sweep_scheduler import parse_arguments
 
 def weights_run_all_together_v1(w_EP_within,w_EP_cross, w_ES_within,w_ES_cross, w_EE_within, w_EE_cross):
     plastic_flag = True
@@ -132,26 +132,7 @@ def weights_run_all_together_v2(w_PE_within,w_PP_within,w_PS_within, w_SE_within
                                 run_simulation=1, save_results =1, plot_results=0,modulation_SST=-1)
 
 def parse_parameter(parameter):
-    parsed_arguments = []
-    parameter_values = parameter.split(',')
-
-    for parsed_parameter in parameter_values:
-        parsed_parameter = parsed_parameter.strip()
-
-        if parsed_parameter.lower() == 'true':
-            parsed_value = True
-        elif parsed_parameter.lower() == 'false':
-            parsed_value = False
-        else:
-            try:
-                parsed_value = int(parsed_parameter)
-            except ValueError:
-                try:
-                    parsed_value = float(parsed_parameter)
-                except ValueError:
-                    raise ValueError(f"Invalid parameter value: {parsed_parameter}")
-
-        parsed_arguments.append(parsed_value)
+    parsed_arguments = parse_arguments(parameter)
 
     print("Parameter values:", parsed_arguments)
     # Call the sim function with the parsed parameters
@@ -160,7 +141,21 @@ def parse_parameter(parameter):
     except:
         weights_run_all_together_v2(*parsed_arguments)
 
+def prescreen(parameters):
+    # Outcome of every line of the parameter file (see prescreen_weights()), the lines with six values are the plastic
+    # weights of weights_run_all_together_v1(), the ones with four the weights of weights_run_all_together_v2()
+    l_parsed_arguments = [parse_arguments(parameter) for parameter in parameters]
+    l_outcomes = [None] * len(parameters)
+    for n_values, plastic_flag in ((6, True), (4, False)):
+        l_index = [i for i, parsed_arguments in enumerate(l_parsed_arguments) if len(parsed_arguments) == n_values]
+        outcomes, abscissas = prescreen_weights([l_parsed_arguments[i] for i in l_index], plastic_flag)
+        for i, outcome in zip(l_index, outcomes):
+            l_outcomes[i] = outcome
+    # Lines of other lengths are not screened
+    return ['stable' if outcome is None else outcome for outcome in l_outcomes]
+
 
 # Example usage of parameter values
-parameter = sys.argv[1]
-parse_parameter(parameter)
\ No newline at end of file
+if __name__ == '__main__':
+    parameter = sys.argv[1]
+    parse_parameter(parameter)
\ No newline at end of file
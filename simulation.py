@@ -0,0 +1,1153 @@
+import numpy as np
+import os
+import pickle
+import time
+import hashlib
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from model import *
+
+# The simulation protocol around the kernels of model.py, without the plotting modules, thus a headless run (e.g. a
+# worker of sweep_scheduler.py) only imports numpy and numba. model_analysis.py holds the drivers of the figures.
+
+
+def determine_name(flags):
+    (hebbian_flag, three_factor_flag, adaptive_threshold_flag,
+     E_scaling_flag, P_scaling_flag, S_scaling_flag) = flags
+
+    if flags == (0,0,0,0,0,0):
+        return "0", "No plasticity"
+
+    elif flags == (1,1,1,1,1,1):
+        return "1", "Full model"
+
+    elif flags == (1,1,1,0,1,1):
+        return "2", "E off (P+S)"
+
+    elif flags == (1,1,1,1,0,1):
+        return "3", "P off (E+S)"
+
+    elif flags == (1,1,1,1,1,0):
+        return "4", "S off (E+P)"
+
+    elif flags == (1,1,1,1,0,0):
+        return "5", "only E on"
+
+    elif flags == (1,1,1,0,1,0):
+        return "6", "only P on"
+
+    elif flags == (1,1,1,0,0,1):
+        return "7", "only S on"
+
+    elif flags == (1,1,1,0,0,0):
+        return "8", "No scaling"
+    elif flags == (1,1,0,1,1,1):
+        return "9", "No beta active - full model"
+
+
+def get_stim_times(hour_sim, stim_duration=15):
+    """
+    :param hour_sim: Time of the test (second stimulus) after the conditioning in hours
+    :param stim_duration: Stimulation duration in seconds
+    :return: Timepoints of the onset (first column) and offset (second column) of the first (first row) and second
+    (second row) stimuli.
+    """
+    return np.array([[5, 5 + stim_duration],
+                     [int(hour_sim * 60 * 60) + 5, int(hour_sim * 60 * 60) + 5 + stim_duration]]).reshape(2, 2)
+
+
+def allocate_data_arrays(hour_sim, delta_t, sampling_rate, stim_duration=15, three_compartmental=False, fill_value=0,
+                         traces=True):
+    """
+    :param hour_sim: Defines how many hours does the simulation lasts
+    :param delta_t: Time step in seconds
+    :param sampling_rate: (sampling_rate_stim, sampling_rate_sim) in time steps
+    :param three_compartmental: True to create the arrays of model_3_compartmental_v3(), False for model()
+    :param fill_value: Initial value of the arrays (e.g. np.nan to tell the unwritten data apart)
+    :param traces: False to allocate the arrays without samples, only the maximum of the excitatory rate is kept (e.g.
+    for sweeps whose analysis only needs a recorder, see new_recorder())
+    :return: l_res_rates, l_res_weights: the data arrays the models write into
+    """
+    (sampling_rate_stim, sampling_rate_sim) = sampling_rate
+    n_time_points_stim = int((stim_duration + 10) * (1 / delta_t) * (1 / sampling_rate_stim))
+    n_time_points_phase2 = int((hour_sim * 60 * 60 - 20) * (1 / delta_t) * (1 / sampling_rate_sim)) + 1
+    if not traces:
+        # The models only write the samples the arrays have room for
+        n_time_points_stim, n_time_points_phase2 = 0, 0
+
+    def new(n_rows, n_time_points):
+        return np.full((n_rows, n_time_points), fill_value, dtype=np.float32)
+
+    max_E = np.zeros(1, dtype=np.float32)
+    if three_compartmental:
+        l_res_rates = (new(6, n_time_points_stim), new(6, n_time_points_stim), new(6, n_time_points_phase2),
+                       new(6, n_time_points_phase2), new(12, n_time_points_phase2), new(6, n_time_points_stim), max_E)
+        l_res_weights = (new(8, n_time_points_stim), new(20, n_time_points_phase2))
+    else:
+        l_res_rates = (new(6, n_time_points_stim), new(10, n_time_points_phase2), new(6, n_time_points_stim), max_E)
+        l_res_weights = (new(4, n_time_points_stim), new(12, n_time_points_phase2))
+
+    return l_res_rates, l_res_weights
+
+
+def new_recorder(hour_sim, delta_t, channels, stride, window, stim_duration=15, fill_value=0):
+    """
+    :param hour_sim: Time of the test after the conditioning in hours
+    :param channels: Entries of the state vector to record, e.g. (ST_E1, ST_P1) (see initial_state() in model.py)
+    :param stride: Time steps between the samples
+    :param window: (t_start, t_stop) in seconds relative to the onset of the test, e.g. (0, stim_duration) for the
+    test response
+    :return: (channels, (step_start, step_stop, stride), data) for the recorder argument of the models, data holds a
+    row for every channel and a column for every sample
+
+    The state is recorded at the start of the time steps step_start, step_start + stride, ... before step_stop.
+    """
+    if stride < 1:
+        raise ValueError('The stride of the recorder must be at least one time step, not ' + repr(stride))
+    test_onset = get_stim_times(hour_sim, stim_duration)[1][0]
+    # The stimulus times are shifted by 2 seconds in the models (see event_steps() in model.py)
+    step_start = int((test_onset + window[0] + 2) * (1 / delta_t))
+    step_stop = int((test_onset + window[1] + 2) * (1 / delta_t))
+    n_samples = max(0, (step_stop - step_start + stride - 1) // stride)
+    return (np.array(channels, dtype=np.int64), np.array([step_start, step_stop, stride], dtype=np.int64),
+            np.full((len(channels), n_samples), fill_value, dtype=np.float32))
+
+
+# Kinds of the reductions by name (see new_reductions())
+REDUCTION_KINDS = {'max': REDUCE_MAX, 'min': REDUCE_MIN, 'mean': REDUCE_MEAN, 'onset': REDUCE_ONSET,
+                   'value': REDUCE_VALUE}
+
+
+def new_reductions(hour_sim, delta_t, reductions, stim_duration=15):
+    """
+    :param hour_sim: Time of the test after the conditioning in hours
+    :param reductions: List of (kind, channel, window, stride) with kind one of 'max', 'min', 'mean', 'onset' (the
+    maximum minus the first sample) and 'value', channel an entry of the state vector (e.g. ST_E1), window (t_start,
+    t_stop) in seconds relative to the onset of the test (a time t for 'value') and stride the time steps between the
+    samples, e.g. ('max', ST_E1, (0, stim_duration), 20) for the test response of E1
+    :return: (channels, kinds, windows, values) for the reductions argument of the models, values[:, 0] holds the
+    results after the simulation, np.nan for the windows the simulation didn't reach (see reduce() in model.py)
+    """
+    test_onset = get_stim_times(hour_sim, stim_duration)[1][0]
+    channels = np.empty(len(reductions), dtype=np.int64)
+    kinds = np.empty(len(reductions), dtype=np.int64)
+    windows = np.empty((len(reductions), 3), dtype=np.int64)
+    for i, (kind, channel, window, stride) in enumerate(reductions):
+        if kind not in REDUCTION_KINDS:
+            raise ValueError('The kind of a reduction must be one of ' + ', '.join(REDUCTION_KINDS) + ', not '
+                             + repr(kind))
+        if stride < 1:
+            raise ValueError('The stride of a reduction must be at least one time step, not ' + repr(stride))
+        if kind == 'value':
+            window = (window, window)
+        channels[i], kinds[i] = channel, REDUCTION_KINDS[kind]
+        # The stimulus times are shifted by 2 seconds in the models (see event_steps() in model.py)
+        windows[i, 0] = int((test_onset + window[0] + 2) * (1 / delta_t))
+        windows[i, 1] = max(int((test_onset + window[1] + 2) * (1 / delta_t)), windows[i, 0] + 1)
+        windows[i, 2] = stride
+    return channels, kinds, windows, np.full((len(reductions), 3), np.nan)
+
+
+# Names of the reasons a simulation stopped (see exit_status() in model.py)
+EXIT_REASONS = {EXIT_STEP_STOP: 'step_stop', EXIT_EXPLODED: 'exploded', EXIT_SILENT: 'silent'}
+
+
+def run_status(state, delta_t):
+    """
+    :param state: State vector of model() or model_3_compartmental_v3() after the simulation
+    :return: Dictionary with the reason the simulation stopped ('step_stop' if it reached the time step it was run
+    until, 'exploded' or 'silent'), the time step and the simulated time in seconds it reached, the number of
+    activations of the lower boundaries, the numbers of accepted and rejected steps of the integrator 'rk' (see
+    exit_status() in model.py, zero for the other integrators) and the simulated time in seconds phase 2 was found
+    converged at, None if it wasn't (see check_convergence() in model.py)
+    """
+    if len(state) == N_STATE_3_COMPARTMENTAL:
+        exit_reason, step, time_reached, n_clamps, rk_accepted, rk_rejected = \
+            exit_status_3_compartmental_v3(state, delta_t)
+        step_converged = state[ST3_CONVERGED_STEP]
+    else:
+        exit_reason, step, time_reached, n_clamps, rk_accepted, rk_rejected = exit_status(state, delta_t)
+        step_converged = state[ST_CONVERGED_STEP]
+    return {'exit_reason': EXIT_REASONS[exit_reason], 'step': step, 'time': time_reached, 'n_clamps': n_clamps,
+            'rk_accepted': rk_accepted, 'rk_rejected': rk_rejected,
+            'converged': step_converged * delta_t if step_converged else None}
+
+
+def save_checkpoint(file_name, state, hour_sim, l_res, parameters):
+    """
+    :param file_name: Path of the pickle file
+    :param state: State vector of the simulation (see initial_state() in model.py)
+    :param hour_sim: Time of the test after the conditioning of the simulation in hours
+    :param l_res: (l_res_rates, l_res_weights) of the simulation until the state
+    :param parameters: Everything the simulation depends on besides the test time, compared with same_parameters()
+    before the simulation is resumed from the checkpoint
+
+    Saves a simulation that can be resumed later (see load_checkpoint()). The state vector holds everything the
+    simulation carries from one time step to the next, thus the simulation continues exactly as if it was not stopped.
+    """
+    with open(file_name, 'wb') as file:
+        pickle.dump({'state': state, 'hour_sim': hour_sim, 'l_res': l_res, 'parameters': parameters}, file)
+
+
+def load_checkpoint(file_name):
+    """
+    :param file_name: Path of a pickle file written by save_checkpoint()
+    :return: Dictionary with the keys 'state', 'hour_sim', 'l_res' and 'parameters' of save_checkpoint()
+    """
+    with open(file_name, 'rb') as file:
+        return pickle.load(file)
+
+
+def same_parameters(parameters, parameters_other):
+    """
+    :return: True if the two (nested) tuples of parameters, which may hold numpy arrays, are equal
+    """
+    if isinstance(parameters, (tuple, list)) or isinstance(parameters_other, (tuple, list)):
+        return (isinstance(parameters, (tuple, list)) and isinstance(parameters_other, (tuple, list))
+                and len(parameters) == len(parameters_other)
+                and all(same_parameters(p, p_other) for p, p_other in zip(parameters, parameters_other)))
+    if isinstance(parameters, np.ndarray) or isinstance(parameters_other, np.ndarray):
+        return np.array_equal(parameters, parameters_other)
+    if isinstance(parameters, float) and isinstance(parameters_other, float) and np.isnan(parameters):
+        return np.isnan(parameters_other)  # e.g. fill_value=np.nan
+    return type(parameters) == type(parameters_other) and parameters == parameters_other
+
+
+def copy_data_arrays(l_res, l_res_source, n_phase2, three_compartmental=False):
+    """
+    :param l_res: (l_res_rates, l_res_weights) the data is copied to (see allocate_data_arrays())
+    :param l_res_source: (l_res_rates, l_res_weights) the data is copied from, possibly of a different test time
+    :param n_phase2: Number of samples of phase 2 to copy
+
+    Copies the data of phase 1, the first n_phase2 samples of phase 2 and the maximum of the excitatory rate.
+    """
+    # Positions of the data arrays of phase 1 and phase 2 in l_res_rates and l_res_weights
+    if three_compartmental:
+        idx_phase1, idx_phase2 = ([0, 1], [0]), ([2, 3, 4], [1])
+    else:
+        idx_phase1, idx_phase2 = ([0], [0]), ([1], [1])
+
+    for i_res in range(2):
+        for idx in idx_phase1[i_res]:
+            # Either array may be allocated without samples (see allocate_data_arrays())
+            n = min(l_res[i_res][idx].shape[1], l_res_source[i_res][idx].shape[1])
+            l_res[i_res][idx][:, :n] = l_res_source[i_res][idx][:, :n]
+        for idx in idx_phase2[i_res]:
+            n = min(n_phase2, l_res[i_res][idx].shape[1], l_res_source[i_res][idx].shape[1])
+            l_res[i_res][idx][:, :n] = l_res_source[i_res][idx][:, :n]
+    l_res[0][-1][0] = l_res_source[0][-1][0]
+
+
+def parareal_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g, g_stim,
+                        stim_times, taus, beta_K, rheobases, flags=(0, 0, 0, 0, 0, 0), flags_theta=(1,1),
+                        exponential_euler=False, recorder=None, reductions=None, n_slices=None, delta_t_slow=20.,
+                        tolerance=1e-6, n_threads=None):
+    """
+    :param n_slices: Number of time slices the time between the conditioning and the test is split into, None for the
+    number of cores
+    :param delta_t_slow: Step of the slow variables in seconds of the coarse propagator (see model_qss_from_state())
+    :param tolerance: The iterations stop once the states at the boundaries of the slices change by less than tolerance
+    between two iterations, relative to the values above 1 and absolute below
+    :param n_threads: Number of slices simulated at once, None for the number of cores
+    :return: Dictionary with the number of iterations, the last change of the states at the boundaries, n_slices and
+    whether the time between the conditioning and the test was simulated without slices ('serial': with a warning on a
+    single core or for a time too short to split, without one after the rates explode in a slice)
+
+    Parallel-in-time (Parareal) version of model_from_state() with the same arguments, for a single long simulation.
+    The time between the registration window of the conditioning and the one of the test has no events, it is split
+    into n_slices slices. The coarse propagator (model_qss_from_state(), the slow variables on the slow manifold) runs
+    over the slices one after the other, the Euler steps of model_from_state() refine all the slices at once from the
+    states at their boundaries in the threads of run_threads(). The states at the boundaries are then corrected in
+    slice order by the difference of the coarse propagator from the corrected and the previous state, until they no
+    longer change. After k iterations the first k slices are exact, thus the result is the one of model_from_state()
+    after at most n_slices iterations, and much earlier within tolerance as the slow variables are smooth. The data
+    of phase 2 is written by the Euler steps of the last iteration. The rest of the protocol is simulated with
+    model_from_state(). Only for model().
+    """
+    model_args = (delta_t, sampling_rate)
+    model_kwargs = {'flags': flags, 'flags_theta': flags_theta, 'exponential_euler': exponential_euler}
+    parameters = (weights, g, g_stim, stim_times, taus, beta_K, rheobases)
+    (r_phase1, r_phase2, r_phase3, max_E) = l_res_rates
+    (J_exc_phase1, J_phase2) = l_res_weights
+    n_slices = n_slices or os.cpu_count()
+    info = {'iterations': 0, 'error': 0., 'n_slices': n_slices, 'serial': False}
+
+    # The recorder and the reductions only sample the registration windows, outside of the slices
+    probe_kwargs = {key: value for key, value in (('recorder', recorder), ('reductions', reductions))
+                    if value is not None}
+
+    def fine(state, step_stop, l_res_rates=l_res_rates, probe_kwargs=probe_kwargs):
+        model_from_state(state, step_stop, *model_args, l_res_rates, l_res_weights, *parameters, **model_kwargs,
+                         **probe_kwargs)
+        return state[ST_STEP] == step_stop
+
+    def coarse(state, step_stop):
+        # The coarse propagator writes into arrays without samples, the data is registered by the Euler steps
+        l_res_none = allocate_data_arrays(0, delta_t, sampling_rate, traces=False)
+        model_qss_from_state(state, step_stop, *model_args, *l_res_none, *parameters, flags=flags,
+                             flags_theta=flags_theta, delta_t_slow=delta_t_slow, exponential_euler=exponential_euler)
+        return state
+
+    # The same time steps as the slow period of model_qss_from_state()
+    step_slow_start = int((stim_times[0][1] + 5 + 2) * (1 / delta_t)) + 1
+    step_slow_stop = step_stop
+    if stim_times.shape[0] > 1:
+        step_slow_stop = min(step_stop, int((stim_times[1][0] - 5 + 2) * (1 / delta_t)))
+    steps_slow = max(1, int(delta_t_slow * (1 / delta_t)))
+
+    def run_rest():
+        # The events and the registration windows of the test, max_E is taken from the state
+        if state[ST_STEP] < step_stop:
+            fine(state, step_stop)
+        else:
+            max_E[0] = state[ST_MAX_E]
+        return info
+
+    if int(state[ST_STEP]) < step_slow_start and not fine(state, min(step_slow_start, step_stop)):
+        return info
+    step_start = int(state[ST_STEP])
+    if n_slices < 2 or step_slow_stop - step_start < n_slices * steps_slow:
+        if step_slow_stop > step_start:
+            info['serial'] = True
+            warnings.warn('Parareal with n_slices=' + str(n_slices) + ' over ' + str(step_slow_stop - step_start) +
+                          ' time steps: the Euler steps are simulated one after the other')
+        return run_rest()
+
+    slice_steps = np.linspace(step_start, step_slow_stop, n_slices + 1).astype(np.int64)
+    # The continuous variables are corrected, the counters and indices are the ones of the Euler steps
+    idx_continuous = slice(ST_E1, ST_SLOW_STOP)
+    # Data of phase 2 the Euler steps from the states before convergence write and the fallback resets
+    i_2_start = int(state[ST_I2])
+    phase2_unwritten = (r_phase2[:, i_2_start:].copy(), J_phase2[:, i_2_start:].copy())
+
+    states = [state.copy()]
+    states_coarse = []
+    for i_slice in range(n_slices):
+        states_coarse.append(coarse(states[i_slice].copy(), slice_steps[i_slice + 1]))
+        states.append(states_coarse[i_slice].copy())
+
+    def fine_slice(i_slice):
+        # Every slice keeps the maximum of the excitatory rate in its own array, the phase 2 samples are disjoint
+        state_fine = states[i_slice].copy()
+        l_res_slice = (r_phase1, r_phase2, r_phase3, np.zeros(1, dtype=np.float32))
+        reached = fine(state_fine, slice_steps[i_slice + 1], l_res_slice, {})
+        return state_fine, reached
+
+    with ThreadPoolExecutor(max_workers=n_threads or os.cpu_count()) as executor:
+        for k in range(n_slices):
+            l_fine = list(executor.map(fine_slice, range(k, n_slices)))
+            info['iterations'] = k + 1
+
+            if not all(reached for _, reached in l_fine):
+                # The rates explode or fall silent in a slice, the simulation stops there: the slices are simulated
+                # one after the other from the first exact state
+                r_phase2[:, i_2_start:], J_phase2[:, i_2_start:] = phase2_unwritten
+                state[:] = states[k]
+                info['serial'] = True
+                if fine(state, step_slow_stop):
+                    return run_rest()
+                return info
+
+            error = 0.
+            for i_slice in range(k, n_slices):
+                state_fine = l_fine[i_slice - k][0]
+                state_coarse = coarse(states[i_slice].copy(), slice_steps[i_slice + 1])
+                state_new = state_fine.copy()
+                state_new[idx_continuous] = (state_fine[idx_continuous]
+                                             + (state_coarse[idx_continuous] - states_coarse[i_slice][idx_continuous]))
+                change = np.abs(state_new[idx_continuous] - states[i_slice + 1][idx_continuous])
+                error = max(error, np.max(change / np.maximum(np.abs(state_new[idx_continuous]), 1)))
+                states_coarse[i_slice] = state_coarse
+                states[i_slice + 1] = state_new
+            info['error'] = error
+            if error <= tolerance:
+                break
+
+    state[:] = states[n_slices]
+    return run_rest()
+
+
+def model_functions(three_compartmental, integrator='euler', exponential_euler=False):
+    """
+    :return: The function creating the initial state, the function running the simulation from a state and its extra
+    keyword arguments (see run_test_probes() for the arguments)
+    """
+    if integrator not in ('euler', 'qss', 'rk', 'parareal'):
+        raise ValueError("integrator must be 'euler', 'qss', 'rk' or 'parareal', not " + repr(integrator))
+    if integrator == 'rk' and exponential_euler:
+        raise ValueError('The exponential Euler update is not used by the Runge-Kutta integrator')
+    if three_compartmental and (integrator in ('qss', 'parareal') or exponential_euler):
+        raise ValueError('Only the Euler and the Runge-Kutta integrators are available for model_3_compartmental_v3()')
+
+    if three_compartmental:
+        run_from_state = model_3_compartmental_v3_rk_from_state if integrator == 'rk' else model_3_compartmental_v3_from_state
+        return initial_state_3_compartmental_v3, run_from_state, {}
+    run_from_state = {'euler': model_from_state, 'qss': model_qss_from_state, 'rk': model_rk_from_state,
+                      'parareal': parareal_from_state}[integrator]
+    return initial_state, run_from_state, {} if integrator == 'rk' else {'exponential_euler': exponential_euler}
+
+
+def kernel_parameters(weights, back_inputs, g_stim, taus, K, rheobases, flags=(0, 0, 0, 0, 0, 0), flags_theta=(1,1),
+                      lambdas=None):
+    """
+    :return: The parameters with the types the kernels are compiled for (see warm_up()): tuples of floats, the stimuli
+    as float arrays and the flags as tuples of ints
+
+    numba compiles a kernel again for every new combination of argument types, e.g. for g_stim given as an int array
+    (np.array([(1, 0), (0, 1)])) instead of a float one, or a weight parsed as 1 instead of 1.0. The values are unchanged.
+    """
+    weights, back_inputs, taus, rheobases = (tuple(float(value) for value in values)
+                                             for values in (weights, back_inputs, taus, rheobases))
+    g_stim = tuple(np.asarray(g_stim_X, dtype=np.float64) for g_stim_X in g_stim)
+    flags, flags_theta = tuple(int(flag) for flag in flags), tuple(int(flag) for flag in flags_theta)
+    if lambdas is not None:
+        lambdas = tuple(float(value) for value in lambdas)
+    return weights, back_inputs, g_stim, taus, float(K), rheobases, flags, flags_theta, lambdas
+
+
+# Simulations until the onset of the conditioning, shared by all runs with the same parameters (see run_prefix())
+prefix_cache = []
+PREFIX_CACHE_SIZE = 32
+# Held while prefix_cache is read or changed, as the runs of run_threads() share it
+prefix_lock = threading.Lock()
+
+
+def run_prefix(delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta=(1,1),
+               lambdas=None, stim_duration=15, fill_value=0, integrator='euler', exponential_euler=False):
+    """
+    :return: Dictionary with the state (see initial_state() in model.py) and the data arrays (l_res_rates,
+    l_res_weights) of the simulation at the onset of the conditioning, not to be written to (see branch_prefix())
+
+    The flags, flags_theta and K take effect at the onset of the conditioning, and g_stim (e.g. the SST modulation) is
+    only applied from there on. Until then, the simulations of all the variants of these parameters, and of every test
+    time, are the same. The first 7 seconds are simulated once and held in prefix_cache for the later runs with the
+    same remaining parameters (the last PREFIX_CACHE_SIZE of them). The arguments are the ones of run_test_probes().
+    """
+    three_compartmental = lambdas is not None
+    # Until the onset of the conditioning, the slow-manifold integration follows the Euler steps
+    integrator_prefix = 'rk' if integrator == 'rk' else 'euler'
+    parameters = (three_compartmental, delta_t, sampling_rate, weights, back_inputs, taus, rheobases, lambdas,
+                  stim_duration, fill_value, integrator_prefix, exponential_euler)
+    with prefix_lock:
+        for prefix in prefix_cache:
+            if same_parameters(prefix['parameters'], parameters):
+                return prefix
+
+    new_state, run_from_state, model_kwargs = model_functions(three_compartmental, integrator_prefix, exponential_euler)
+    model_args = (K, rheobases, lambdas) if three_compartmental else (K, rheobases)
+    # The onset of the conditioning is the same for every test time
+    stim_times = get_stim_times(1, stim_duration)
+    step_onset = event_steps(delta_t, stim_times)[0][0, 0]
+
+    state = new_state(weights)
+    l_res = allocate_data_arrays(1, delta_t, sampling_rate, stim_duration, three_compartmental, fill_value)
+    run_from_state(state, step_onset, delta_t, sampling_rate, l_res[0], l_res[1], weights, back_inputs, g_stim,
+                   stim_times, taus, *model_args, flags=flags, flags_theta=flags_theta, **model_kwargs)
+
+    prefix = {'state': state, 'l_res': l_res, 'parameters': parameters}
+    with prefix_lock:
+        # Another thread may have simulated the same prefix meanwhile, the first one is kept
+        for prefix_other in prefix_cache:
+            if same_parameters(prefix_other['parameters'], parameters):
+                return prefix_other
+        prefix_cache.append(prefix)
+        if len(prefix_cache) > PREFIX_CACHE_SIZE:
+            prefix_cache.pop(0)
+    return prefix
+
+
+def branch_prefix(prefix, hour_sim, delta_t, sampling_rate, stim_duration=15, three_compartmental=False, fill_value=0,
+                  traces=True):
+    """
+    :param prefix: Simulation until the onset of the conditioning (see run_prefix())
+    :return: state, (l_res_rates, l_res_weights) of a new simulation with the test at hour_sim, continuing the prefix
+    """
+    l_res = allocate_data_arrays(hour_sim, delta_t, sampling_rate, stim_duration, three_compartmental, fill_value,
+                                 traces)
+    copy_data_arrays(l_res, prefix['l_res'], 0, three_compartmental)
+    return prefix['state'].copy(), l_res
+
+
+def run_calibration(hour_sim, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases,
+                    flags_theta=(1,1), lambdas=None, stim_duration=15, fill_value=0):
+    """
+    :return: (l_res_rates, l_res_weights) of the first 30 seconds of the protocol without plasticity, used to determine
+    the aversion threshold from the response of E2 to the conditioning of E1
+
+    The simulation continues the shared prefix (see run_prefix()).
+    """
+    three_compartmental = lambdas is not None
+    flags = (0, 0, 0, 0, 0, 0)
+    weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta, lambdas = kernel_parameters(
+        weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta, lambdas)
+    prefix = run_prefix(delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta,
+                        lambdas, stim_duration, fill_value)
+    state, l_res = branch_prefix(prefix, hour_sim, delta_t, sampling_rate, stim_duration, three_compartmental,
+                                 fill_value)
+    _, run_from_state, _ = model_functions(three_compartmental)
+    model_args = (K, rheobases, lambdas) if three_compartmental else (K, rheobases)
+    run_from_state(state, int(30 * (1 / delta_t)), delta_t, sampling_rate, l_res[0], l_res[1], weights, back_inputs,
+                   g_stim, get_stim_times(hour_sim, stim_duration), taus, *model_args, flags=flags,
+                   flags_theta=flags_theta)
+    return l_res
+
+
+def parameters_hash(parameters):
+    """
+    :return: Hex digest of the (nested) tuple of parameters, which may hold numpy arrays, the same for every run of
+    Python. Numbers are compared by their value as float, e.g. 1 and 1.0 give the same digest.
+    """
+    digest = hashlib.sha1()
+
+    def update(p):
+        if isinstance(p, (tuple, list)):
+            digest.update(b'(')
+            for p_item in p:
+                update(p_item)
+            digest.update(b')')
+        elif isinstance(p, np.ndarray):
+            p = np.ascontiguousarray(p, dtype=np.float64)
+            digest.update(repr(p.shape).encode())
+            digest.update(p.tobytes())
+        elif isinstance(p, (int, float, np.number)):
+            digest.update(repr(float(p)).encode() + b',')
+        else:
+            digest.update(repr(p).encode() + b',')
+
+    update(parameters)
+    return digest.hexdigest()
+
+
+# Maximal number of files in the directory of cached aversion thresholds (see aversion_threshold())
+THRESHOLD_CACHE_SIZE = 20000
+
+
+def load_cached_threshold(cache_dir, key):
+    """
+    :return: The aversion threshold saved with save_cached_threshold() under the key, None if there is none
+    """
+    file_name = os.path.join(cache_dir, key + '.pkl')
+    try:
+        with open(file_name, 'rb') as file:
+            av_threshold = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    # The modification time orders the files by their last use for the eviction
+    os.utime(file_name)
+    return av_threshold
+
+
+def save_cached_threshold(cache_dir, key, av_threshold):
+    """
+    Saves the aversion threshold under the key, evicting the least recently used files beyond THRESHOLD_CACHE_SIZE.
+    The file is written under a temporary name and renamed, thus the parallel runs of a sweep never read a partial one.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    file_name = os.path.join(cache_dir, key + '.pkl')
+    file_name_tmp = file_name + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+    with open(file_name_tmp, 'wb') as file:
+        pickle.dump(av_threshold, file)
+    os.replace(file_name_tmp, file_name)
+
+    entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith('.pkl')]
+    if len(entries) > THRESHOLD_CACHE_SIZE:
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - THRESHOLD_CACHE_SIZE]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass  # already evicted by a parallel run
+
+
+def aversion_threshold(hour_sim, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases,
+                       flags_theta=(1,1), lambdas=None, stim_duration=15, fill_value=0, closed_form=True,
+                       cache_dir=None):
+    """
+    :param closed_form: True to find the steady state of the rates directly (see calibration_rates() in model.py),
+    with the calibration run as the fallback if there is no stable fixed point, False to always simulate it
+    :param cache_dir: Directory to keep the thresholds in across runs, keyed by the parameters of the network, None to
+    compute it every time
+    :return: The aversion threshold, the rate of E2 10 seconds into the conditioning without plasticity (see
+    run_calibration()), as float32 like the data arrays
+
+    Without plasticity, the calibration run does not depend on hour_sim, K and flags_theta.
+    """
+    (sampling_rate_stim, sampling_rate_sim) = sampling_rate
+    weights, back_inputs, g_stim, taus, K, rheobases, _, flags_theta, lambdas = kernel_parameters(
+        weights, back_inputs, g_stim, taus, K, rheobases, flags_theta=flags_theta, lambdas=lambdas)
+    if cache_dir is not None:
+        key = parameters_hash((delta_t, sampling_rate_stim, weights, back_inputs, g_stim, taus, rheobases, lambdas,
+                               stim_duration, fill_value, closed_form))
+        av_threshold = load_cached_threshold(cache_dir, key)
+        if av_threshold is None:
+            av_threshold = aversion_threshold(hour_sim, delta_t, sampling_rate, weights, back_inputs, g_stim, taus,
+                                              K, rheobases, flags_theta, lambdas, stim_duration, fill_value,
+                                              closed_form)
+            save_cached_threshold(cache_dir, key, av_threshold)
+        return av_threshold
+
+    # The stimulus is still on when the threshold is read
+    if closed_form and stim_duration > 10:
+        if lambdas is None:
+            found, r = calibration_rates(weights, back_inputs, g_stim, taus, rheobases, delta_t)
+        else:
+            found, r = calibration_rates_3_compartmental_v3(weights, back_inputs, g_stim, taus, rheobases, lambdas,
+                                                            delta_t)
+        if found:
+            return np.float32(r[1])
+
+    l_res_rates, l_res_weights = run_calibration(hour_sim, delta_t, sampling_rate, weights, back_inputs, g_stim, taus,
+                                                 K, rheobases, flags_theta=flags_theta, lambdas=lambdas,
+                                                 stim_duration=stim_duration, fill_value=fill_value)
+    idx_av_threshold = int(15 * (1 / delta_t) * (1 / sampling_rate_stim))
+    return l_res_rates[0][1][idx_av_threshold]
+
+
+def run_test_probes(hour_sims, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases, flags,
+                    flags_theta=(1,1), lambdas=None, stim_duration=15, fill_value=0, checkpoint_fork=True,
+                    integrator='euler', exponential_euler=False, checkpoint_file=None, share_prefix=True,
+                    recorder=None, reductions=None, traces=True, status=False, convergence=None,
+                    parareal_options=None):
+    """
+    :param hour_sims: Times of the tests after the conditioning in hours, arbitrary (e.g. 0.25 for a test after 15 min)
+    :param lambdas: Given for model_3_compartmental_v3(), None for model()
+    :param checkpoint_fork: True to simulate the latest test once and fork the earlier tests from its snapshots, False
+    to simulate every test from the beginning
+    :param integrator: 'euler' for the Euler steps of delta_t throughout, 'qss' to integrate the time between the
+    conditioning and the test on the slow manifold (see model_qss_from_state() in model.py, only for model()), 'rk' for
+    adaptive Runge-Kutta steps between the time steps of the protocol (see model_rk_from_state() in model.py),
+    'parareal' to simulate the Euler steps between the conditioning and the test in time slices on all the cores (see
+    parareal_from_state(), only for model())
+    :param exponential_euler: True to update the rates with the exponential Euler method, which allows a larger delta_t
+    (see model_from_state() in model.py, only for model()). sampling_rate has to be scaled with delta_t
+    :param checkpoint_file: Path of a checkpoint (see save_checkpoint()) or None. If the file exists and was written
+    with the same parameters for a test time not later than every test in hour_sims, the simulation is resumed from it
+    instead of starting at t=0, unless its data of phase 2 lacks samples the simulation needs (its arrays are sized by
+    its own test time). The state 5 seconds before the latest test is written to the file afterwards (unless it
+    holds a later one), so a later call with a longer test time (e.g. 72h after 48h) only simulates the additional time
+    :param share_prefix: True to continue the simulation until the onset of the conditioning shared with the runs of
+    other flags, K and g_stim (see run_prefix()), False to simulate it
+    :param recorder: (channels, stride, window) to record the entries channels of the state vector at every stride-th
+    time step within the window around each test (see new_recorder()), e.g. ((ST_E1,), 10, (0, stim_duration)), or
+    None. The window has to start at most 5 seconds before the test
+    :param reductions: List of reductions computed while the test is simulated (see new_reductions()), e.g.
+    [('max', ST_E1, (0, stim_duration), sampling_rate[0])] for the test response of E1, or None. The windows have to
+    start at most 5 seconds before the test
+    :param traces: False to leave out the data of the phases (see allocate_data_arrays()), e.g. if the recorder holds
+    all the analysis needs
+    :param status: True to add the status of every test's simulation (see run_status()), e.g. to skip the analysis of
+    the ones that exploded. The earlier tests of a simulation that stopped before their snapshot are not simulated and
+    get its status
+    :param convergence: (tolerance, window) to skip the rest of phase 2 once the plastic weights, set points and
+    regulators drift by less than tolerance (relative to their values, absolute below 1) within window seconds, e.g.
+    (1e-6, 3600), or None (see check_convergence() in model.py, only with the Euler integrator). The samples of phase 2
+    after the convergence hold the converged one, and the status (see run_status()) the time it was reached
+    :param parareal_options: Keyword arguments of parareal_from_state() for the integrator 'parareal', e.g.
+    {'n_slices': 16, 'tolerance': 1e-8, 'n_threads': 8}, or None for its defaults. The status then holds the
+    dictionaries parareal_from_state() returns for the simulation of every test under 'parareal' (the ones of the
+    latest test until the snapshot for the earlier tests forked from it)
+    :return: List of (l_res_rates, l_res_weights) for every test time in the order of hour_sims, each as if the model
+    was run with the stim_times of this test, followed by the data of the recorder, the results of the reductions
+    (values[:, 0], see new_reductions()) and the status if they are requested
+
+    Runs the protocol of analyze_model() with the test at every time in hour_sims. With checkpoint_fork, only the
+    simulation with the latest test is run from t=0. Its state (see initial_state() in model.py) is snapshotted at the
+    start of the data registration of every earlier test, 5 seconds before the test onset, and only the remaining test
+    protocol is simulated from each snapshot. Until the snapshot, the simulations with different test times are
+    identical, thus the results are the same as running them one by one while the simulated time drops from the sum
+    to the maximum of hour_sims. The data of the earlier tests in phase 2 is the beginning of the one of the latest.
+    """
+    three_compartmental = lambdas is not None
+    new_state, run_from_state, model_kwargs = model_functions(three_compartmental, integrator, exponential_euler)
+    weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta, lambdas = kernel_parameters(
+        weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta, lambdas)
+    if convergence is not None:
+        if integrator != 'euler':
+            raise ValueError('The convergence of phase 2 is only monitored with the Euler integrator')
+        # The window is counted in samples of phase 2
+        convergence = (float(convergence[0]), max(1, int(round(convergence[1] / (delta_t * sampling_rate[1])))))
+    if parareal_options is not None and integrator != 'parareal':
+        raise ValueError("parareal_options are only used with the integrator 'parareal'")
+    # The earlier tests are forked from their snapshots 5 seconds before the test (see snapshot_step())
+    windows = ([] if recorder is None else [recorder[2]]) + ([] if reductions is None else
+                                                             [reduction[2] for reduction in reductions])
+    for window in windows:
+        if np.min(window) < -5:
+            raise ValueError('The windows of the recorder and the reductions have to start at most 5 seconds before '
+                             'the test, not ' + repr(window))
+    recorders = {hour_sim: None if recorder is None else
+                 new_recorder(hour_sim, delta_t, recorder[0], recorder[1], recorder[2], stim_duration, fill_value)
+                 for hour_sim in hour_sims}
+    reducers = {hour_sim: None if reductions is None else
+                new_reductions(hour_sim, delta_t, reductions, stim_duration) for hour_sim in hour_sims}
+    if three_compartmental:
+        idx_step, idx_max_E, idx_i2 = ST3_STEP, ST3_MAX_E, ST3_I2
+        model_args = (K, rheobases, lambdas)
+    else:
+        idx_step, idx_max_E, idx_i2 = ST_STEP, ST_MAX_E, ST_I2
+        model_args = (K, rheobases)
+
+    def sim_steps(hour_sim):
+        return int(int(hour_sim * 60 * 60 + (stim_duration + 10) * 2 + 2) * (1 / delta_t))
+
+    def snapshot_step(hour_sim):
+        return int((get_stim_times(hour_sim, stim_duration)[1][0] - 5 + 2) * (1 / delta_t))
+
+    def run(state, step_stop, hour_sim, l_res):
+        kwargs = dict(model_kwargs)
+        if recorders[hour_sim] is not None:
+            kwargs['recorder'] = recorders[hour_sim]
+        if reducers[hour_sim] is not None:
+            kwargs['reductions'] = reducers[hour_sim]
+        if convergence is not None:
+            kwargs['convergence'] = convergence
+        if parareal_options is not None:
+            kwargs.update(parareal_options)
+        info = run_from_state(state, step_stop, delta_t, sampling_rate, l_res[0], l_res[1], weights, back_inputs,
+                              g_stim, get_stim_times(hour_sim, stim_duration), taus, *model_args, flags=flags,
+                              flags_theta=flags_theta, **kwargs)
+        if integrator == 'parareal':
+            parareal_infos.setdefault(hour_sim, []).append(info)
+        # The simulation stops earlier if the rates explode
+        return state[idx_step] == step_stop
+
+    parameters = (three_compartmental, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases, flags,
+                  flags_theta, lambdas, stim_duration, fill_value, integrator, exponential_euler, traces, convergence)
+    if parareal_options is not None:
+        parameters += (tuple(sorted(parareal_options.items())),)
+    checkpoint, hour_checkpoint = None, None
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        checkpoint = load_checkpoint(checkpoint_file)
+        # The state vectors of older checkpoints can have another layout
+        if (not same_parameters(checkpoint['parameters'], parameters)
+                or checkpoint['state'].shape != new_state(weights).shape):
+            checkpoint = None
+        else:
+            hour_checkpoint = checkpoint['hour_sim']
+            if hour_checkpoint > min(hour_sims):
+                checkpoint = None
+
+    def start(hour_sim):
+        # A new simulation with the test at hour_sim, resumed from the checkpoint or the shared prefix if there is one
+        l_res = allocate_data_arrays(hour_sim, delta_t, sampling_rate, stim_duration, three_compartmental, fill_value,
+                                     traces)
+        if checkpoint is not None:
+            # The checkpoint's arrays of phase 2 are sized by its own test time, the samples it had no room for are
+            # missing (e.g. for a test time off the sampling of phase 2), then the simulation starts from the beginning
+            n_phase2 = int(checkpoint['state'][idx_i2])
+            if checkpoint['l_res'][1][1].shape[1] >= min(n_phase2, l_res[1][1].shape[1]):
+                copy_data_arrays(l_res, checkpoint['l_res'], n_phase2, three_compartmental)
+                return checkpoint['state'].copy(), l_res
+        if share_prefix:
+            prefix = run_prefix(delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases, flags,
+                                flags_theta, lambdas, stim_duration, fill_value, integrator, exponential_euler)
+            return branch_prefix(prefix, hour_sim, delta_t, sampling_rate, stim_duration, three_compartmental,
+                                 fill_value, traces)
+        return new_state(weights), l_res
+
+    def run_latest(state, hour_sim, l_res, running):
+        # The state before the test is written to the checkpoint file before the test is simulated, unless the file
+        # already holds a later state of the same simulation
+        if running and checkpoint_file is not None and (hour_checkpoint is None or hour_checkpoint <= hour_sim):
+            running = run(state, snapshot_step(hour_sim), hour_sim, l_res)
+            if running:
+                save_checkpoint(checkpoint_file, state.copy(), hour_sim, l_res, parameters)
+        if running:
+            run(state, sim_steps(hour_sim), hour_sim, l_res)
+
+    def results():
+        l_results = []
+        for hour_sim in hour_sims:
+            l_result = tuple(l_probes[hour_sim])
+            if recorder is not None:
+                l_result += (recorders[hour_sim][2],)
+            if reductions is not None:
+                l_result += (reducers[hour_sim][3][:, 0],)
+            if status:
+                run_status_test = run_status(l_states[hour_sim], delta_t)
+                if integrator == 'parareal':
+                    run_status_test['parareal'] = parareal_infos.get(hour_sim, [])
+                l_result += (run_status_test,)
+            l_results.append(l_result)
+        return l_results
+
+    l_probes, l_states, parareal_infos = {}, {}, {}
+    if not checkpoint_fork:
+        for hour_sim in hour_sims:
+            state, l_res = start(hour_sim)
+            if hour_sim == max(hour_sims):
+                run_latest(state, hour_sim, l_res, True)
+            else:
+                run(state, sim_steps(hour_sim), hour_sim, l_res)
+            l_probes[hour_sim], l_states[hour_sim] = l_res, state
+        return results()
+
+    hour_last = max(hour_sims)
+    state, l_res_last = start(hour_last)
+
+    # The simulation with the latest test is run and its state is held before each earlier test
+    snapshots = []
+    running = True
+    for hour_sim in sorted(set(hour_sims) - {hour_last}):
+        running = running and run(state, snapshot_step(hour_sim), hour_last, l_res_last)
+        snapshots.append((hour_sim, state.copy(), running))
+        parareal_infos[hour_sim] = list(parareal_infos.get(hour_last, []))
+    run_latest(state, hour_last, l_res_last, running)
+    l_probes[hour_last], l_states[hour_last] = l_res_last, state
+
+    # Every earlier test is simulated from its snapshot, the data until the snapshot is taken from the latest test
+    for hour_sim, state_probe, reached in snapshots:
+        l_res = allocate_data_arrays(hour_sim, delta_t, sampling_rate, stim_duration, three_compartmental, fill_value,
+                                     traces)
+        copy_data_arrays(l_res, l_res_last, l_res[1][1].shape[1], three_compartmental)
+        l_res[0][-1][0] = state_probe[idx_max_E]
+        if reached:
+            run(state_probe, sim_steps(hour_sim), hour_sim, l_res)
+        l_probes[hour_sim], l_states[hour_sim] = l_res, state_probe
+
+    return results()
+
+
+def compare_integrators(hour_sim, weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta=(1,1),
+                        delta_t_slow=20, stim_duration=15, rtol=1e-6, atol=1e-9):
+    """
+    :param hour_sim: Time of the test after the conditioning in hours
+    :param delta_t_slow: Step of the slow variables in seconds for model_qss()
+    :param rtol: Relative tolerance of model_rk()
+    :param atol: Absolute tolerance of model_rk()
+    :return: Dictionary with the run times of the integrators (compilation excluded), the maximum absolute errors of
+    model_qss() and of model_rk() (keys ending with '_rk') against model() in the rates and weights of phase 2, the rates
+    of the test and the test response of E1, and the numbers of accepted and rejected steps of model_rk()
+
+    Error report of the slow-manifold integration (model_qss() in model.py) and of the adaptive Runge-Kutta steps
+    (model_rk()) against the Euler steps of model() as the reference, for the protocol of analyze_model() with the given
+    parameters.
+    """
+    delta_t = 0.0001
+    sampling_rate = (20, 200_000)
+    stim_times = get_stim_times(hour_sim, stim_duration)
+    weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta, _ = kernel_parameters(
+        weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta)
+    sim_duration = int(int(hour_sim * 60 * 60 + (stim_duration + 10) * 2 + 2) * (1 / delta_t))
+
+    l_results, l_times, l_status = [], [], []
+    for run, kwargs in ((model, {}), (model_qss, {'delta_t_slow': delta_t_slow}),
+                        (model_rk, {'rtol': rtol, 'atol': atol})):
+        # The first run compiles the model
+        for n_steps in (int(30 * (1 / delta_t)), sim_duration):
+            l_res_rates, l_res_weights = allocate_data_arrays(hour_sim, delta_t, sampling_rate, stim_duration)
+            time_start = time.perf_counter()
+            status = run(delta_t, sampling_rate, l_res_rates, l_res_weights, n_steps, weights, back_inputs, g_stim,
+                         stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta, **kwargs)
+        l_times.append(time.perf_counter() - time_start)
+        l_results.append((l_res_rates, l_res_weights))
+        l_status.append(status)
+
+    [(r_ref, J_ref), (r_qss, J_qss), (r_rk, J_rk)] = l_results
+    idx_test = slice(int(stim_times[0][0] * (1 / (delta_t * sampling_rate[0]))),
+                     int(stim_times[0][1] * (1 / (delta_t * sampling_rate[0]))))
+    errors = {'time_reference': l_times[0], 'time_qss': l_times[1], 'time_rk': l_times[2]}
+    for suffix, r, J in (('', r_qss, J_qss), ('_rk', r_rk, J_rk)):
+        errors.update({'rates_phase2' + suffix: np.nanmax(np.abs(r[1][:6] - r_ref[1][:6])),
+                       'set_points_phase2' + suffix: np.nanmax(np.abs(r[1][6:] - r_ref[1][6:])),
+                       'weights_phase2' + suffix: np.nanmax(np.abs(J[1] - J_ref[1])),
+                       'rates_test' + suffix: np.nanmax(np.abs(r[2] - r_ref[2])),
+                       'delta_rE1' + suffix: abs(np.max(r[2][0][idx_test]) - np.max(r_ref[2][0][idx_test]))})
+    # See exit_status() in model.py
+    errors['rk_accepted'], errors['rk_rejected'] = l_status[2][4], l_status[2][5]
+
+    for key, value in errors.items():
+        print(key + ':', value)
+
+    return errors
+
+
+# Names of the outcomes of the endpoint solver (see slow_fixed_point() in model.py)
+ENDPOINT_OUTCOMES = {ENDPOINT_CONVERGED: 'converged', ENDPOINT_NONE: 'no_fixed_point',
+                     ENDPOINT_NOT_CONVERGED: 'not_converged'}
+
+
+def homeostatic_endpoint(delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases, flags,
+                         flags_theta=(1,1), stim_duration=15, tolerance=1e-10, max_iterations=2000,
+                         exponential_euler=False):
+    """
+    :param tolerance: Largest derivative of the slow variables at the fixed point, relative to their value (absolute
+    for values below 1) in 1/s
+    :param max_iterations: Maximal number of steps of the solver
+    :return: state, dictionary with the outcome ('converged', 'no_fixed_point' if the rates explode or fall silent on
+    the way to it, during the conditioning included, or 'not_converged'), the number of iterations and the residual
+    reached
+
+    Long-time limit of the plasticity after the conditioning: the protocol of analyze_model() is simulated until the end
+    of the registration window of the conditioning, then the slow variables (weights, set points and regulators) are
+    moved to the fixed point of their dynamics with the rates on their fixed point (see slow_fixed_point() in model.py).
+    The state holds the weights, set points and rates at the fixed point, e.g. to tell whether memory specificity is
+    eventually restored without simulating the days it takes.
+    """
+    weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta, _ = kernel_parameters(
+        weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta)
+    # The test is never reached, any test time later than the conditioning gives the same simulation
+    hour_sim = 1
+    stim_times = get_stim_times(hour_sim, stim_duration)
+    prefix = run_prefix(delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases, flags, flags_theta,
+                        stim_duration=stim_duration, exponential_euler=exponential_euler)
+    state, l_res = branch_prefix(prefix, hour_sim, delta_t, sampling_rate, stim_duration, traces=False)
+
+    step_seed = int((stim_times[0][1] + 5 + 2) * (1 / delta_t)) + 1
+    model_from_state(state, step_seed, delta_t, sampling_rate, l_res[0], l_res[1], weights, back_inputs, g_stim,
+                     stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta,
+                     exponential_euler=exponential_euler)
+    if state[ST_STEP] != step_seed:
+        return state, {'outcome': ENDPOINT_OUTCOMES[ENDPOINT_NONE], 'iterations': 0, 'residual': np.inf}
+
+    outcome, iterations, residual = slow_fixed_point(state, weights, back_inputs, taus, rheobases, delta_t,
+                                                     tolerance, max_iterations, exponential_euler=exponential_euler)
+    return state, {'outcome': ENDPOINT_OUTCOMES[outcome], 'iterations': iterations, 'residual': residual}
+
+
+# Names of the outcomes of the stability pre-screen (see screen_stability() in model.py)
+SCREEN_OUTCOMES = {SCREEN_STABLE: 'stable', SCREEN_EXPLODES: 'explodes', SCREEN_SILENT: 'silent',
+                   SCREEN_UNSTABLE: 'unstable'}
+
+
+def prescreen_stability(l_weights, back_inputs, g_stim, taus, rheobases, delta_t=0.0001):
+    """
+    :param l_weights: The 14 weights of every parameter set (see initial_state() in model.py), e.g. one per line of a
+    parameter file
+    :return: List with the outcome of every parameter set, 'stable' or the first of 'explodes', 'silent' (E1 is above
+    1000 or at zero at the fixed point of the rates) and 'unstable' (no stable fixed point, or an eigenvalue of the
+    Jacobian of the rate dynamics with a non-negative real part) at baseline or during the conditioning, and an array
+    (n_sets, 2) with the largest real part of the eigenvalues at both (np.nan without a stable fixed point)
+
+    Classifies the parameter sets whose rates explode or fall silent before the plasticity has changed the weights,
+    without simulating them (see screen_stability() in model.py), e.g. to leave them out of a sweep. A
+    stable set can still explode or fall silent later on, as the plasticity changes the weights.
+    """
+    weights = np.array(l_weights, dtype=np.float64).reshape(-1, 14)
+    back_inputs, taus, rheobases = (tuple(float(value) for value in values) for values in (back_inputs, taus, rheobases))
+    g_stim = tuple(np.asarray(g_stim_X, dtype=np.float64) for g_stim_X in g_stim)
+
+    outcomes, rates, jacobians = screen_stability(weights, back_inputs, g_stim, taus, rheobases, delta_t)
+    # The eigenvalues of all the Jacobians at once
+    abscissas = np.max(np.linalg.eigvals(jacobians).real, axis=-1)
+    abscissas[outcomes == SCREEN_UNSTABLE] = np.nan
+    outcomes[(outcomes == SCREEN_STABLE) & (abscissas >= 0)] = SCREEN_UNSTABLE
+
+    l_outcomes = []
+    for outcome_baseline, outcome_stimulus in outcomes:
+        outcome = outcome_baseline if outcome_baseline != SCREEN_STABLE else outcome_stimulus
+        l_outcomes.append(SCREEN_OUTCOMES[outcome])
+    return l_outcomes, abscissas
+
+
+# Names of the 14 weights of model() in their order (see initial_state() in model.py) and of the six populations
+WEIGHT_NAMES = ('w_EE_within', 'w_EP_within', 'w_ES_within', 'w_PE_within', 'w_PP_within', 'w_PS_within',
+                'w_SE_within', 'w_EE_cross', 'w_EP_cross', 'w_ES_cross', 'w_PE_cross', 'w_PP_cross', 'w_PS_cross',
+                'w_SE_cross')
+POPULATION_NAMES = ('E1', 'E2', 'P1', 'P2', 'S1', 'S2')
+
+
+def branch_point(weights, i_x, x, back_inputs, stimulus, taus, rheobases, r):
+    """
+    :return: Whether the branch of fixed points followed from the rates r has a fixed point at weight i_x = x, its
+    rates and its Jacobian (see fixed_point_path() in model.py), the largest real part of the eigenvalues of the
+    Jacobian and whether the eigenvalue with the largest real part is complex
+    """
+    weights_point = np.array(weights, dtype=np.float64).reshape(1, 14)
+    weights_point[0, i_x] = x
+    found, rates, jacobians = fixed_point_path(weights_point, back_inputs, stimulus, taus, rheobases, r)
+    eigenvalues = np.linalg.eigvals(jacobians[0])
+    i_max = np.argmax(eigenvalues.real)
+    return found[0], rates[0], jacobians[0], eigenvalues[i_max].real, eigenvalues[i_max].imag != 0
+
+
+def branch_boundaries(point_a, point_b):
+    """
+    :param point_a: (found, rates, abscissa, complex) of a point on one side of the boundary (see branch_point())
+    :return: List of the boundaries between two points closer than the tolerance of trace_fixed_points(), each a tuple
+    (kind, populations), see trace_fixed_points()
+    """
+    found_a, r_a, abscissa_a, complex_a = point_a
+    found_b, r_b, abscissa_b, complex_b = point_b
+    if found_a != found_b:
+        return [('fold', ())]
+
+    boundaries = []
+    # The rates jump where the branch turns back and the fixed point found is the one of another branch
+    jump = np.max(np.abs(r_a - r_b)) > 1e-2 * (1 + max(np.max(np.abs(r_a)), np.max(np.abs(r_b))))
+    active_a, active_b = r_a > 0, r_b > 0
+    if jump:
+        boundaries.append(('fold', ()))
+    elif np.any(active_a != active_b):
+        boundaries.append(('border', tuple(name for name, a, b in zip(POPULATION_NAMES, active_a, active_b)
+                                           if a != b)))
+    if not jump and (abscissa_a >= 0) != (abscissa_b >= 0):
+        complex_unstable = complex_a if abscissa_a >= 0 else complex_b
+        boundaries.append(('hopf' if complex_unstable else 'fold', ()))
+    if (r_a[0] > 1000) != (r_b[0] > 1000):
+        boundaries.append(('explosion', ()))
+    return boundaries
+
+
+def trace_fixed_points(weights, weight_x, values_x, back_inputs, g_stim, taus, rheobases, stimulated=False,
+                       tolerance=1e-6):
+    """
+    :param weights: The 14 weights of model() (see initial_state() in model.py), of which weight_x is varied
+    :param weight_x: Name of the weight varied (see WEIGHT_NAMES), e.g. 'w_EP_within'
+    :param values_x: Values of weight_x the fixed point is followed along, e.g. np.linspace(0.1, 1.5, 29). The
+    boundaries are located between them, two boundaries between the same two values can be missed if their changes
+    cancel out (e.g. a population switching off and on again)
+    :param stimulated: True for the fixed point during the conditioning stimulus, which is followed from the baseline
+    fixed point of the first value, False for the baseline
+    :param tolerance: Width of weight_x within which the boundaries are located
+    :return: Dictionary with, for every value of values_x, whether the branch has a fixed point ('found'), its rates
+    ('rates', np.nan where there is none) and the largest real part of the eigenvalues of the Jacobian there
+    ('abscissas'), and the boundaries along the path ('boundaries'), a list of tuples (value of weight_x, kind,
+    populations)
+
+    Numerical continuation of the fixed point of the rate dynamics: the fixed point reached from the initial rates at
+    the first value is followed along weight_x (see fixed_point_path() in model.py), and where its existence, its
+    active populations or its stability change between two values, the boundary is located by bisection. The kinds of
+    boundaries are 'fold' (a real eigenvalue crosses zero, where the rates diverge or the branch turns back and the
+    fixed point jumps to another branch, or the branch ends), 'hopf' (a pair of complex eigenvalues crosses the
+    imaginary axis, the rates start to oscillate), 'border' (the populations switch on or off, e.g. ('E1', 'E2') where
+    the E populations fall silent) and 'explosion' (the rate of E1 crosses 1000 at the fixed point, where the
+    simulation stops). Only the branch followed is tracked, with several stable fixed points (e.g. a silent and an
+    active one) the path in the other direction can follow another one. The boundaries of a region of two weights are
+    traced by trace_boundaries().
+    """
+    i_x = WEIGHT_NAMES.index(weight_x)
+    weights, back_inputs, g_stim, taus, _, rheobases, _, _, _ = kernel_parameters(weights, back_inputs, g_stim, taus,
+                                                                                   0, rheobases)
+    (g_stim_E, g_stim_P, g_stim_S) = g_stim
+    stimulus = np.zeros(6)
+    r = initial_state(weights)[ST_E1:ST_S2 + 1].copy()
+    if stimulated:
+        found, r_baseline, _, _, _ = branch_point(weights, i_x, values_x[0], back_inputs, stimulus, taus, rheobases, r)
+        if found:
+            r = r_baseline
+        stimulus = np.concatenate((g_stim_E[0], g_stim_P[0], g_stim_S[0]))
+
+    def key(point):
+        found, r_point, abscissa, _ = point
+        return found, tuple(r_point > 0), abscissa >= 0, r_point[0] > 1000
+
+    l_found, l_rates, l_abscissas, boundaries = [], [], [], []
+    point_a = None
+    for x in values_x:
+        found, r_x, _, abscissa, complex_x = branch_point(weights, i_x, x, back_inputs, stimulus, taus, rheobases, r)
+        point_b = (found, r_x, abscissa, complex_x)
+        if point_a is not None:
+            # The boundaries between the two values are located one after the other, each by bisection
+            x_a, r_a = x_previous, r
+            while key(point_a) != key(point_b):
+                x_low, point_low, x_high, point_high = x_a, point_a, x, point_b
+                while abs(x_high - x_low) > tolerance:
+                    x_mid = 0.5 * (x_low + x_high)
+                    found_mid, r_mid, _, abscissa_mid, complex_mid = branch_point(weights, i_x, x_mid, back_inputs,
+                                                                                  stimulus, taus, rheobases, r_a)
+                    point_mid = (found_mid, r_mid, abscissa_mid, complex_mid)
+                    if key(point_mid) != key(point_low):
+                        x_high, point_high = x_mid, point_mid
+                    else:
+                        x_low, point_low = x_mid, point_mid
+                        if found_mid:
+                            r_a = r_mid
+                boundaries.extend((float(0.5 * (x_low + x_high)), kind, populations)
+                                  for kind, populations in branch_boundaries(point_low, point_high))
+                # The rest of the interval is followed from the far side of the boundary
+                x_a, point_a = x_high, point_high
+                if point_high[0]:
+                    r_a = point_high[1]
+                if x_a == x:
+                    break
+        if found:
+            r = r_x
+        x_previous, point_a = x, point_b
+
+        l_found.append(found)
+        l_rates.append(r_x if found else np.full(6, np.nan))
+        l_abscissas.append(abscissa if found else np.nan)
+
+    return {'found': np.array(l_found), 'rates': np.array(l_rates), 'abscissas': np.array(l_abscissas),
+            'boundaries': boundaries}
+
+
+def trace_boundaries(weights, weight_x, values_x, weight_y, values_y, back_inputs, g_stim, taus, rheobases,
+                     stimulated=False, tolerance=1e-6):
+    """
+    :param weight_y: Name of the second weight (see WEIGHT_NAMES), e.g. 'w_ES_within', values_y its values
+    :return: List of the boundaries (value of weight_x, value of weight_y, kind, populations) of the fixed point of the
+    rate dynamics in the plane of the two weights, see trace_fixed_points()
+
+    The fixed point is followed along weight_x for every value of weight_y, thus the boundaries of the regions (e.g.
+    of stable and silent fixed points) are located within tolerance in weight_x with len(values_x) * len(values_y)
+    points and a bisection per crossing, instead of a grid dense enough to resolve them.
+    """
+    i_y = WEIGHT_NAMES.index(weight_y)
+    weights = list(weights)
+    boundaries = []
+    for y in values_y:
+        weights[i_y] = y
+        path = trace_fixed_points(weights, weight_x, values_x, back_inputs, g_stim, taus, rheobases,
+                                  stimulated=stimulated, tolerance=tolerance)
+        boundaries.extend((x, float(y), kind, populations) for x, kind, populations in path['boundaries'])
+    return boundaries
+
+
+def run_threads(function, l_kwargs, n_threads=None, **kwargs):
+    """
+    :param function: Simulation to run, e.g. run_test_probes or aversion_threshold
+    :param l_kwargs: List of the keyword arguments of every run, e.g. [{'weights': weights} for weights in l_weights]
+    :param n_threads: Number of runs at once, None for the number of cores
+    :param kwargs: Keyword arguments shared by all the runs, e.g. hour_sims=[1], delta_t=0.0001
+    :return: List of the results of the runs in the order of l_kwargs
+
+    Runs the simulations concurrently in the threads of this process, e.g. in a notebook. The kernels of model.py
+    release the GIL (nogil) while they run, so the runs are simulated in parallel on the cores while they share the
+    imported modules, the compiled kernels, the prefixes (see run_prefix()) and the input arrays, and the results are
+    returned as they are instead of being pickled back from other processes (see sweep_scheduler.py). Only the Python
+    code between the kernel calls holds the GIL. A kernel not compiled yet is compiled once by the first run needing
+    it, the others wait for it (see warm_up()). The runs must not write to the same checkpoint file, and they must not
+    plot, as matplotlib is not thread-safe. The kernels with parallel=True (model_batch()) are not to be run from
+    several threads at once.
+    """
+    with ThreadPoolExecutor(max_workers=n_threads or os.cpu_count()) as executor:
+        futures = [executor.submit(function, **{**kwargs, **run_kwargs}) for run_kwargs in l_kwargs]
+        return [future.result() for future in futures]
+
+
+def warm_up(three_compartmental=False):
+    """
+    :param three_compartmental: True to also compile model_3_compartmental_v3()
+
+    Compiles the numba kernels of the drivers by simulating a test 36 seconds after the conditioning. The arguments of
+    the kernels are converted to the same types for every call (see kernel_parameters()), so this covers every later
+    simulation with the Euler steps. The compiled kernels are cached on disk next to model.py (cache=True), thus
+    only the first process after a change of model.py pays for the compilation, the later ones load it.
+    """
+    delta_t = 0.0001
+    sampling_rate = (20, 200000)
+    g_stim = (np.array([(1, 0), (0, 1)]), np.array([(0.5, 0), (0, 0.5)]), np.array([(0, 0), (0, 0)]))
+    weights = (0.51, 0.91, 0.51, 0.3, 0.2, 0.95, 0.1, 0.51, 0.41, 0.31, 0.1, 0.1, 0.1, 0.1)
+    taus = (0.02, 0.005, 0.01, 240, 8 * (60 * 60), 8 * (60 * 60), 8 * (60 * 60), 24 * (60 * 60), 28 * (60 * 60))
+    back_inputs, rheobases, K = (4.5, 3.2, 3), (1.5, 1.5, 1.5), 0.25
+    for fill_value in (0, np.nan):
+        aversion_threshold(0.01, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases,
+                           fill_value=fill_value, closed_form=False)
+        aversion_threshold(0.01, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases,
+                           fill_value=fill_value)
+        run_test_probes([0.01], delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases,
+                        (1, 1, 1, 1, 1, 1), fill_value=fill_value)
+
+    if three_compartmental:
+        g_stim = (np.array([(1, 0), (0, 1)]), np.array([(0.5, 0), (0, 0.5)]), np.array([(0, 0), (0, 0)]))
+        weights = (0.5, 0.5, 0.6, 0.4, 0.35, 0.2, 0.3, 0.15, 0.3, 0.3, 0.18, 0.18, 0.1, 0.1, 0.1, 0.1)
+        taus = (0.02, 0.005, 0.01, 0.02, 120, 2.5 * (60 * 60), 6.5 * (60 * 60), 2.5 * (60 * 60), 24 * (60 * 60),
+                28 * (60 * 60))
+        back_inputs, rheobases, lambdas = (4, 6, 0, 4, 3.2), (1, 1.5, 1.5, 3, 9), (0.4, 0.3)
+        aversion_threshold(0.01, delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases,
+                           lambdas=lambdas)
+        run_test_probes([0.01], delta_t, sampling_rate, weights, back_inputs, g_stim, taus, K, rheobases,
+                        (1, 1, 1, 1, 1, 1), lambdas=lambdas)
@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import resource
+import argparse
+import traceback
+import subprocess
+import importlib.util
+import multiprocessing
+import multiprocessing.connection
+from collections import deque
+
+# Runs every line of a parameter file with parameter_exploration.py, as many at once as the cores and the memory allow.
+# Usage: python sweep_scheduler.py param_total_plastic.txt [--n_workers 32] [--memory_budget 100000] [--warm]
+# [--prescreen [--prescreen_skip explodes silent]]
+
+
+def parse_arguments(parameter):
+    """
+    :param parameter: Line of a parameter file, values separated by commas
+    :return: List of the values, 'true'/'false' as bool, then int, then float
+    """
+    parsed_arguments = []
+    parameter_values = parameter.split(',')
+
+    for parsed_parameter in parameter_values:
+        parsed_parameter = parsed_parameter.strip()
+
+        if parsed_parameter.lower() == 'true':
+            parsed_value = True
+        elif parsed_parameter.lower() == 'false':
+            parsed_value = False
+        else:
+            try:
+                parsed_value = int(parsed_parameter)
+            except ValueError:
+                try:
+                    parsed_value = float(parsed_parameter)
+                except ValueError:
+                    raise ValueError(f"Invalid parameter value: {parsed_parameter}")
+
+        parsed_arguments.append(parsed_value)
+
+    return parsed_arguments
+
+
+def read_parameter_file(parameter_file):
+    """
+    :return: The lines of the parameter file to run, without the empty lines and the comments starting with #
+    """
+    parameters = []
+    with open(parameter_file) as file:
+        for i_line, line in enumerate(file):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                parse_arguments(line)
+            except ValueError as error:
+                raise ValueError(f"{parameter_file}, line {i_line + 1}: {error}")
+            parameters.append(line)
+    return parameters
+
+
+def available_memory():
+    """
+    :return: Memory available for new processes in megabytes (MemAvailable of /proc/meminfo), None if unknown
+    """
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+class SweepScheduler:
+    """
+    Keeps up to n_workers simulations running. A new one is only started if the memory of the running ones, estimated
+    with the largest peak RSS measured so far, leaves room for it within memory_budget, thus the sweep slows down
+    instead of swapping when the simulations get larger.
+    """
+
+    def __init__(self, parameters, script, n_workers, memory_budget, rss_estimate=2000, niceness=10,
+                 report_interval=60, log=sys.stdout):
+        """
+        :param parameters: Lines of the parameter file to run (see read_parameter_file())
+        :param script: Python script run with one line as its argument
+        :param n_workers: Maximal number of simulations at once
+        :param memory_budget: Memory in megabytes the simulations may use together, None for no limit
+        :param rss_estimate: Memory in megabytes assumed for a simulation until the first one has finished
+        :param niceness: Added to the niceness of the simulations, as `nice` in the shell
+        :param report_interval: Seconds between the progress reports
+        """
+        self.queue = deque(parameters)
+        self.n_jobs = len(parameters)
+        self.script = script
+        self.n_workers = n_workers
+        self.memory_budget = memory_budget
+        self.rss_estimate = rss_estimate
+        self.niceness = niceness
+        self.report_interval = report_interval
+        self.log = log
+
+        self.running = {}  # pid -> (process, parameter, start time)
+        self.n_done, self.failed = 0, []
+        self.rss_peak, self.rss_total = 0, 0
+        self.time_start = self.time_report = None
+
+    def can_start(self):
+        if not self.queue or len(self.running) >= self.n_workers:
+            return False
+        if not self.running or self.memory_budget is None:
+            return True
+        rss_job = self.rss_peak if self.n_done > 0 else self.rss_estimate
+        return (len(self.running) + 1) * rss_job <= self.memory_budget
+
+    def start(self, parameter):
+        process = subprocess.Popen([sys.executable, self.script, parameter],
+                                   preexec_fn=lambda: os.nice(self.niceness))
+        self.running[process.pid] = (process, parameter, time.time())
+
+    def wait(self):
+        # os.wait4 gives the resource usage of the finished simulation alone, ru_maxrss in kilobytes on Linux
+        pid, status, rusage = os.wait4(-1, 0)
+        if pid not in self.running:
+            return
+        process, parameter, time_started = self.running.pop(pid)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        rss = rusage.ru_maxrss / 1024
+        self.rss_peak = max(self.rss_peak, rss)
+        self.rss_total += rss
+        self.n_done += 1
+        if process.returncode != 0:
+            self.failed.append(parameter)
+            print(f"Failed ({process.returncode}) after {time.time() - time_started:.0f} s: {parameter}",
+                  file=self.log, flush=True)
+
+    def report(self, final=False):
+        time_elapsed = time.time() - self.time_start
+        throughput = self.n_done / time_elapsed * 3600 if time_elapsed > 0 else 0
+        n_left = self.n_jobs - self.n_done
+        eta = f", {n_left / throughput:.1f} h left" if throughput > 0 and not final else ""
+        rss_mean = self.rss_total / self.n_done if self.n_done else 0
+        print(f"{'Finished' if final else 'Progress'}: {self.n_done}/{self.n_jobs} done, {len(self.failed)} failed, "
+              f"{len(self.running)} running, {throughput:.1f} jobs/h{eta}, "
+              f"RSS {rss_mean:.0f} MB mean, {self.rss_peak:.0f} MB peak", file=self.log, flush=True)
+        self.time_report = time.time()
+
+    def run(self):
+        """
+        :return: The lines of the parameter file whose simulation failed
+        """
+        self.time_start = self.time_report = time.time()
+        while self.queue or self.running:
+            while self.can_start():
+                self.start(self.queue.popleft())
+            self.wait()
+            if time.time() - self.time_report >= self.report_interval:
+                self.report()
+        self.report(final=True)
+        return self.failed
+
+
+def warm_worker(script, niceness, connection):
+    """
+    :param connection: End of the pipe to the scheduler, see WarmSweepScheduler
+
+    Long-lived process of WarmSweepScheduler: imports the script once, without running its __main__ part, and
+    compiles the kernels with its warm_up() if it has one (see warm_up() in model_analysis.py). Then runs the lines
+    it receives with the parse_parameter() of the script until it receives None.
+    """
+    os.nice(niceness)
+    spec = importlib.util.spec_from_file_location('sweep_job', script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if hasattr(module, 'warm_up'):
+        module.warm_up()
+    connection.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+    while True:
+        parameter = connection.recv()
+        if parameter is None:
+            return
+        try:
+            module.parse_parameter(parameter)
+            success = True
+        except Exception:
+            traceback.print_exc()
+            success = False
+        sys.stdout.flush()
+        connection.send((success, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def prescreen_worker(script, parameters):
+    """
+    :return: The outcome of every line with the prescreen() of the script, None if it has none
+    """
+    spec = importlib.util.spec_from_file_location('sweep_job', script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not hasattr(module, 'prescreen'):
+        return None
+    return module.prescreen(parameters)
+
+
+def prescreen_parameters(script, parameters, skip=('explodes',)):
+    """
+    :param skip: Outcomes whose lines are not run. Only 'explodes' by default: the simulations of 'silent' and
+    'unstable' lines run to the end, where synaptic scaling can still raise a silent E population
+    :return: The lines of parameters to run and the lines screened as anything but 'stable', each with its outcome
+    (see prescreen_stability() in simulation.py) and whether it is skipped
+
+    Screens the lines with the prescreen() of the script, e.g. for the weights whose rates explode before the
+    plasticity acts, which are then not simulated. The script is imported in a process of its own, as warm_worker()
+    does, so that its imports (e.g. the os.chdir() of parameter_exploration.py) leave the scheduler unchanged. Every
+    line is run if the script has no prescreen().
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        outcomes = pool.apply(prescreen_worker, (script, parameters))
+    if outcomes is None:
+        return parameters, []
+
+    kept = [parameter for parameter, outcome in zip(parameters, outcomes) if outcome not in skip]
+    screened = [(parameter, outcome, outcome in skip) for parameter, outcome in zip(parameters, outcomes)
+                if outcome != 'stable']
+    return kept, screened
+
+
+class WarmSweepScheduler(SweepScheduler):
+    """
+    Runs the simulations in long-lived processes (see warm_worker()) instead of a new Python process for every one,
+    thus the imports and the compilation of the kernels are paid once per worker instead of once per simulation. There
+    are as many workers as memory_budget allows with rss_estimate per worker, at most n_workers. A worker keeps the
+    memory of its largest simulation, so once the peak RSS of all the workers exceeds memory_budget, a worker is
+    retired after its simulation.
+    """
+
+    def start_worker(self):
+        connection, connection_worker = self.context.Pipe()
+        worker = self.context.Process(target=warm_worker, args=(self.script, self.niceness, connection_worker),
+                                      daemon=True)
+        worker.start()
+        # Closed here, thus the pipe reports the end of the worker
+        connection_worker.close()
+        self.workers[connection] = {'process': worker, 'parameter': None, 'rss': self.rss_estimate, 'ready': False}
+
+    def stop_worker(self, connection, retire=True):
+        worker = self.workers.pop(connection)
+        if retire:
+            connection.send(None)
+        worker['process'].join()
+        connection.close()
+
+    def next_task(self, connection):
+        # Either the next simulation for the worker, or its retirement if the workers exceed the memory budget
+        worker = self.workers[connection]
+        rss_workers = sum(worker_other['rss'] for worker_other in self.workers.values())
+        if not self.queue or (self.memory_budget is not None and len(self.workers) > 1
+                              and rss_workers > self.memory_budget):
+            self.stop_worker(connection)
+            return
+        worker['parameter'] = self.queue.popleft()
+        self.running[connection] = (worker['process'], worker['parameter'], time.time())
+        connection.send(worker['parameter'])
+
+    def finish(self, connection, success):
+        process, parameter, time_started = self.running.pop(connection)
+        worker = self.workers[connection]
+        worker['parameter'] = None
+        self.rss_peak = max(self.rss_peak, worker['rss'])
+        self.rss_total += worker['rss']
+        self.n_done += 1
+        if not success:
+            self.failed.append(parameter)
+            print(f"Failed after {time.time() - time_started:.0f} s: {parameter}", file=self.log, flush=True)
+
+    def run(self):
+        """
+        :return: The lines of the parameter file whose simulation failed
+        """
+        self.time_start = self.time_report = time.time()
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = {}
+
+        n_workers = min(self.n_workers, len(self.queue))
+        if self.memory_budget is not None:
+            n_workers = max(1, min(n_workers, int(self.memory_budget // self.rss_estimate)))
+        for _ in range(n_workers):
+            self.start_worker()
+
+        while self.workers:
+            for connection in multiprocessing.connection.wait(list(self.workers), timeout=self.report_interval):
+                worker = self.workers[connection]
+                try:
+                    message = connection.recv()
+                except EOFError:
+                    # The worker died, e.g. killed for its memory, and is replaced
+                    if not worker['ready']:
+                        raise RuntimeError(f"The worker failed to start {self.script} "
+                                           f"(exit code {worker['process'].exitcode})")
+                    if worker['parameter'] is not None:
+                        self.finish(connection, False)
+                    self.stop_worker(connection, retire=False)
+                    if self.queue:
+                        self.start_worker()
+                    continue
+
+                if not worker['ready']:
+                    worker['ready'], worker['rss'] = True, message
+                else:
+                    success, worker['rss'] = message
+                    self.finish(connection, success)
+                self.next_task(connection)
+
+            if time.time() - self.time_report >= self.report_interval:
+                self.report()
+
+        self.report(final=True)
+        return self.failed
+
+
+if __name__ == '__main__':
+    directory = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Runs parameter_exploration.py for every line of a parameter file')
+    parser.add_argument('parameter_file')
+    parser.add_argument('--script', default=os.path.join(directory, 'parameter_exploration.py'))
+    parser.add_argument('--n_workers', type=int, default=os.cpu_count(), help='default: number of cores')
+    parser.add_argument('--memory_budget', type=float, default=None,
+                        help='megabytes for all the simulations, default: 90%% of the available memory')
+    parser.add_argument('--rss_estimate', type=float, default=2000,
+                        help='megabytes per simulation until the first one has finished')
+    parser.add_argument('--report_interval', type=float, default=60, help='seconds')
+    parser.add_argument('--failed_file', default=None, help='file to write the lines of the failed simulations to')
+    parser.add_argument('--warm', action='store_true',
+                        help='run the simulations in long-lived workers that import and compile once')
+    parser.add_argument('--prescreen', action='store_true',
+                        help='skip the lines whose rates explode before the plasticity acts')
+    parser.add_argument('--prescreen_skip', nargs='+', default=['explodes'],
+                        choices=['explodes', 'silent', 'unstable'],
+                        help='outcomes of --prescreen whose lines are skipped, default: explodes')
+    parser.add_argument('--skipped_file', default=None,
+                        help='file to write the lines --prescreen found not stable to, each with its outcome and '
+                             'whether it was skipped')
+    args = parser.parse_args()
+
+    memory_budget = args.memory_budget
+    if memory_budget is None and available_memory() is not None:
+        memory_budget = 0.9 * available_memory()
+
+    parameters = read_parameter_file(args.parameter_file)
+    if args.prescreen:
+        n_parameters = len(parameters)
+        parameters, screened = prescreen_parameters(args.script, parameters, skip=tuple(args.prescreen_skip))
+        print(f"Prescreen: {n_parameters - len(parameters)} of {n_parameters} lines skipped, "
+              f"{len(screened) - n_parameters + len(parameters)} not stable but run")
+        if args.skipped_file is not None:
+            with open(args.skipped_file, 'w') as file:
+                file.writelines(parameter + ' # ' + outcome + (' skipped' if skipped else ' run') + '\n'
+                                for parameter, outcome, skipped in screened)
+    scheduler = (WarmSweepScheduler if args.warm else SweepScheduler)(
+        parameters, args.script, args.n_workers, memory_budget, args.rss_estimate,
+        report_interval=args.report_interval)
+    failed = scheduler.run()
+    if args.failed_file is not None:
+        with open(args.failed_file, 'w') as file:
+            file.writelines(parameter + '\n' for parameter in failed)
+    sys.exit(1 if failed else 0)
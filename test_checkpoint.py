@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+from simulation import *
+
+# Parameters of analyze_model() with the full model
+PARAMETERS = (0.0001, (20, 200000), (0.55, 0.91, 0.51, 0.3, 0.2, 0.3, 0.4, 0.51, 0.41, 0.31, 0.1, 0.1, 0.1, 0.1),
+              (4.5, 3.2, 3), (np.array([(1, 0), (0, 1)]), np.array([(0.5, 0), (0, 0.5)]), np.array([(0, 0), (0, 0)])),
+              (0.02, 0.005, 0.01, 240, 8 * 3600, 8 * 3600, 8 * 3600, 24 * 3600, 28 * 3600), 0.25, (1.5, 1.5, 1.5),
+              (1, 1, 1, 1, 1, 1))
+
+
+# The test time of the checkpoint is on the sampling of phase 2 (1/60 h) or off it (0.0125 h, the arrays of the
+# checkpoint are too short for the samples before its snapshot)
+@pytest.mark.parametrize('hour_checkpoint', [1 / 60, 0.0125])
+def test_resume_equals_run_from_start(tmp_path, hour_checkpoint):
+    checkpoint_file = str(tmp_path / 'checkpoint.pkl')
+    run_test_probes([hour_checkpoint], *PARAMETERS, fill_value=np.nan, checkpoint_file=checkpoint_file,
+                    share_prefix=False)
+    (l_res_rates, l_res_weights), = run_test_probes([0.05], *PARAMETERS, fill_value=np.nan,
+                                                    checkpoint_file=checkpoint_file, share_prefix=False)
+    (l_res_rates_0, l_res_weights_0), = run_test_probes([0.05], *PARAMETERS, fill_value=np.nan, share_prefix=False)
+
+    for res, res_0 in zip(l_res_rates + l_res_weights, l_res_rates_0 + l_res_weights_0):
+        np.testing.assert_array_equal(res, res_0)
@@ -0,0 +1,46 @@
+import numpy as np
+from simulation import *
+
+# Parameters of analyze_model() with the full model
+PARAMETERS = (0.0001, (20, 200000), (0.55, 0.91, 0.51, 0.3, 0.2, 0.3, 0.4, 0.51, 0.41, 0.31, 0.1, 0.1, 0.1, 0.1),
+              (4.5, 3.2, 3), (np.array([(1, 0), (0, 1)]), np.array([(0.5, 0), (0, 0.5)]), np.array([(0, 0), (0, 0)])),
+              (0.02, 0.005, 0.01, 240, 8 * 3600, 8 * 3600, 8 * 3600, 24 * 3600, 28 * 3600), 0.25, (1.5, 1.5, 1.5),
+              (1, 1, 1, 1, 1, 1))
+
+
+def test_status_reports_rk_steps():
+    (_, _, status), = run_test_probes([0.05], *PARAMETERS, integrator='rk', status=True)
+    assert status['exit_reason'] == 'step_stop'
+    assert status['rk_accepted'] > 0
+
+    (_, _, status), = run_test_probes([0.05], *PARAMETERS, status=True)
+    assert status['rk_accepted'] == status['rk_rejected'] == 0
+
+
+# The steps rejected in windows of 2 seconds around the onsets and offsets of the stimuli and in a window of phase 2
+# without any. The data of phases 1 and 3 is registered every 20 seconds, as the registrations every 2 milliseconds of
+# the protocol would bound the step size around the stimuli.
+def test_rk_rejects_steps_around_stimuli():
+    delta_t, _, *parameters = PARAMETERS
+    sampling_rate = (200000, 200000)
+    weights, g, g_stim, taus, K, rheobases, flags, flags_theta, _ = kernel_parameters(*parameters)
+    stim_times = get_stim_times(0.05)
+    (stim_steps, phase_steps) = event_steps(delta_t, stim_times)
+    l_res_rates, l_res_weights = allocate_data_arrays(0.05, delta_t, sampling_rate)
+    state = initial_state(weights)
+
+    def rejected(step_start, step_stop):
+        model_rk_from_state(state, step_start, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g, g_stim,
+                            stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta)
+        n_rejected = state[ST_RK_REJECTED]
+        model_rk_from_state(state, step_stop, delta_t, sampling_rate, l_res_rates, l_res_weights, weights, g, g_stim,
+                            stim_times, taus, K, rheobases, flags=flags, flags_theta=flags_theta)
+        return state[ST_RK_REJECTED] - n_rejected
+
+    window = int(1 / delta_t)
+    n_onset = rejected(stim_steps[0, 0] - window, stim_steps[0, 0] + window)
+    n_offset = rejected(stim_steps[0, 1] - window, stim_steps[0, 1] + window)
+    n_quiet = rejected(phase_steps[1] + 20 * window, phase_steps[1] + 22 * window)
+    n_test = rejected(stim_steps[1, 0] - window, stim_steps[1, 0] + window)
+
+    assert n_onset > n_quiet and n_offset > n_quiet and n_test > n_quiet
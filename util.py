@@ -5,41 +5,7 @@ from matplotlib import cm as colmaps
 import matplotlib.colors as mcolors
 from matplotlib.legend_handler import HandlerTuple
 import seaborn as sns
-
-
-def determine_name(flags):
-    (hebbian_flag, three_factor_flag, adaptive_threshold_flag,
-     E_scaling_flag, P_scaling_flag, S_scaling_flag) = flags
-
-    if flags == (0,0,0,0,0,0):
-        return "0", "No plasticity"
-
-    elif flags == (1,1,1,1,1,1):
-        return "1", "Full model"
-
-    elif flags == (1,1,1,0,1,1):
-        return "2", "E off (P+S)"
-
-    elif flags == (1,1,1,1,0,1):
-        return "3", "P off (E+S)"
-
-    elif flags == (1,1,1,1,1,0):
-        return "4", "S off (E+P)"
-
-    elif flags == (1,1,1,1,0,0):
-        return "5", "only E on"
-
-    elif flags == (1,1,1,0,1,0):
-        return "6", "only P on"
-
-    elif flags == (1,1,1,0,0,1):
-        return "7", "only S on"
-
-    elif flags == (1,1,1,0,0,0):
-        return "8", "No scaling"
-    elif flags == (1,1,0,1,1,1):
-        return "9", "No beta active - full model"
-
+from simulation import determine_name
 
 
 def find_baseline_reactivation(rE1_conditioning):
@@ -0,0 +1,7 @@
+import sys
+from model_analysis import warm_up
+
+# Compiles the numba kernels into the cache next to model.py (__pycache__), e.g. before starting a sweep or opening the
+# notebooks after a change of model.py. Usage: python warm_up.py [--three_compartmental]
+if __name__ == '__main__':
+    warm_up(three_compartmental='--three_compartmental' in sys.argv)